@@ -1,187 +1,3173 @@
-from flask import Flask, request, jsonify, render_template
-import sqlite3
+from flask import Flask, Response, request, jsonify, render_template, send_file, stream_with_context
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+import array
+import base64
+import collections
+import concurrent.futures
+import contextlib
+import csv
 import datetime
+import functools
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import logging
+import math
+import os
+import queue
+import re
+import secrets
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:  # brotli é opcional; sem ele respondemos só com gzip
+    brotli = None
+
+# --- MÉTRICAS E INSTRUMENTAÇÃO ---
+
+# MANUTENCAO_METRICAS=0 desliga a coleta: as funções ficam sem invólucro e, se o log de SQL lento
+# também estiver desligado, as conexões usam o cursor padrão do sqlite3.
+METRICAS_ATIVAS = os.environ.get('MANUTENCAO_METRICAS', '1') != '0'
+# Consultas mais demoradas que este limite (em ms) vão para o logger 'manutencao.sql'. Vazio = desligado.
+SQL_LENTO_MS = float(os.environ['MANUTENCAO_SQL_LENTO_MS']) if os.environ.get('MANUTENCAO_SQL_LENTO_MS') else None
+
+BALDES_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+log_sql = logging.getLogger('manutencao.sql')
+log_escrita = logging.getLogger('manutencao.escrita')
+
+
+class Histograma:
+    """Histograma cumulativo no formato do Prometheus (baldes, soma e contagem)."""
+
+    def __init__(self, baldes=BALDES_LATENCIA):
+        self.baldes = baldes
+        self.contagens = [0] * len(baldes)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.baldes):
+            if valor <= limite:
+                self.contagens[i] += 1
+                break
+        self.soma += valor
+        self.total += 1
+
+    def linhas(self, nome, rotulos):
+        acumulado = 0
+        for limite, contagem in zip(self.baldes, self.contagens):
+            acumulado += contagem
+            yield f"{nome}_bucket{_rotulos(rotulos, le=repr(limite))} {acumulado}"
+        yield f"{nome}_bucket{_rotulos(rotulos, le='+Inf')} {self.total}"
+        yield f"{nome}_sum{_rotulos(rotulos)} {self.soma!r}"
+        yield f"{nome}_count{_rotulos(rotulos)} {self.total}"
+
+
+def _rotulos(rotulos, **extras):
+    pares = list(rotulos) + list(extras.items())
+    if not pares:
+        return ''
+    texto = ','.join(
+        '{}="{}"'.format(nome, str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for nome, valor in pares
+    )
+    return '{' + texto + '}'
+
+
+class Metricas:
+    """
+    Acumula as métricas da aplicação: latência e status por rota, e consultas,
+    linhas e tempo de SQL versus Python por função de acesso a dados.
+    O tempo de SQL de cada thread fica num contador próprio, de modo que uma função
+    instrumentada sabe quanto do seu tempo foi gasto dentro do SQLite.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.requisicoes = {}  # (rota, metodo) -> Histograma
+        self.respostas = collections.Counter()  # (rota, metodo, status) -> quantidade
+        self.funcoes = {}  # nome -> {'chamadas', 'erros', 'consultas', 'linhas', 'sql_s', 'python_s'}
+        self.sql = Histograma()
+        self.sql_linhas = 0
+        self.sql_lentas = 0
+
+    def _acumulado_thread(self):
+        local = self._local
+        if not hasattr(local, 'sql_s'):
+            local.sql_s = 0.0
+            local.consultas = 0
+            local.linhas = 0
+        return local
+
+    def registrar_requisicao(self, rota, metodo, status, duracao):
+        with self._lock:
+            histograma = self.requisicoes.get((rota, metodo))
+            if histograma is None:
+                histograma = self.requisicoes[(rota, metodo)] = Histograma()
+            histograma.observar(duracao)
+            self.respostas[(rota, metodo, status)] += 1
+
+    def registrar_sql(self, sql, duracao, operacao, linhas=0):
+        """Chamado pelo cursor instrumentado a cada execute e uma vez pelas buscas de cada comando."""
+        local = self._acumulado_thread()
+        local.sql_s += duracao
+        local.linhas += linhas
+        if operacao.startswith('execute'):
+            local.consultas += 1
+        lenta = SQL_LENTO_MS is not None and duracao * 1000 >= SQL_LENTO_MS
+        if lenta:
+            log_sql.warning("SQL lento (%.1f ms em %s): %s", duracao * 1000, operacao, ' '.join(sql.split()))
+        if METRICAS_ATIVAS:
+            with self._lock:
+                if operacao.startswith('execute'):
+                    self.sql.observar(duracao)
+                else:
+                    self.sql.soma += duracao
+                self.sql_linhas += linhas
+                self.sql_lentas += lenta
+
+    def registrar_funcao(self, nome, inicio_thread, duracao, erro):
+        """Registra uma chamada, descontando do total o que foi gasto em SQL na mesma thread."""
+        local = self._acumulado_thread()
+        sql_s = local.sql_s - inicio_thread[0]
+        with self._lock:
+            dados = self.funcoes.get(nome)
+            if dados is None:
+                dados = self.funcoes[nome] = dict.fromkeys(
+                    ('chamadas', 'erros', 'consultas', 'linhas', 'sql_s', 'python_s'), 0)
+            dados['chamadas'] += 1
+            dados['erros'] += erro
+            dados['consultas'] += local.consultas - inicio_thread[1]
+            dados['linhas'] += local.linhas - inicio_thread[2]
+            dados['sql_s'] += sql_s
+            dados['python_s'] += max(duracao - sql_s, 0.0)
+
+    def marcar_thread(self):
+        local = self._acumulado_thread()
+        return local.sql_s, local.consultas, local.linhas
+
+    def limpar(self):
+        with self._lock:
+            self.requisicoes.clear()
+            self.respostas.clear()
+            self.funcoes.clear()
+            self.sql = Histograma()
+            self.sql_linhas = 0
+            self.sql_lentas = 0
+
+    def exportar(self, extras=()):
+        """Texto no formato de exposição do Prometheus (versão 0.0.4)."""
+        linhas = []
+
+        def cabecalho(nome, tipo, ajuda):
+            linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+
+        with self._lock:
+            cabecalho('manutencao_http_requisicao_segundos', 'histogram', "Latência das requisições HTTP por rota.")
+            for (rota, metodo), histograma in sorted(self.requisicoes.items()):
+                linhas.extend(histograma.linhas('manutencao_http_requisicao_segundos',
+                                                (('rota', rota), ('metodo', metodo))))
+            cabecalho('manutencao_http_respostas_total', 'counter', "Respostas HTTP por rota e status.")
+            for (rota, metodo, status), quantidade in sorted(self.respostas.items()):
+                linhas.append('manutencao_http_respostas_total'
+                              f"{_rotulos((('rota', rota), ('metodo', metodo), ('status', status)))} {quantidade}")
+
+            cabecalho('manutencao_sql_segundos', 'histogram',
+                      "Duração de cada execute no SQLite (a soma inclui o tempo dos fetch).")
+            linhas.extend(self.sql.linhas('manutencao_sql_segundos', ()))
+            cabecalho('manutencao_sql_linhas_total', 'counter', "Linhas devolvidas pelo SQLite.")
+            linhas.append(f"manutencao_sql_linhas_total {self.sql_linhas}")
+            cabecalho('manutencao_sql_lentas_total', 'counter', "Operações acima de MANUTENCAO_SQL_LENTO_MS.")
+            linhas.append(f"manutencao_sql_lentas_total {self.sql_lentas}")
+
+            funcoes = sorted(self.funcoes.items())
+            for nome, tipo, ajuda, chave in (
+                ('manutencao_funcao_chamadas_total', 'counter', "Chamadas das funções de dados.", 'chamadas'),
+                ('manutencao_funcao_erros_total', 'counter', "Chamadas que terminaram em exceção.", 'erros'),
+                ('manutencao_funcao_consultas_total', 'counter', "Consultas SQL feitas por função.", 'consultas'),
+                ('manutencao_funcao_linhas_total', 'counter', "Linhas lidas do SQLite por função.", 'linhas'),
+            ):
+                cabecalho(nome, tipo, ajuda)
+                for funcao, dados in funcoes:
+                    linhas.append(f"{nome}{_rotulos((('funcao', funcao),))} {dados[chave]}")
+            cabecalho('manutencao_funcao_segundos_total', 'counter',
+                      "Tempo acumulado por função, separado entre SQLite (sql) e Python (python).")
+            for funcao, dados in funcoes:
+                for parte in ('sql', 'python'):
+                    linhas.append('manutencao_funcao_segundos_total'
+                                  f"{_rotulos((('funcao', funcao), ('parte', parte)))} {dados[parte + '_s']!r}")
+
+        for nome, tipo, ajuda, valor in extras:
+            cabecalho(nome, tipo, ajuda)
+            linhas.append(f"{nome} {valor}")
+        return '\n'.join(linhas) + '\n'
+
+
+metricas = Metricas()
+
+
+def instrumentar(funcao):
+    """
+    Decorador das funções de acesso a dados: conta chamadas, consultas e linhas,
+    e separa o tempo gasto no SQLite do tempo gasto em Python.
+    Com as métricas desligadas devolve a própria função, sem custo algum.
+    """
+    if not METRICAS_ATIVAS:
+        return funcao
+
+    @functools.wraps(funcao)
+    def medido(*args, **kwargs):
+        marca = metricas.marcar_thread()
+        inicio = time.perf_counter()
+        erro = True
+        try:
+            resultado = funcao(*args, **kwargs)
+            erro = False
+            return resultado
+        finally:
+            metricas.registrar_funcao(funcao.__name__, marca, time.perf_counter() - inicio, erro)
+    return medido
+
+
+class CursorInstrumentado(sqlite3.Cursor):
+    """
+    Cursor que mede cada execute e as buscas de linhas e repassa os números para 'metricas'.
+    O tempo e as linhas das buscas (fetch* e iteração) são somados no próprio cursor e
+    registrados uma vez por comando: quando as linhas acabam, quando o cursor é fechado ou
+    usado para outro comando, ou quando é descartado.
+    """
+    _sql = None
+    _busca_s = 0.0
+    _busca_linhas = 0
+    _buscou = False
+
+    def _somar_busca(self, inicio, linhas, fim=False):
+        self._busca_s += time.perf_counter() - inicio
+        self._busca_linhas += linhas
+        self._buscou = True
+        if fim:
+            self._registrar_busca()
+
+    def _registrar_busca(self):
+        if self._buscou:
+            metricas.registrar_sql(self._sql, self._busca_s, 'fetch', self._busca_linhas)
+            self._busca_s = 0.0
+            self._busca_linhas = 0
+            self._buscou = False
+
+    def execute(self, sql, parametros=()):
+        self._registrar_busca()
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            self._sql = sql
+            metricas.registrar_sql(sql, time.perf_counter() - inicio, 'execute')
+
+    def executemany(self, sql, parametros):
+        self._registrar_busca()
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, parametros)
+        finally:
+            self._sql = sql
+            metricas.registrar_sql(sql, time.perf_counter() - inicio, 'executemany')
+
+    def executescript(self, script):
+        self._registrar_busca()
+        inicio = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            self._sql = script
+            metricas.registrar_sql(script, time.perf_counter() - inicio, 'executescript')
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        registro = super().fetchone()
+        self._somar_busca(inicio, registro is not None, registro is None)
+        return registro
+
+    def fetchmany(self, size=None):
+        inicio = time.perf_counter()
+        tamanho = self.arraysize if size is None else size
+        registros = super().fetchmany(tamanho)
+        self._somar_busca(inicio, len(registros), len(registros) < tamanho)
+        return registros
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        registros = super().fetchall()
+        self._somar_busca(inicio, len(registros), True)
+        return registros
+
+    def __next__(self):
+        inicio = time.perf_counter()
+        try:
+            registro = super().__next__()
+        except StopIteration:
+            self._somar_busca(inicio, 0, True)
+            raise
+        self._somar_busca(inicio, 1)
+        return registro
+
+    def close(self):
+        self._registrar_busca()
+        super().close()
+
+    def __del__(self):
+        self._registrar_busca()
+
+
+class ConexaoInstrumentada(sqlite3.Connection):
+    """Conexão cujos cursores (inclusive os de conn.execute) são CursorInstrumentado."""
+
+    def cursor(self, factory=CursorInstrumentado):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+
+# Só pagamos o cursor em Python quando há algo a medir ou a registrar.
+FABRICA_CONEXAO = ConexaoInstrumentada if METRICAS_ATIVAS or SQL_LENTO_MS is not None else sqlite3.Connection
+
+# --- CONFIGURAÇÃO DO BANCO DE DADOS ---
+
+# Todos os parâmetros podem ser ajustados por variáveis de ambiente sem mexer no código.
+CAMINHO_BD = os.environ.get('MANUTENCAO_BD', 'manutencao.db')
+TAMANHO_POOL = int(os.environ.get('MANUTENCAO_BD_POOL', '8'))
+PRAGMAS_BD = {
+    'synchronous': os.environ.get('MANUTENCAO_BD_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': int(os.environ.get('MANUTENCAO_BD_CACHE_SIZE', '-20000')),  # negativo = KiB
+    'mmap_size': int(os.environ.get('MANUTENCAO_BD_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'busy_timeout': int(os.environ.get('MANUTENCAO_BD_BUSY_TIMEOUT', '5000')),  # ms
+}
+
+MODOS_SYNCHRONOUS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+class PoolConexoes:
+    """
+    Mantém um conjunto limitado de conexões SQLite abertas e reutilizáveis.
+    Cada conexão é configurada uma única vez em modo WAL com os pragmas informados,
+    evitando o custo de abrir o arquivo e ajustar o banco a cada requisição.
+    """
+
+    def __init__(self, caminho, tamanho_max=8, synchronous='NORMAL', cache_size=-20000,
+                 mmap_size=0, busy_timeout=5000):
+        synchronous = str(synchronous).upper()
+        if synchronous not in MODOS_SYNCHRONOUS:
+            raise ValueError(f"Valor inválido para synchronous: {synchronous}")
+        if tamanho_max < 1:
+            raise ValueError("O pool precisa de pelo menos uma conexão.")
+
+        self.caminho = caminho
+        self.tamanho_max = tamanho_max
+        self.pragmas = {
+            'synchronous': synchronous,
+            'cache_size': int(cache_size),
+            'mmap_size': int(mmap_size),
+            'busy_timeout': int(busy_timeout),
+        }
+        self._ociosas = queue.LifoQueue()
+        self._vagas = threading.BoundedSemaphore(tamanho_max)
+        self._lock = threading.Lock()
+        self._fechado = False
+        self._estatisticas = {
+            'criadas': 0,
+            'reutilizadas': 0,
+            'em_uso': 0,
+            'esperas': 0,
+            'descartadas': 0,
+        }
+
+    def _contar(self, chave, delta=1):
+        with self._lock:
+            self._estatisticas[chave] += delta
+
+    def _nova_conexao(self):
+        conn = sqlite3.connect(
+            self.caminho,
+            timeout=self.pragmas['busy_timeout'] / 1000,
+            check_same_thread=False,
+            factory=FABRICA_CONEXAO,
+        )
+        # Num arquivo novo o auto_vacuum só pode ser escolhido antes de o modo WAL gravar a
+        # primeira página; num existente, só vale para um VACUUM feito por esta conexão.
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.pragmas['synchronous']}")
+        conn.execute(f"PRAGMA cache_size={self.pragmas['cache_size']}")
+        conn.execute(f"PRAGMA mmap_size={self.pragmas['mmap_size']}")
+        conn.execute(f"PRAGMA busy_timeout={self.pragmas['busy_timeout']}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        self._contar('criadas')
+        return conn
+
+    @contextlib.contextmanager
+    def conexao(self):
+        """Empresta uma conexão do pool e a devolve ao final do bloco 'with'."""
+        if self._fechado:
+            raise sqlite3.ProgrammingError("O pool de conexões foi fechado.")
+        if not self._vagas.acquire(blocking=False):
+            self._contar('esperas')
+            if not self._vagas.acquire(timeout=self.pragmas['busy_timeout'] / 1000):
+                raise sqlite3.OperationalError("Tempo esgotado aguardando uma conexão livre do pool.")
+        try:
+            try:
+                conn = self._ociosas.get_nowait()
+                self._contar('reutilizadas')
+            except queue.Empty:
+                conn = self._nova_conexao()
+            self._contar('em_uso')
+            try:
+                yield conn
+            finally:
+                self._contar('em_uso', -1)
+                self._devolver(conn)
+        finally:
+            self._vagas.release()
+
+    def _devolver(self, conn):
+        try:
+            # Uma transação esquecida aberta travaria os escritores; descartamos o que não foi commitado.
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._contar('descartadas')
+            conn.close()
+            return
+        if self._fechado:
+            conn.close()
+        else:
+            self._ociosas.put(conn)
+
+    def estatisticas(self):
+        """Retorna um retrato do uso do pool."""
+        with self._lock:
+            dados = dict(self._estatisticas)
+        dados.update({
+            'caminho': self.caminho,
+            'tamanho_max': self.tamanho_max,
+            'ociosas': self._ociosas.qsize(),
+            'pragmas': dict(self.pragmas),
+        })
+        return dados
+
+    def fechar(self):
+        """Fecha todas as conexões ociosas; as emprestadas são fechadas ao retornar."""
+        self._fechado = True
+        while True:
+            try:
+                self._ociosas.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def obter_pool():
+    """Retorna o pool global, criando-o (e o esquema do banco) no primeiro uso."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = PoolConexoes(CAMINHO_BD, TAMANHO_POOL, **PRAGMAS_BD)
+                inicializar_bd(pool)
+                _pool = pool
+    return _pool
+
+
+def configurar_bd(caminho=None, tamanho_max=None, **pragmas):
+    """
+    Troca o banco de dados ou os pragmas em tempo de execução.
+    O pool anterior é fechado e um novo é criado no próximo acesso.
+    """
+    global _pool, CAMINHO_BD, TAMANHO_POOL
+    with _pool_lock:
+        if caminho is not None:
+            CAMINHO_BD = caminho
+        if tamanho_max is not None:
+            TAMANHO_POOL = tamanho_max
+        PRAGMAS_BD.update(pragmas)
+        if _pool is not None:
+            _pool.fechar()
+            _pool = None
+
+
+def conexao():
+    """Atalho para emprestar uma conexão do pool global."""
+    return obter_pool().conexao()
+
+
+# --- ESCRITA AGRUPADA (GROUP COMMIT) ---
+
+# Com MANUTENCAO_GRUPO_COMMIT=1, inclusões, edições e remoções de itens de requisições
+# simultâneas são gravadas por uma única thread e confirmadas num só commit.
+GRUPO_COMMIT = os.environ.get('MANUTENCAO_GRUPO_COMMIT', '0') == '1'
+JANELA_GRUPO_MS = float(os.environ.get('MANUTENCAO_GRUPO_JANELA_MS', '2'))
+MAX_GRUPO = int(os.environ.get('MANUTENCAO_GRUPO_MAX', '256'))
+
+
+class EscritorAgrupado:
+    """
+    Thread única que grava as escritas enfileiradas em grupos. A primeira escrita da fila
+    abre o grupo; as que já estão na fila e, havendo concorrência, as que chegarem nos
+    próximos 'janela' segundos (até 'maximo') entram na mesma transação, cada uma dentro do seu SAVEPOINT, e o grupo inteiro é confirmado com
+    um único commit. Uma escrita que falha desfaz só o próprio SAVEPOINT e o erro volta
+    apenas para quem a pediu; se o commit falhar, todas as escritas do grupo recebem o erro.
+    Quem pede a escrita só recebe a resposta depois do commit do seu grupo.
+    """
+
+    def __init__(self, janela=0.002, maximo=256):
+        if janela < 0:
+            raise ValueError("A janela do commit em grupo não pode ser negativa.")
+        if maximo < 1:
+            raise ValueError("O grupo precisa aceitar pelo menos uma escrita.")
+        self.janela = janela
+        self.maximo = maximo
+        self._fila = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._fechado = False
+        self._estatisticas = {'grupos': 0, 'escritas': 0, 'falhas': 0, 'maior_grupo': 0}
+
+    def executar(self, operacao, depois=None):
+        """
+        Enfileira operacao(conn) e espera o commit do grupo em que ela entrou. Retorna o
+        resultado da operação ou levanta a exceção que ela (ou o commit) levantou.
+        depois(resultado) roda na thread do escritor logo após o commit, na ordem das escritas.
+        """
+        futuro = concurrent.futures.Future()
+        with self._lock:
+            if self._fechado:
+                raise sqlite3.ProgrammingError("O escritor agrupado foi fechado.")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._laco, name='escritor-agrupado', daemon=True)
+                self._thread.start()
+            self._fila.put((operacao, depois, futuro))
+        return futuro.result()
+
+    def _laco(self):
+        concorrente = False
+        while True:
+            pedido = self._fila.get()
+            if pedido is None:
+                return
+            grupo = [pedido]
+            # Só vale esperar a janela se o grupo anterior mostrou escritas simultâneas;
+            # uma escrita isolada é gravada na hora, sem pagar a espera.
+            limite = time.monotonic() + (self.janela if concorrente else 0)
+            while len(grupo) < self.maximo:
+                try:
+                    pedido = self._fila.get_nowait()
+                except queue.Empty:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        break
+                    try:
+                        pedido = self._fila.get(timeout=restante)
+                    except queue.Empty:
+                        break
+                if pedido is None:
+                    self._fila.put(None)  # termina o laço depois de gravar este grupo
+                    break
+                grupo.append(pedido)
+            concorrente = len(grupo) > 1
+            self._gravar(grupo)
+
+    def _gravar(self, grupo):
+        resultados = []
+        try:
+            with conexao() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for operacao, _, _ in grupo:
+                    conn.execute("SAVEPOINT escrita")
+                    try:
+                        resultados.append((True, operacao(conn)))
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO escrita")
+                        resultados.append((False, e))
+                    conn.execute("RELEASE escrita")
+                conn.commit()
+        except Exception as e:
+            # Nada do grupo foi gravado: o pool desfaz a transação ao receber a conexão de volta.
+            with self._lock:
+                self._estatisticas['falhas'] += len(grupo)
+            for _, _, futuro in grupo:
+                futuro.set_exception(e)
+            return
+
+        with self._lock:
+            self._estatisticas['grupos'] += 1
+            self._estatisticas['escritas'] += len(grupo)
+            self._estatisticas['maior_grupo'] = max(self._estatisticas['maior_grupo'], len(grupo))
+        for (_, depois, futuro), (sucesso, valor) in zip(grupo, resultados):
+            if not sucesso:
+                futuro.set_exception(valor)
+                continue
+            if depois is not None:
+                try:
+                    depois(valor)
+                except Exception:
+                    log_escrita.exception("Falha ao aplicar os efeitos de uma escrita agrupada")
+            futuro.set_result(valor)
+
+    def estatisticas(self):
+        with self._lock:
+            dados = dict(self._estatisticas)
+        dados.update({'janela_ms': self.janela * 1000, 'maximo': self.maximo, 'pendentes': self._fila.qsize()})
+        return dados
+
+    def fechar(self):
+        """Grava o que já está na fila e encerra a thread."""
+        with self._lock:
+            if self._fechado:
+                return
+            self._fechado = True
+            thread = self._thread
+            self._fila.put(None)
+        if thread is not None:
+            thread.join()
+
+
+_escritor = EscritorAgrupado(JANELA_GRUPO_MS / 1000, MAX_GRUPO) if GRUPO_COMMIT else None
+
+
+def configurar_escrita(agrupar, janela_ms=None, maximo=None):
+    """
+    Liga ou desliga o commit em grupo em tempo de execução. O escritor anterior grava o
+    que já estava na fila antes de ser trocado.
+    """
+    global _escritor, JANELA_GRUPO_MS, MAX_GRUPO
+    if janela_ms is not None:
+        JANELA_GRUPO_MS = float(janela_ms)
+    if maximo is not None:
+        MAX_GRUPO = int(maximo)
+    novo = EscritorAgrupado(JANELA_GRUPO_MS / 1000, MAX_GRUPO) if agrupar else None
+    anterior, _escritor = _escritor, novo
+    if anterior is not None:
+        anterior.fechar()
+
+
+def executar_escrita(operacao, depois=None):
+    """
+    Executa operacao(conn) e confirma a escrita, numa transação própria ou, com o commit em
+    grupo ligado, pelo escritor agrupado. depois(resultado) roda após o commit.
+    """
+    escritor = _escritor
+    if escritor is not None:
+        return escritor.executar(operacao, depois)
+    with conexao() as conn:
+        resultado = operacao(conn)
+        conn.commit()
+    if depois is not None:
+        depois(resultado)
+    return resultado
+
+
+# --- LÓGICA DO BANCO DE DADOS ---
+
+# Itens criados sem veiculo_id ficam no veículo padrão, criado pela migração de veículos.
+VEICULO_PADRAO = 1
+
+COLUNAS_TABELA = ('id', 'nome', 'valor', 'data_troca', 'km_troca', 'km_proxima', 'meses_proxima',
+                  'proxima_km', 'proxima_data', 'veiculo_id')
+SELECT_ITENS = f"SELECT {', '.join(COLUNAS_TABELA)} FROM manutencao_itens"
+
+def _migracao_esquema_inicial(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS manutencao_itens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            valor REAL NOT NULL,
+            data_troca TEXT NOT NULL,
+            km_troca INTEGER NOT NULL,
+            km_proxima INTEGER NOT NULL,
+            meses_proxima INTEGER NOT NULL
+        )
+    ''')
+    # Índices que sustentam os filtros e as ordenações de listar_itens.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_itens_nome ON manutencao_itens (nome)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_itens_data_troca ON manutencao_itens (data_troca)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_itens_km_troca ON manutencao_itens (km_troca)")
+
+def _migracao_vencimentos(conn):
+    """Guarda a próxima troca (km e data) em colunas indexadas e preenche os itens existentes."""
+    conn.execute("ALTER TABLE manutencao_itens ADD COLUMN proxima_km INTEGER")
+    conn.execute("ALTER TABLE manutencao_itens ADD COLUMN proxima_data TEXT")
+    conn.execute('''
+        UPDATE manutencao_itens
+        SET proxima_km = km_troca + km_proxima,
+            proxima_data = date(data_troca, '+' || (meses_proxima * 30) || ' days')
+    ''')
+    conn.execute("CREATE INDEX idx_itens_proxima_km ON manutencao_itens (proxima_km)")
+    conn.execute("CREATE INDEX idx_itens_proxima_data ON manutencao_itens (proxima_data)")
+
+def _migracao_versao_dados(conn):
+    """Cria um contador que aumenta a cada escrita em manutencao_itens, mantido por triggers."""
+    conn.execute("CREATE TABLE versao_dados (id INTEGER PRIMARY KEY CHECK (id = 1), versao INTEGER NOT NULL)")
+    conn.execute("INSERT INTO versao_dados (id, versao) VALUES (1, 0)")
+    for evento in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''
+            CREATE TRIGGER trg_versao_{evento.lower()} AFTER {evento} ON manutencao_itens
+            BEGIN
+                UPDATE versao_dados SET versao = versao + 1 WHERE id = 1;
+            END
+        ''')
+
+def _migracao_veiculos(conn):
+    """
+    Cria a tabela de veículos e liga cada item a um veículo.
+    Os itens já existentes passam a pertencer ao veículo padrão (id 1).
+    """
+    conn.execute('''
+        CREATE TABLE veiculos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            placa TEXT
+        )
+    ''')
+    conn.execute("INSERT INTO veiculos (id, nome) VALUES (?, 'Veículo principal')", (VEICULO_PADRAO,))
+    conn.execute("ALTER TABLE manutencao_itens ADD COLUMN veiculo_id INTEGER REFERENCES veiculos (id)")
+    conn.execute("UPDATE manutencao_itens SET veiculo_id = ?", (VEICULO_PADRAO,))
+    # Índices compostos: toda consulta por veículo vira uma busca por faixa dentro do veículo.
+    # O índice só de veiculo_id já vem ordenado por id (rowid), o que atende a paginação padrão.
+    conn.execute("CREATE INDEX idx_itens_veiculo ON manutencao_itens (veiculo_id)")
+    for coluna in ('nome', 'data_troca', 'km_troca', 'proxima_km', 'proxima_data'):
+        conn.execute(f"CREATE INDEX idx_itens_veiculo_{coluna} ON manutencao_itens (veiculo_id, {coluna})")
+    for evento in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''
+            CREATE TRIGGER trg_versao_veiculos_{evento.lower()} AFTER {evento} ON veiculos
+            BEGIN
+                UPDATE versao_dados SET versao = versao + 1 WHERE id = 1;
+            END
+        ''')
+
+# Valores em centavos inteiros: somas e subtrações repetidas nos resumos não acumulam erro de ponto flutuante.
+_SQL_CENTAVOS = "CAST(ROUND({linha}.valor * 100) AS INTEGER)"
+
+def _sql_resumo_entrada(linha):
+    """Comandos que contabilizam a linha 'linha' (NEW) nas tabelas de resumo."""
+    centavos = _SQL_CENTAVOS.format(linha=linha)
+    return f'''
+        INSERT INTO resumo_por_nome (veiculo_id, nome, quantidade, total_centavos, primeira_troca, ultima_troca)
+        VALUES ({linha}.veiculo_id, {linha}.nome, 1, {centavos}, {linha}.data_troca, {linha}.data_troca)
+        ON CONFLICT (veiculo_id, nome) DO UPDATE SET
+            quantidade = quantidade + 1,
+            total_centavos = total_centavos + excluded.total_centavos,
+            primeira_troca = MIN(primeira_troca, excluded.primeira_troca),
+            ultima_troca = MAX(ultima_troca, excluded.ultima_troca);
+        INSERT INTO resumo_por_mes (veiculo_id, mes, quantidade, total_centavos)
+        VALUES ({linha}.veiculo_id, substr({linha}.data_troca, 1, 7), 1, {centavos})
+        ON CONFLICT (veiculo_id, mes) DO UPDATE SET
+            quantidade = quantidade + 1,
+            total_centavos = total_centavos + excluded.total_centavos;
+    '''
+
+def _sql_resumo_saida(linha):
+    """Comandos que descontam a linha 'linha' (OLD) das tabelas de resumo."""
+    centavos = _SQL_CENTAVOS.format(linha=linha)
+    grupo = f"veiculo_id = {linha}.veiculo_id AND nome = {linha}.nome"
+    return f'''
+        UPDATE resumo_por_nome
+        SET quantidade = quantidade - 1, total_centavos = total_centavos - {centavos}
+        WHERE {grupo};
+        UPDATE resumo_por_nome
+        SET primeira_troca = (SELECT MIN(data_troca) FROM manutencao_itens WHERE {grupo}),
+            ultima_troca = (SELECT MAX(data_troca) FROM manutencao_itens WHERE {grupo})
+        WHERE {grupo} AND quantidade > 0
+          AND (primeira_troca = {linha}.data_troca OR ultima_troca = {linha}.data_troca);
+        DELETE FROM resumo_por_nome WHERE {grupo} AND quantidade = 0;
+        UPDATE resumo_por_mes
+        SET quantidade = quantidade - 1, total_centavos = total_centavos - {centavos}
+        WHERE veiculo_id = {linha}.veiculo_id AND mes = substr({linha}.data_troca, 1, 7);
+        DELETE FROM resumo_por_mes
+        WHERE veiculo_id = {linha}.veiculo_id AND mes = substr({linha}.data_troca, 1, 7) AND quantidade = 0;
+    '''
+
+_SQL_RECALCULAR_RESUMOS = '''
+    DELETE FROM resumo_por_nome;
+    DELETE FROM resumo_por_mes;
+    INSERT INTO resumo_por_nome (veiculo_id, nome, quantidade, total_centavos, primeira_troca, ultima_troca)
+        SELECT veiculo_id, nome, COUNT(*), SUM(CAST(ROUND(valor * 100) AS INTEGER)), MIN(data_troca), MAX(data_troca)
+        FROM manutencao_itens GROUP BY veiculo_id, nome;
+    INSERT INTO resumo_por_mes (veiculo_id, mes, quantidade, total_centavos)
+        SELECT veiculo_id, substr(data_troca, 1, 7), COUNT(*), SUM(CAST(ROUND(valor * 100) AS INTEGER))
+        FROM manutencao_itens GROUP BY veiculo_id, substr(data_troca, 1, 7);
+'''
+
+def _migracao_resumos(conn):
+    """
+    Cria as tabelas de resumo de gastos (por item e por mês, dentro de cada veículo),
+    mantidas por triggers a cada escrita, e as preenche com os itens existentes.
+    """
+    conn.execute('''
+        CREATE TABLE resumo_por_nome (
+            veiculo_id INTEGER NOT NULL,
+            nome TEXT NOT NULL,
+            quantidade INTEGER NOT NULL,
+            total_centavos INTEGER NOT NULL,
+            primeira_troca TEXT NOT NULL,
+            ultima_troca TEXT NOT NULL,
+            PRIMARY KEY (veiculo_id, nome)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE resumo_por_mes (
+            veiculo_id INTEGER NOT NULL,
+            mes TEXT NOT NULL,
+            quantidade INTEGER NOT NULL,
+            total_centavos INTEGER NOT NULL,
+            PRIMARY KEY (veiculo_id, mes)
+        ) WITHOUT ROWID
+    ''')
+    # Ao remover a primeira ou a última troca de um grupo, MIN/MAX são refeitos com este índice.
+    conn.execute("CREATE INDEX idx_itens_veiculo_nome_data ON manutencao_itens (veiculo_id, nome, data_troca)")
+    conn.execute(f"CREATE TRIGGER trg_resumo_insert AFTER INSERT ON manutencao_itens BEGIN {_sql_resumo_entrada('NEW')} END")
+    conn.execute(f"CREATE TRIGGER trg_resumo_delete AFTER DELETE ON manutencao_itens BEGIN {_sql_resumo_saida('OLD')} END")
+    conn.execute(f'''
+        CREATE TRIGGER trg_resumo_update AFTER UPDATE OF nome, valor, data_troca, veiculo_id ON manutencao_itens
+        BEGIN {_sql_resumo_saida('OLD')} {_sql_resumo_entrada('NEW')} END
+    ''')
+    for comando in _SQL_RECALCULAR_RESUMOS.split(';'):
+        if comando.strip():
+            conn.execute(comando)
+
+def _migracao_busca(conn):
+    """
+    Cria a busca textual por nome (FTS5, sem diferenciar acentos: "oleo" encontra "Óleo").
+    O índice guarda cada nome distinto uma vez, com a quantidade de itens que o usam,
+    então ranquear uma busca custa proporcional aos nomes diferentes e não aos itens.
+    """
+    conn.execute('''
+        CREATE TABLE nomes_itens (
+            id INTEGER PRIMARY KEY,
+            nome TEXT NOT NULL UNIQUE,
+            quantidade INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE VIRTUAL TABLE itens_fts USING fts5(
+            nome, content='nomes_itens', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    # nomes_itens -> itens_fts: só muda quando aparece um nome novo ou some o último item de um nome.
+    conn.execute('''
+        CREATE TRIGGER trg_fts_insert AFTER INSERT ON nomes_itens BEGIN
+            INSERT INTO itens_fts (rowid, nome) VALUES (NEW.id, NEW.nome);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER trg_fts_delete AFTER DELETE ON nomes_itens BEGIN
+            INSERT INTO itens_fts (itens_fts, rowid, nome) VALUES ('delete', OLD.id, OLD.nome);
+        END
+    ''')
+    # manutencao_itens -> nomes_itens
+    entrada = '''
+        INSERT INTO nomes_itens (nome, quantidade) VALUES (NEW.nome, 1)
+        ON CONFLICT (nome) DO UPDATE SET quantidade = quantidade + 1;
+    '''
+    saida = '''
+        UPDATE nomes_itens SET quantidade = quantidade - 1 WHERE nome = OLD.nome;
+        DELETE FROM nomes_itens WHERE nome = OLD.nome AND quantidade <= 0;
+    '''
+    conn.execute(f"CREATE TRIGGER trg_busca_insert AFTER INSERT ON manutencao_itens BEGIN {entrada} END")
+    conn.execute(f"CREATE TRIGGER trg_busca_delete AFTER DELETE ON manutencao_itens BEGIN {saida} END")
+    conn.execute(f'''
+        CREATE TRIGGER trg_busca_update AFTER UPDATE OF nome ON manutencao_itens
+        WHEN OLD.nome IS NOT NEW.nome BEGIN {saida} {entrada} END
+    ''')
+    conn.execute("INSERT INTO nomes_itens (nome, quantidade) SELECT nome, COUNT(*) FROM manutencao_itens GROUP BY nome")
+
+def _migracao_leituras(conn):
+    """
+    Cria o registro de leituras do odômetro de cada veículo, que alimenta a previsão de
+    quando cada item chega à sua km de troca. versao_leituras muda só com as leituras,
+    para a previsão ser recalculada apenas quando chegam leituras novas.
+    """
+    conn.execute('''
+        CREATE TABLE leituras_odometro (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            veiculo_id INTEGER NOT NULL REFERENCES veiculos (id) ON DELETE CASCADE,
+            data TEXT NOT NULL,
+            km INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX idx_leituras_veiculo_data ON leituras_odometro (veiculo_id, data)")
+    conn.execute("ALTER TABLE versao_dados ADD COLUMN versao_leituras INTEGER NOT NULL DEFAULT 0")
+    # As listagens trazem a previsão, então uma leitura nova também precisa invalidar o cache de respostas.
+    for evento in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''
+            CREATE TRIGGER trg_versao_leituras_{evento.lower()} AFTER {evento} ON leituras_odometro
+            BEGIN
+                UPDATE versao_dados SET versao = versao + 1, versao_leituras = versao_leituras + 1 WHERE id = 1;
+            END
+        ''')
+
+def _migracao_mudancas(conn):
+    """
+    Cria o registro de mudanças dos itens: cada item tem uma linha com o número de
+    sequência da sua última escrita (e se ela foi uma remoção), então as mudanças
+    desde a sequência N saem de uma faixa no índice de seq. Os itens existentes entram
+    como inseridos, para desde=0 equivaler a uma carga completa.
+    """
+    conn.execute('''
+        CREATE TABLE mudancas_itens (
+            item_id INTEGER PRIMARY KEY,
+            seq INTEGER NOT NULL UNIQUE,
+            removido INTEGER NOT NULL
+        )
+    ''')
+    for evento, linha, removido in (('INSERT', 'NEW', 0), ('UPDATE', 'NEW', 0), ('DELETE', 'OLD', 1)):
+        conn.execute(f'''
+            CREATE TRIGGER trg_mudancas_{evento.lower()} AFTER {evento} ON manutencao_itens
+            BEGIN
+                INSERT INTO mudancas_itens (item_id, seq, removido)
+                VALUES ({linha}.id, (SELECT COALESCE(MAX(seq), 0) + 1 FROM mudancas_itens), {removido})
+                ON CONFLICT (item_id) DO UPDATE SET seq = excluded.seq, removido = excluded.removido;
+            END
+        ''')
+    conn.execute("INSERT INTO mudancas_itens (item_id, seq, removido) SELECT id, id, 0 FROM manutencao_itens")
+
+def _migracao_auto_vacuum(conn):
+    """
+    Liga auto_vacuum=INCREMENTAL, para que as páginas liberadas por remoções e edições
+    possam ser devolvidas aos poucos (veja ManutencaoBd). Bancos novos já nascem assim
+    (PoolConexoes); num banco antigo a mudança só vale depois do VACUUM feito por
+    ManutencaoBd.compactar, que reescreve o arquivo e por isso não roda na inicialização.
+    """
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+# Cada migração roda uma única vez; PRAGMA user_version guarda quantas já foram aplicadas.
+MIGRACOES = [
+    _migracao_esquema_inicial,
+    _migracao_vencimentos,
+    _migracao_versao_dados,
+    _migracao_veiculos,
+    _migracao_resumos,
+    _migracao_busca,
+    _migracao_leituras,
+    _migracao_mudancas,
+    _migracao_auto_vacuum,
+]
+AUTO_VACUUM_INCREMENTAL = 2  # valor de PRAGMA auto_vacuum
+
+def inicializar_bd(pool):
+    """Cria o esquema do banco ou atualiza um arquivo antigo aplicando as migrações pendentes."""
+    with pool.conexao() as conn:
+        # BEGIN IMMEDIATE impede que dois processos apliquem a mesma migração ao mesmo tempo.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            versao = conn.execute("PRAGMA user_version").fetchone()[0]
+            for numero in range(versao, len(MIGRACOES)):
+                MIGRACOES[numero](conn)
+            conn.execute(f"PRAGMA user_version = {len(MIGRACOES)}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+@instrumentar
+def obter_versao_dados():
+    """
+    Retorna o contador de versão da tabela de itens. Ele muda a cada escrita,
+    venha ela deste processo ou de outro que use o mesmo arquivo.
+    """
+    with conexao() as conn:
+        return conn.execute("SELECT versao FROM versao_dados WHERE id = 1").fetchone()[0]
+
+def _calcular_vencimento(data_troca, km_troca, km_proxima, meses_proxima):
+    """Calcula a próxima troca prevista. Retorna (proxima_km, proxima_data_iso)."""
+    proxima_data = data_troca + datetime.timedelta(days=meses_proxima * 30)
+    return km_troca + km_proxima, proxima_data.isoformat()
+
+def _ler_data(texto):
+    """Converte 'AAAA-MM-DD' em date, aceitando as mesmas entradas que strptime('%Y-%m-%d')."""
+    # fromisoformat é bem mais rápido que strptime, o que pesa nas importações em lote.
+    if isinstance(texto, str) and len(texto) == 10 and texto[4] == '-' and texto[7] == '-':
+        return datetime.date.fromisoformat(texto)
+    return datetime.datetime.strptime(texto, '%Y-%m-%d').date()
+
+def _validar_item(data):
+    """
+    Valida e converte os campos de um item recebido pela API.
+    Retorna a tupla de valores na ordem das colunas (sem o id), com o vencimento já calculado.
+    Lança ValueError, KeyError ou TypeError se algum campo for inválido.
+    """
+    nome = data['nome']
+    valor = float(data['valor'])
+    data_troca = _ler_data(data['data_troca'])
+    km_troca = int(data['km_troca'])
+    km_proxima = int(data['km_proxima'])
+    meses_proxima = int(data['meses_proxima'])
+    veiculo_id = int(data.get('veiculo_id', VEICULO_PADRAO))
+    proxima_km, proxima_data = _calcular_vencimento(data_troca, km_troca, km_proxima, meses_proxima)
+    return (nome, valor, data_troca.isoformat(), km_troca, km_proxima, meses_proxima, proxima_km, proxima_data,
+            veiculo_id)
+
+def _formatar_item(reg):
+    """Converte uma linha da tabela no dicionário devolvido pela API."""
+    id, nome, valor, data_troca, km_troca, km_proxima, meses_proxima, proxima_km, proxima_data, veiculo_id = reg
+
+    return {
+        'id': id,
+        'veiculo_id': veiculo_id,
+        'nome': nome,
+        'valor': valor,
+        'data_troca': data_troca,
+        'km_troca': km_troca,
+        'km_proxima': km_proxima,
+        'meses_proxima': meses_proxima,
+        'proxima_data_formatada': f"{proxima_data[8:10]}/{proxima_data[5:7]}/{proxima_data[:4]}",
+        'proxima_troca_km_prevista': proxima_km,
+        'proxima_data_iso': proxima_data
+    }
+
+@instrumentar
+def carregar_itens():
+    """Carrega todos os itens do banco de dados, sem filtro."""
+    with conexao() as conn:
+        registros = conn.execute(SELECT_ITENS).fetchall()
+    return [_formatar_item(reg) for reg in registros]
+
+# Colunas aceitas em ?ordenar=. Cada uma tem um índice, e o rowid (id) desempata.
+COLUNAS_ORDENACAO = ('id', 'nome', 'data_troca', 'km_troca')
+LIMITE_PADRAO = 50
+LIMITE_MAXIMO = 500
+
+def _codificar_cursor(valor, item_id):
+    bruto = json.dumps([valor, item_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(bruto).decode('ascii')
+
+def _decodificar_cursor(cursor):
+    try:
+        valor, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return valor, int(item_id)
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError("Cursor inválido.")
+
+@instrumentar
+def listar_itens(limite=LIMITE_PADRAO, after_id=None, cursor=None, nome=None,
+                 data_de=None, data_ate=None, km_min=None, km_max=None,
+                 ordenar='id', ordem='asc', veiculo_id=None):
+    """
+    Retorna uma página de itens usando paginação por chave (keyset).
+    Filtros e ordenação são resolvidos no SQL, então o custo é proporcional
+    ao tamanho da página e não ao da tabela. Com veiculo_id, só os itens daquele veículo.
+    Retorna (itens, proximo_cursor); proximo_cursor é None na última página.
+    """
+    if ordenar not in COLUNAS_ORDENACAO:
+        raise ValueError(f"Ordenação inválida: {ordenar}")
+    if ordem not in ('asc', 'desc'):
+        raise ValueError(f"Ordem inválida: {ordem}")
+    limite = int(limite)
+    if not 1 <= limite <= LIMITE_MAXIMO:
+        raise ValueError(f"O limite deve estar entre 1 e {LIMITE_MAXIMO}.")
+
+    condicoes = []
+    parametros = []
+    if veiculo_id is not None:
+        condicoes.append("veiculo_id = ?")
+        parametros.append(int(veiculo_id))
+    if nome:
+        # Faixa [prefixo, prefixo + maior caractere) aproveita o índice de nome, ao contrário de LIKE.
+        condicoes.append("nome >= ? AND nome < ?")
+        parametros += [nome, nome + '\U0010ffff']
+    if data_de:
+        condicoes.append("data_troca >= ?")
+        parametros.append(datetime.date.fromisoformat(data_de).isoformat())
+    if data_ate:
+        condicoes.append("data_troca <= ?")
+        parametros.append(datetime.date.fromisoformat(data_ate).isoformat())
+    if km_min is not None:
+        condicoes.append("km_troca >= ?")
+        parametros.append(int(km_min))
+    if km_max is not None:
+        condicoes.append("km_troca <= ?")
+        parametros.append(int(km_max))
+
+    comparador = '>' if ordem == 'asc' else '<'
+    if cursor:
+        valor, ultimo_id = _decodificar_cursor(cursor)
+        if ordenar == 'id':
+            condicoes.append(f"id {comparador} ?")
+            parametros.append(ultimo_id)
+        else:
+            condicoes.append(f"({ordenar}, id) {comparador} (?, ?)")
+            parametros += [valor, ultimo_id]
+    elif after_id is not None:
+        if ordenar != 'id':
+            raise ValueError("after_id só pode ser usado com ordenar=id; use cursor.")
+        condicoes.append(f"id {comparador} ?")
+        parametros.append(int(after_id))
+
+    sql = SELECT_ITENS
+    if condicoes:
+        sql += " WHERE " + " AND ".join(condicoes)
+    if ordenar == 'id':
+        sql += f" ORDER BY id {ordem.upper()}"
+    else:
+        sql += f" ORDER BY {ordenar} {ordem.upper()}, id {ordem.upper()}"
+    # Um registro a mais indica se existe uma próxima página.
+    sql += " LIMIT ?"
+    parametros.append(limite + 1)
+
+    with conexao() as conn:
+        registros = conn.execute(sql, parametros).fetchall()
+
+    proximo_cursor = None
+    if len(registros) > limite:
+        registros = registros[:limite]
+        ultimo = registros[-1]
+        proximo_cursor = _codificar_cursor(ultimo[COLUNAS_TABELA.index(ordenar)], ultimo[0])
+    return previsao_km.anexar([_formatar_item(reg) for reg in registros]), proximo_cursor
+
+_TERMOS_BUSCA = re.compile(r'\w+')
+
+def _consulta_fts(texto):
+    """
+    Converte o texto digitado numa consulta FTS5: todos os termos, cada um como prefixo.
+    Aspas e operadores do usuário viram termos comuns, então nenhuma entrada quebra a sintaxe.
+    """
+    termos = _TERMOS_BUSCA.findall(texto)
+    if not termos:
+        raise ValueError("A busca precisa de pelo menos uma letra ou número.")
+    return ' AND '.join(f'"{termo}"*' for termo in termos)
+
+@instrumentar
+def buscar_itens(q, limite=LIMITE_PADRAO, cursor=None, veiculo_id=None):
+    """
+    Busca textual pelo nome, sem diferenciar acentos nem maiúsculas ("oleo" encontra "Óleo").
+    Os nomes que casam com a busca são ordenados por relevância (bm25; empates pelo nome
+    mais usado) e os itens de cada nome saem em ordem de id, paginados por chave.
+    Retorna (itens, proximo_cursor); proximo_cursor é None na última página.
+    """
+    limite = int(limite)
+    if not 1 <= limite <= LIMITE_MAXIMO:
+        raise ValueError(f"O limite deve estar entre 1 e {LIMITE_MAXIMO}.")
+    consulta = _consulta_fts(q)
+
+    with conexao() as conn:
+        nomes = [nome for (nome,) in conn.execute('''
+            SELECT n.nome FROM itens_fts JOIN nomes_itens n ON n.id = itens_fts.rowid
+            WHERE itens_fts MATCH ?
+            ORDER BY itens_fts.rank, n.quantidade DESC, n.nome
+        ''', (consulta,))]
+
+        inicio, ultimo_id = 0, None
+        if cursor:
+            nome_cursor, ultimo_id = _decodificar_cursor(cursor)
+            if nome_cursor not in nomes:
+                # O nome da página anterior deixou de existir ou de casar com a busca.
+                return [], None
+            inicio = nomes.index(nome_cursor)
+
+        sql = SELECT_ITENS + " WHERE nome = ? AND id > ?"
+        if veiculo_id is not None:
+            sql += " AND veiculo_id = ?"
+        sql += " ORDER BY id LIMIT ?"
+
+        # Um registro a mais indica se existe uma próxima página.
+        registros = []
+        for nome in nomes[inicio:]:
+            parametros = [nome, ultimo_id or 0]
+            if veiculo_id is not None:
+                parametros.append(int(veiculo_id))
+            parametros.append(limite + 1 - len(registros))
+            registros += conn.execute(sql, parametros).fetchall()
+            ultimo_id = None
+            if len(registros) > limite:
+                break
+
+    proximo_cursor = None
+    if len(registros) > limite:
+        registros = registros[:limite]
+        ultimo = registros[-1]
+        proximo_cursor = _codificar_cursor(ultimo[1], ultimo[0])
+    return previsao_km.anexar([_formatar_item(reg) for reg in registros]), proximo_cursor
+
+def consultar_itens(args, veiculo_id=None):
+    """
+    Resolve os parâmetros de GET /api/itens (um dicionário como request.args): com 'q' faz a
+    busca textual, sem ele a listagem filtrada. Retorna (dados, status) prontos para a resposta.
+    """
+    try:
+        if args.get('q') is not None:
+            conflitantes = [p for p in ('after_id', 'nome', 'data_de', 'data_ate', 'km_min', 'km_max',
+                                        'ordenar', 'ordem') if args.get(p) is not None]
+            if conflitantes:
+                raise ValueError(f"q não pode ser combinado com {', '.join(conflitantes)}.")
+            itens, proximo_cursor = buscar_itens(
+                args['q'],
+                limite=args.get('limit', LIMITE_PADRAO),
+                cursor=args.get('cursor'),
+                veiculo_id=veiculo_id,
+            )
+        else:
+            itens, proximo_cursor = listar_itens(
+                limite=args.get('limit', LIMITE_PADRAO),
+                after_id=args.get('after_id'),
+                cursor=args.get('cursor'),
+                nome=args.get('nome'),
+                data_de=args.get('data_de'),
+                data_ate=args.get('data_ate'),
+                km_min=args.get('km_min'),
+                km_max=args.get('km_max'),
+                ordenar=args.get('ordenar', 'id'),
+                ordem=args.get('ordem', 'asc'),
+                veiculo_id=veiculo_id,
+            )
+    except ValueError as e:
+        return {'mensagem': f"Parâmetros inválidos: {e}"}, 400
+    return {'itens': itens, 'proximo_cursor': proximo_cursor}, 200
+
+@instrumentar
+def buscar_item(item_id):
+    """Busca um único item pelo seu ID. Retorna None se não existir."""
+    with conexao() as conn:
+        reg = conn.execute(SELECT_ITENS + " WHERE id = ?", (item_id,)).fetchone()
+    if reg is None:
+        return None
+    id, nome, valor, data_troca, km_troca, km_proxima, meses_proxima = reg[:7]
+    return {
+        'id': id,
+        'veiculo_id': reg[9],
+        'nome': nome,
+        'valor': valor,
+        'data_troca': data_troca,
+        'km_troca': km_troca,
+        'km_proxima': km_proxima,
+        'meses_proxima': meses_proxima
+    }
+
+INSERT_ITEM = (
+    "INSERT INTO manutencao_itens (nome, valor, data_troca, km_troca, km_proxima, meses_proxima, proxima_km, proxima_data, "
+    "veiculo_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+def _sql_vencimentos(colunas, por_veiculo):
+    """
+    Monta a consulta de vencimentos: uma busca limitada por condição (proxima_km <= ? e/ou
+    proxima_data <= ?), unidas com UNION ALL, e a ordenação final sobre no máximo
+    limite * len(colunas) ids. Cada busca já ordena por (proxima_data, id), a ordem do
+    resultado, para que os seus primeiros 'limite' contenham os que podem aparecer nele.
+    Parâmetros: [veiculo_id,] valor, limite por condição e o limite final.
+    """
+    # O filtro de veículo fica em cada busca para que ela continue sendo uma única
+    # faixa em um índice composto (veiculo_id, coluna). Na de km, o '+' impede o SQLite
+    # de percorrer o índice de datas filtrando por km: ele usa a faixa de km e ordena
+    # só as linhas encontradas, guardando 'limite' delas.
+    prefixo = "veiculo_id = ? AND " if por_veiculo else ""
+    buscas = [
+        f"SELECT id FROM (SELECT id FROM manutencao_itens WHERE {prefixo}{coluna} <= ? "
+        f"ORDER BY {'+' if coluna == 'proxima_km' else ''}proxima_data, id LIMIT ?)"
+        for coluna in colunas
+    ]
+    return (SELECT_ITENS + " WHERE id IN (" + " UNION ALL ".join(buscas) + ") "
+            "ORDER BY proxima_data, id LIMIT ?")
+
+@instrumentar
+def listar_vencimentos(km_atual=None, ate=None, limite=LIMITE_MAXIMO, veiculo_id=None):
+    """
+    Lista os itens cuja próxima troca já chegou: proxima_km <= km_atual ou proxima_data <= ate.
+    As duas condições são faixas sobre colunas indexadas, e de cada uma só os 'limite'
+    primeiros são lidos, então o custo não cresce com o número de itens vencidos.
+    Com veiculo_id, usa os índices compostos daquele veículo.
+    """
+    colunas = []
+    if km_atual is not None:
+        km_atual = int(km_atual)
+        colunas.append('proxima_km')
+    if ate is not None:
+        ate = datetime.date.fromisoformat(ate).isoformat()
+        colunas.append('proxima_data')
+    if not colunas:
+        raise ValueError("Informe km_atual e/ou ate.")
+    limite = int(limite)
+    if not 1 <= limite <= LIMITE_MAXIMO:
+        raise ValueError(f"O limite deve estar entre 1 e {LIMITE_MAXIMO}.")
+
+    parametros = []
+    for coluna in colunas:
+        if veiculo_id is not None:
+            parametros.append(int(veiculo_id))
+        parametros += [km_atual if coluna == 'proxima_km' else ate, limite]
+    parametros.append(limite)
+    with conexao() as conn:
+        registros = conn.execute(_sql_vencimentos(colunas, veiculo_id is not None), parametros).fetchall()
+
+    itens = []
+    for reg in registros:
+        item = _formatar_item(reg)
+        item['vence_por_km'] = km_atual is not None and item['proxima_troca_km_prevista'] <= km_atual
+        item['vence_por_data'] = ate is not None and item['proxima_data_iso'] <= ate
+        itens.append(item)
+    return previsao_km.anexar(itens)
+
+@instrumentar
+def adicionar_item(data):
+    """Adiciona um novo item ao banco de dados."""
+    try:
+        valores = _validar_item(data)
+
+        def inserir(conn):
+            cursor = conn.execute(INSERT_ITEM, valores)
+            return cursor.lastrowid, motor_alertas.versao_na_transacao(conn)
+
+        def depois(resultado):
+            item_id, versao = resultado
+            motor_alertas.registrar(versao, item_id, valores[8], valores[6], valores[7])
+            aviso_mudancas.avisar()
+
+        executar_escrita(inserir, depois)
+        return True, "Item adicionado com sucesso!"
+    except (ValueError, KeyError, TypeError, sqlite3.Error) as e:
+        return False, f"Erro ao adicionar item: {e}"
+
+@instrumentar
+def remover_item(item_id):
+    """Remove um item do banco de dados pelo seu ID."""
+    try:
+        def apagar(conn):
+            cursor = conn.execute("DELETE FROM manutencao_itens WHERE id = ?", (item_id,))
+            return cursor.rowcount, motor_alertas.versao_na_transacao(conn)
+
+        def depois(resultado):
+            motor_alertas.registrar(resultado[1], item_id)
+            aviso_mudancas.avisar()
+
+        removidos, _ = executar_escrita(apagar, depois)
+        if removidos > 0:
+            return True, "Item removido com sucesso!"
+        else:
+            return False, "Item não encontrado."
+    except sqlite3.Error as e:
+        return False, f"Erro ao remover item: {e}"
+
+@instrumentar
+def editar_item(item_id, data):
+    """Edita um item no banco de dados pelo seu ID."""
+    try:
+        valores = _validar_item(data)
+
+        def atualizar(conn):
+            cursor = conn.execute(
+                """
+                UPDATE manutencao_itens
+                SET nome = ?, valor = ?, data_troca = ?, km_troca = ?, km_proxima = ?, meses_proxima = ?,
+                    proxima_km = ?, proxima_data = ?, veiculo_id = ?
+                WHERE id = ?
+                """,
+                valores + (item_id,)
+            )
+            return cursor.rowcount, motor_alertas.versao_na_transacao(conn)
+
+        def depois(resultado):
+            motor_alertas.registrar(resultado[1], item_id, valores[8], valores[6], valores[7])
+            aviso_mudancas.avisar()
+
+        alterados, _ = executar_escrita(atualizar, depois)
+        if alterados > 0:
+            return True, "Item atualizado com sucesso!"
+        else:
+            return False, "Item não encontrado."
+    except (ValueError, KeyError, TypeError, sqlite3.Error) as e:
+        return False, f"Erro ao atualizar item: {e}"
+
+@instrumentar
+def listar_veiculos(limite=LIMITE_PADRAO, after_id=None):
+    """Retorna uma página de veículos ordenados por id. Retorna (veiculos, proximo_after_id)."""
+    limite = int(limite)
+    if not 1 <= limite <= LIMITE_MAXIMO:
+        raise ValueError(f"O limite deve estar entre 1 e {LIMITE_MAXIMO}.")
+    with conexao() as conn:
+        registros = conn.execute(
+            "SELECT id, nome, placa FROM veiculos WHERE id > ? ORDER BY id LIMIT ?",
+            (int(after_id) if after_id is not None else 0, limite + 1)
+        ).fetchall()
+    proximo = None
+    if len(registros) > limite:
+        registros = registros[:limite]
+        proximo = registros[-1][0]
+    return [{'id': id, 'nome': nome, 'placa': placa} for id, nome, placa in registros], proximo
+
+@instrumentar
+def buscar_veiculo(veiculo_id):
+    """Busca um veículo pelo seu ID. Retorna None se não existir."""
+    with conexao() as conn:
+        reg = conn.execute("SELECT id, nome, placa FROM veiculos WHERE id = ?", (veiculo_id,)).fetchone()
+    if reg is None:
+        return None
+    id, nome, placa = reg
+    return {'id': id, 'nome': nome, 'placa': placa}
+
+@instrumentar
+def adicionar_veiculo(data):
+    """Adiciona um novo veículo. Retorna (sucesso, mensagem, id do veículo criado)."""
+    try:
+        nome = data['nome']
+        placa = data.get('placa')
+        with conexao() as conn:
+            cursor = conn.execute("INSERT INTO veiculos (nome, placa) VALUES (?, ?)", (nome, placa))
+            versao = motor_alertas.versao_na_transacao(conn)
+            conn.commit()
+        motor_alertas.registrar(versao)
+        return True, "Veículo adicionado com sucesso!", cursor.lastrowid
+    except (KeyError, TypeError, AttributeError, sqlite3.Error) as e:
+        return False, f"Erro ao adicionar veículo: {e}", None
+
+@instrumentar
+def editar_veiculo(veiculo_id, data):
+    """Edita o nome e a placa de um veículo."""
+    try:
+        nome = data['nome']
+        placa = data.get('placa')
+        with conexao() as conn:
+            cursor = conn.execute("UPDATE veiculos SET nome = ?, placa = ? WHERE id = ?", (nome, placa, veiculo_id))
+            versao = motor_alertas.versao_na_transacao(conn)
+            conn.commit()
+        motor_alertas.registrar(versao)
+        if cursor.rowcount > 0:
+            return True, "Veículo atualizado com sucesso!"
+        else:
+            return False, "Veículo não encontrado."
+    except (KeyError, TypeError, AttributeError, sqlite3.Error) as e:
+        return False, f"Erro ao atualizar veículo: {e}"
+
+@instrumentar
+def remover_veiculo(veiculo_id):
+    """Remove um veículo sem itens. Veículos com itens e o veículo padrão não podem ser removidos."""
+    if veiculo_id == VEICULO_PADRAO:
+        return False, "O veículo padrão não pode ser removido."
+    try:
+        with conexao() as conn:
+            cursor = conn.execute("DELETE FROM veiculos WHERE id = ?", (veiculo_id,))
+            versao = motor_alertas.versao_na_transacao(conn)
+            conn.commit()
+        motor_alertas.registrar(versao)
+        if cursor.rowcount > 0:
+            return True, "Veículo removido com sucesso!"
+        else:
+            return False, "Veículo não encontrado."
+    except sqlite3.IntegrityError:
+        return False, "O veículo possui itens de manutenção; remova-os antes."
+    except sqlite3.Error as e:
+        return False, f"Erro ao remover veículo: {e}"
+
+def iterar_itens(tamanho_bloco=1000):
+    """
+    Percorre todos os itens em blocos de 'tamanho_bloco' linhas, gerando listas de dicionários.
+    A memória usada depende do tamanho do bloco, não do tamanho da tabela.
+    """
+    with conexao() as conn:
+        cursor = conn.execute(SELECT_ITENS + " ORDER BY id")
+        while True:
+            registros = cursor.fetchmany(tamanho_bloco)
+            if not registros:
+                break
+            yield [_formatar_item(reg) for reg in registros]
+
+def gerar_linhas_relatorio(tamanho_bloco=1000, ao_avancar=None):
+    """
+    Gera o texto do relatório em pedaços, um por bloco de itens.
+    Os totais são acumulados durante a leitura, sem uma segunda passada pelos dados.
+    'ao_avancar', se informado, recebe o número de itens já processados a cada bloco.
+    """
+    yield "Relatório de Manutenção do Veículo\n"
+    yield "-----------------------------------\n\n"
+
+    total_itens = 0
+    total_gasto = 0
+
+    for bloco in iterar_itens(tamanho_bloco):
+        partes = []
+        for item in bloco:
+            partes.append(
+                f"Item: {item['nome']}\n"
+                f"  - Valor: R${item['valor']:.2f}\n"
+                f"  - Data da Troca: {item['data_troca']}\n"
+                f"  - KM da Troca: {item['km_troca']}\n"
+                f"  - Próxima Troca (KM): {item['proxima_troca_km_prevista']}\n"
+                f"  - Próxima Troca (Data): {item['proxima_data_formatada']}\n\n"
+            )
+            total_gasto += item['valor']
+        total_itens += len(bloco)
+        if ao_avancar:
+            ao_avancar(total_itens)
+        yield ''.join(partes)
+
+    if total_itens == 0:
+        yield "Nenhum item de manutenção registrado."
+    else:
+        yield "-----------------------------------\n"
+        yield "Resumo:\n"
+        yield f"  - Total de Itens: {total_itens}\n"
+        yield f"  - Gasto Total Acumulado: R${total_gasto:.2f}\n"
+
+@instrumentar
+def gerar_relatorio(caminho="relatorio_manutencao.txt", ao_avancar=None):
+    """Gera um relatório detalhado em um arquivo .txt na raiz do projeto."""
+    # Escrevemos num arquivo temporário ao lado do destino e só então o renomeamos,
+    # assim quem lê o relatório nunca vê um arquivo pela metade.
+    diretorio = os.path.dirname(os.path.abspath(caminho))
+    temporario = None
+    try:
+        fd, temporario = tempfile.mkstemp(prefix='.relatorio-', suffix='.tmp', dir=diretorio)
+        with open(fd, "w", encoding="utf-8") as f:
+            for pedaco in gerar_linhas_relatorio(ao_avancar=ao_avancar):
+                f.write(pedaco)
+        os.replace(temporario, caminho)
+        return True, "Relatório gerado com sucesso!"
+    except Exception as e:
+        if temporario and os.path.exists(temporario):
+            os.remove(temporario)
+        return False, f"Erro ao gerar relatório: {e}"
+
+# --- ESTATÍSTICAS DE GASTOS ---
+
+def _montar_estatisticas(por_nome, por_mes, origem):
+    """
+    Monta a resposta de estatísticas a partir das linhas agregadas.
+    por_nome: (nome, quantidade, centavos, soma_dos_intervalos_em_dias, quantidade_de_intervalos)
+    por_mes: (mes 'AAAA-MM', quantidade, centavos)
+    O intervalo médio é calculado dentro de cada veículo: em uma sequência ordenada de trocas,
+    a média dos intervalos consecutivos é (última - primeira) / (n - 1).
+    """
+    anos = {}
+    for mes, quantidade, centavos in por_mes:
+        ano = anos.setdefault(mes[:4], [0, 0])
+        ano[0] += quantidade
+        ano[1] += centavos
+
+    return {
+        'origem': origem,
+        'total': {
+            'quantidade': sum(q for _, q, _ in por_mes),
+            'gasto': round(sum(c for _, _, c in por_mes) / 100, 2),
+        },
+        'por_nome': [
+            {
+                'nome': nome,
+                'quantidade': quantidade,
+                'gasto': round(centavos / 100, 2),
+                'intervalo_medio_dias': round(soma_intervalos / intervalos, 1) if intervalos else None,
+            }
+            for nome, quantidade, centavos, soma_intervalos, intervalos in por_nome
+        ],
+        'por_mes': [
+            {'mes': mes, 'quantidade': quantidade, 'gasto': round(centavos / 100, 2)}
+            for mes, quantidade, centavos in por_mes
+        ],
+        'por_ano': [
+            {'ano': ano, 'quantidade': quantidade, 'gasto': round(centavos / 100, 2)}
+            for ano, (quantidade, centavos) in sorted(anos.items())
+        ],
+    }
+
+def _filtro_estatisticas(veiculo_id, de=None, ate=None):
+    condicoes = []
+    parametros = []
+    if veiculo_id is not None:
+        condicoes.append("veiculo_id = ?")
+        parametros.append(int(veiculo_id))
+    if de:
+        condicoes.append("data_troca >= ?")
+        parametros.append(datetime.date.fromisoformat(de).isoformat())
+    if ate:
+        condicoes.append("data_troca <= ?")
+        parametros.append(datetime.date.fromisoformat(ate).isoformat())
+    return (" WHERE " + " AND ".join(condicoes)) if condicoes else "", parametros
+
+@instrumentar
+def estatisticas_resumo(veiculo_id=None):
+    """Lê as estatísticas das tabelas de resumo: o custo depende do número de grupos, não de itens."""
+    filtro, parametros = _filtro_estatisticas(veiculo_id)
+    with conexao() as conn:
+        por_nome = conn.execute(f'''
+            SELECT nome, SUM(quantidade), SUM(total_centavos),
+                   SUM(julianday(ultima_troca) - julianday(primeira_troca)), SUM(quantidade - 1)
+            FROM resumo_por_nome{filtro} GROUP BY nome ORDER BY nome
+        ''', parametros).fetchall()
+        por_mes = conn.execute(
+            f"SELECT mes, SUM(quantidade), SUM(total_centavos) FROM resumo_por_mes{filtro} GROUP BY mes ORDER BY mes",
+            parametros
+        ).fetchall()
+    return _montar_estatisticas(por_nome, por_mes, 'resumo')
+
+@instrumentar
+def estatisticas_sql(veiculo_id=None, de=None, ate=None):
+    """Recalcula as estatísticas direto de manutencao_itens, sem usar os resumos."""
+    filtro, parametros = _filtro_estatisticas(veiculo_id, de, ate)
+    with conexao() as conn:
+        por_nome = conn.execute(f'''
+            SELECT nome, SUM(n), SUM(centavos), SUM(julianday(ultima) - julianday(primeira)), SUM(n - 1)
+            FROM (
+                SELECT nome, COUNT(*) AS n, SUM(CAST(ROUND(valor * 100) AS INTEGER)) AS centavos,
+                       MIN(data_troca) AS primeira, MAX(data_troca) AS ultima
+                FROM manutencao_itens{filtro} GROUP BY veiculo_id, nome
+            )
+            GROUP BY nome ORDER BY nome
+        ''', parametros).fetchall()
+        por_mes = conn.execute(f'''
+            SELECT substr(data_troca, 1, 7) AS mes, COUNT(*), SUM(CAST(ROUND(valor * 100) AS INTEGER))
+            FROM manutencao_itens{filtro} GROUP BY mes ORDER BY mes
+        ''', parametros).fetchall()
+    return _montar_estatisticas(por_nome, por_mes, 'sql')
+
+@instrumentar
+def estatisticas_pandas(veiculo_id=None, de=None, ate=None):
+    """
+    Calcula as estatísticas de um recorte qualquer com operações vetorizadas do pandas/NumPy.
+    Se o pandas não estiver instalado, recorre ao recálculo completo em SQL.
+    """
+    try:
+        import numpy as np
+        import pandas as pd
+    except ImportError:
+        return estatisticas_sql(veiculo_id, de, ate)
+
+    filtro, parametros = _filtro_estatisticas(veiculo_id, de, ate)
+    with conexao() as conn:
+        df = pd.read_sql_query(
+            f"SELECT veiculo_id, nome, valor, data_troca FROM manutencao_itens{filtro}", conn, params=parametros
+        )
+    if df.empty:
+        return _montar_estatisticas([], [], 'pandas')
+
+    df['centavos'] = np.rint(df['valor'].to_numpy() * 100).astype(np.int64)
+    df['dia'] = pd.to_datetime(df['data_troca'], format='%Y-%m-%d').to_numpy().astype('datetime64[D]').astype(np.int64)
+    df['mes'] = df['data_troca'].str.slice(0, 7)
+
+    grupos = df.groupby(['veiculo_id', 'nome'], sort=False).agg(
+        n=('dia', 'size'), centavos=('centavos', 'sum'), primeira=('dia', 'min'), ultima=('dia', 'max'),
+    )
+    grupos['intervalo'] = grupos['ultima'] - grupos['primeira']
+    grupos['pares'] = grupos['n'] - 1
+    por_nome = grupos.groupby(level='nome').agg(
+        n=('n', 'sum'), centavos=('centavos', 'sum'), intervalo=('intervalo', 'sum'), pares=('pares', 'sum'),
+    ).sort_index()
+    por_mes = df.groupby('mes').agg(n=('centavos', 'size'), centavos=('centavos', 'sum')).sort_index()
+
+    return _montar_estatisticas(
+        [(nome, int(r.n), int(r.centavos), float(r.intervalo), int(r.pares)) for nome, r in por_nome.iterrows()],
+        [(mes, int(r.n), int(r.centavos)) for mes, r in por_mes.iterrows()],
+        'pandas',
+    )
+
+@instrumentar
+def recalcular_resumos():
+    """Reconstrói as tabelas de resumo a partir dos itens, caso tenham se desalinhado."""
+    try:
+        with conexao() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for comando in _SQL_RECALCULAR_RESUMOS.split(';'):
+                if comando.strip():
+                    conn.execute(comando)
+            # Invalida as respostas de estatísticas já guardadas em cache.
+            conn.execute("UPDATE versao_dados SET versao = versao + 1 WHERE id = 1")
+            conn.commit()
+        return True, "Resumos recalculados com sucesso!"
+    except sqlite3.Error as e:
+        return False, f"Erro ao recalcular resumos: {e}"
+
+# --- ALERTAS DE VENCIMENTO ---
+
+ANTECEDENCIA_KM_PADRAO = 500   # a partir de quantos km antes da troca o item aparece como "próximo"
+ANTECEDENCIA_DIAS_PADRAO = 15  # idem, em dias
+# Cada entrada dos heaps é um único inteiro valor * FATOR_ID + id: ocupa bem menos memória
+# que uma tupla e ainda ordena pelo valor com o id desempatando.
+FATOR_ID = 1 << 40
+# julianday('0001-01-01') - 1: converte o dia juliano do SQLite em date.toordinal().
+JULIANO_ORDINAL = 1721424.5
+
+
+class MotorAlertas:
+    """
+    Índice em memória da próxima troca (km e data) de cada item, para responder aos alertas
+    sem varrer a tabela. Cada veículo tem dois min-heaps, um por km e outro por data;
+    os itens que vencem até um limite são lidos percorrendo só o topo do heap, em O(k).
+
+    O índice é montado no primeiro uso e depois atualizado a cada adicionar/editar/remover
+    deste processo. O contador de versao_dados diz se ele está em dia: escritas de outros
+    processos, importações em lote ou uma troca de banco fazem o índice ser remontado.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._limpar()
+
+    def _limpar(self):
+        self._pool = None
+        self.versao = None
+        # Valores atuais de cada item em arrays indexados pelo id (os ids são densos);
+        # veículo 0 marca um id que não está no índice.
+        self._veiculo = array.array('q')
+        self._km = array.array('q')
+        self._data = array.array('q')
+        self._veiculos = {}  # veiculo_id -> [heap km, heap data, entradas obsoletas]
+
+    def _crescer(self, item_id):
+        if item_id >= len(self._veiculo):
+            faltam = max(item_id + 1, 2 * len(self._veiculo)) - len(self._veiculo)
+            for coluna in (self._veiculo, self._km, self._data):
+                coluna.extend(itertools.repeat(0, faltam))
+
+    def _adicionar(self, item_id, veiculo_id, proxima_km, ordinal):
+        self._remover(item_id)
+        self._crescer(item_id)
+        self._veiculo[item_id] = veiculo_id
+        self._km[item_id] = proxima_km
+        self._data[item_id] = ordinal
+        filas = self._veiculos.setdefault(veiculo_id, [[], [], 0])
+        heapq.heappush(filas[0], proxima_km * FATOR_ID + item_id)
+        heapq.heappush(filas[1], ordinal * FATOR_ID + item_id)
+
+    def _remover(self, item_id):
+        if item_id >= len(self._veiculo) or not self._veiculo[item_id]:
+            return
+        veiculo_id = self._veiculo[item_id]
+        self._veiculo[item_id] = 0
+        # A entrada fica no heap e é ignorada nas consultas; os heaps são refeitos
+        # quando as obsoletas passam da metade, o que mantém a remoção O(1) amortizada.
+        filas = self._veiculos[veiculo_id]
+        filas[2] += 1
+        if filas[2] > 64 and filas[2] > len(filas[0]) // 2:
+            for indice in (0, 1):
+                filas[indice] = [chave for chave in filas[indice] if self._valida(chave, veiculo_id, indice)]
+                heapq.heapify(filas[indice])
+            filas[2] = 0
+
+    def _valida(self, chave, veiculo_id, indice):
+        """A entrada do heap ainda corresponde ao valor atual do item?"""
+        valor, item_id = divmod(chave, FATOR_ID)
+        return self._veiculo[item_id] == veiculo_id and (self._km, self._data)[indice][item_id] == valor
+
+    def _ate(self, veiculo_id, indice, limite):
+        """Ids das entradas válidas do heap com valor até 'limite', sem retirá-las do heap."""
+        heap = self._veiculos[veiculo_id][indice]
+        limite = (limite + 1) * FATOR_ID
+        pendentes = [0]
+        while pendentes:
+            posicao = pendentes.pop()
+            if posicao < len(heap) and heap[posicao] < limite:
+                if self._valida(heap[posicao], veiculo_id, indice):
+                    yield heap[posicao] % FATOR_ID
+                pendentes += (2 * posicao + 1, 2 * posicao + 2)
+
+    def _remontar(self, pool):
+        with pool.conexao() as conn:
+            # Versão e itens lidos na mesma transação de leitura formam um retrato consistente.
+            conn.execute("BEGIN")
+            try:
+                versao = conn.execute("SELECT versao FROM versao_dados WHERE id = 1").fetchone()[0]
+                registros = conn.execute(f'''
+                    SELECT id, veiculo_id, proxima_km,
+                           CAST(julianday(proxima_data) - {JULIANO_ORDINAL} AS INTEGER)
+                    FROM manutencao_itens ORDER BY id
+                ''').fetchall()
+            finally:
+                conn.rollback()
+        self._limpar()
+        if registros:
+            self._crescer(registros[-1][0])
+        for item_id, veiculo_id, proxima_km, ordinal in registros:
+            self._veiculo[item_id] = veiculo_id
+            self._km[item_id] = proxima_km
+            self._data[item_id] = ordinal
+            filas = self._veiculos.setdefault(veiculo_id, [[], [], 0])
+            filas[0].append(proxima_km * FATOR_ID + item_id)
+            filas[1].append(ordinal * FATOR_ID + item_id)
+        for filas in self._veiculos.values():
+            heapq.heapify(filas[0])
+            heapq.heapify(filas[1])
+        self._pool = pool
+        self.versao = versao
+
+    def atualizar(self):
+        """Remonta o índice se ele ainda não existe ou ficou para trás do banco."""
+        pool = obter_pool()
+        with pool.conexao() as conn:
+            versao = conn.execute("SELECT versao FROM versao_dados WHERE id = 1").fetchone()[0]
+        with self._lock:
+            if self._pool is not pool or self.versao != versao:
+                self._remontar(pool)
+
+    def versao_na_transacao(self, conn):
+        """
+        Versão dos dados vista por uma escrita ainda não commitada (None se o índice não
+        está em uso). Deve ser lida depois do comando, dentro da mesma transação.
+        """
+        if self._pool is None:
+            return None
+        return conn.execute("SELECT versao FROM versao_dados WHERE id = 1").fetchone()[0]
+
+    def registrar(self, versao, item_id=None, veiculo_id=None, proxima_km=None, proxima_data=None, passos=1):
+        """
+        Aplica ao índice uma escrita já commitada que levou os dados à 'versao'.
+        Sem veiculo_id, o item foi removido; sem item_id, a escrita não mexeu em itens
+        (veículos, leituras) e só a versão avança, em 'passos' linhas. Se alguma escrita
+        ficou de fora entre a versão do índice e esta, o índice é descartado e remontado
+        na próxima consulta.
+        """
+        if versao is None:
+            return
+        with self._lock:
+            if self.versao is None or versao <= self.versao:
+                return
+            if versao != self.versao + passos:
+                self._pool = self.versao = None
+                return
+            if item_id is not None and veiculo_id is None:
+                self._remover(item_id)
+            elif item_id is not None:
+                self._adicionar(item_id, veiculo_id, proxima_km,
+                                datetime.date.fromisoformat(proxima_data).toordinal())
+            self.versao = versao
+
+    def consultar(self, limite_km=None, limite_data=None, veiculo_id=None):
+        """
+        Itens com proxima_km <= limite_km ou proxima_data <= limite_data (date), como
+        tuplas (id, proxima_km, proxima_data como ordinal).
+        """
+        self.atualizar()
+        with self._lock:
+            veiculos = [veiculo_id] if veiculo_id is not None else list(self._veiculos)
+            encontrados = set()
+            for veiculo in veiculos:
+                if veiculo not in self._veiculos:
+                    continue
+                if limite_km is not None:
+                    encontrados.update(self._ate(veiculo, 0, limite_km))
+                if limite_data is not None:
+                    encontrados.update(self._ate(veiculo, 1, limite_data.toordinal()))
+            return [(item_id, self._km[item_id], self._data[item_id]) for item_id in encontrados]
+
+    def limpar(self):
+        with self._lock:
+            self._limpar()
+
+
+motor_alertas = MotorAlertas()
+
+
+@instrumentar
+def listar_alertas(km_atual=None, data=None, antecedencia_km=ANTECEDENCIA_KM_PADRAO,
+                   antecedencia_dias=ANTECEDENCIA_DIAS_PADRAO, limite=LIMITE_MAXIMO, veiculo_id=None):
+    """
+    Itens vencidos ou perto de vencer em 'data' (padrão: hoje) e/ou no km atual.
+    Cada item traz status 'vencido' ou 'proximo' (vence em até antecedencia_km km ou
+    antecedencia_dias dias); os vencidos vêm primeiro, depois pela próxima data.
+    """
+    data = datetime.date.fromisoformat(data) if data else datetime.date.today()
+    km_atual = int(km_atual) if km_atual is not None else None
+    antecedencia_km = int(antecedencia_km)
+    antecedencia_dias = int(antecedencia_dias)
+    if antecedencia_km < 0 or antecedencia_dias < 0:
+        raise ValueError("A antecedência não pode ser negativa.")
+    limite = int(limite)
+    if not 1 <= limite <= LIMITE_MAXIMO:
+        raise ValueError(f"O limite deve estar entre 1 e {LIMITE_MAXIMO}.")
+
+    encontrados = motor_alertas.consultar(
+        limite_km=km_atual + antecedencia_km if km_atual is not None else None,
+        limite_data=data + datetime.timedelta(days=antecedencia_dias),
+        veiculo_id=int(veiculo_id) if veiculo_id is not None else None,
+    )
+    # Os vencidos vêm primeiro, depois pela próxima data; só as linhas que entram
+    # na resposta são lidas do banco.
+    dia = data.toordinal()
+
+    def ordem(encontrado):
+        item_id, proxima_km, proxima_data = encontrado
+        vencido = (km_atual is not None and proxima_km <= km_atual) or proxima_data <= dia
+        return not vencido, proxima_data, item_id
+
+    ids = [item_id for item_id, _, _ in heapq.nsmallest(limite, encontrados, key=ordem)]
+    if not ids:
+        return []
+    with conexao() as conn:
+        registros = conn.execute(SELECT_ITENS + f" WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()
+
+    # O item pode ter mudado desde a consulta ao índice, então o status sai da linha lida.
+    hoje = data.isoformat()
+    itens = []
+    for reg in registros:
+        item = _formatar_item(reg)
+        item['vence_por_km'] = km_atual is not None and item['proxima_troca_km_prevista'] <= km_atual
+        item['vence_por_data'] = item['proxima_data_iso'] <= hoje
+        item['status'] = 'vencido' if item['vence_por_km'] or item['vence_por_data'] else 'proximo'
+        itens.append(item)
+    itens.sort(key=lambda item: (item['status'] != 'vencido', item['proxima_data_iso'], item['id']))
+    return previsao_km.anexar(itens)
+
+# --- IMPORTAÇÃO EM LOTE ---
+
+TAMANHO_LOTE = 5000
+MAX_ERROS_RELATADOS = 1000
+_ESPACOS = re.compile(r'[ \t\n\r]*')
+
+def _ler_json_array(texto, tamanho_bloco=64 * 1024):
+    """
+    Lê uma lista JSON de um arquivo de texto aos poucos, gerando (numero, objeto).
+    Só o trecho ainda não consumido fica em memória, nunca o corpo inteiro.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    aberto = False
+    separador_pendente = False
+    numero = 0
+    fim_arquivo = False
+    while True:
+        if not fim_arquivo:
+            bloco = texto.read(tamanho_bloco)
+            fim_arquivo = not bloco
+            buffer = buffer[pos:] + bloco
+            pos = 0
+        while True:
+            pos = _ESPACOS.match(buffer, pos).end()
+            if pos >= len(buffer):
+                break
+            if not aberto:
+                if buffer[pos] != '[':
+                    raise ValueError("O corpo JSON deve ser uma lista de itens.")
+                aberto = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            if buffer[pos] == ',' and separador_pendente:
+                separador_pendente = False
+                pos += 1
+                continue
+            if separador_pendente:
+                raise ValueError(f"JSON inválido após o registro {numero}.")
+            try:
+                objeto, fim = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if fim_arquivo:
+                    raise ValueError(f"JSON inválido após o registro {numero}.")
+                break
+            if fim == len(buffer) and not fim_arquivo:
+                # O valor pode continuar no próximo bloco (ex.: um número cortado ao meio).
+                break
+            numero += 1
+            pos = fim
+            separador_pendente = True
+            yield numero, objeto
+        if fim_arquivo:
+            raise ValueError("JSON incompleto: a lista não foi fechada.")
+
+def _ler_ndjson(texto):
+    """
+    Gera (numero, objeto) para cada linha não vazia. Uma linha que não é JSON válido
+    gera (numero, erro), para ser relatada sem interromper a leitura das seguintes.
+    """
+    for numero, linha in enumerate(texto, start=1):
+        if linha.strip():
+            try:
+                yield numero, json.loads(linha)
+            except ValueError as e:
+                yield numero, e
+
+def _ler_csv(texto):
+    """Gera (numero, registro) a partir de um CSV com cabeçalho."""
+    for numero, registro in enumerate(csv.DictReader(texto), start=1):
+        yield numero, registro
+
+LEITORES_LOTE = {
+    'json': _ler_json_array,
+    'ndjson': _ler_ndjson,
+    'csv': _ler_csv,
+}
+
+INSERT_LOTE_TEMPORARIO = (
+    f"INSERT INTO temp.lote_itens ({', '.join(COLUNAS_TABELA[1:])}) "
+    f"VALUES ({', '.join('?' * (len(COLUNAS_TABELA) - 1))})"
+)
+INSERT_DO_LOTE_TEMPORARIO = (
+    f"INSERT INTO manutencao_itens ({', '.join(COLUNAS_TABELA[1:])}) "
+    f"SELECT {', '.join(COLUNAS_TABELA[1:])} FROM temp.lote_itens ORDER BY rowid"
+)
+
+def _inserir_lote(lote):
+    """
+    Insere um lote de (numero, valores) em uma única transação.
+    Se alguma linha violar uma restrição do banco, o lote é refeito linha a linha
+    para que só as linhas ruins fiquem de fora. Retorna (inseridos, erros).
+    """
+    with conexao() as conn:
+        try:
+            # Um INSERT com triggers abre um journal de instrução a cada execução. Passando o lote
+            # por uma tabela temporária, um único INSERT ... SELECT paga esse custo uma vez por lote.
+            conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS lote_itens ({', '.join(COLUNAS_TABELA[1:])})")
+            conn.executemany(INSERT_LOTE_TEMPORARIO, [valores for _, valores in lote])
+            conn.execute(INSERT_DO_LOTE_TEMPORARIO)
+            conn.execute("DELETE FROM temp.lote_itens")
+            conn.commit()
+            aviso_mudancas.avisar()
+            return len(lote), []
+        except sqlite3.IntegrityError:
+            conn.rollback()
+
+        inseridos = 0
+        erros = []
+        for numero, valores in lote:
+            try:
+                conn.execute(INSERT_ITEM, valores)
+                inseridos += 1
+            except sqlite3.IntegrityError as e:
+                erros.append((numero, str(e)))
+        conn.commit()
+    aviso_mudancas.avisar()
+    return inseridos, erros
+
+def _importar(registros, validar, inserir, descricao, tamanho_lote):
+    """
+    Valida cada (numero, dados) de 'registros' com 'validar' e grava os válidos em lotes
+    com 'inserir'. Linhas inválidas são relatadas e puladas sem interromper o restante.
+    Retorna um dicionário com o total inserido e os erros encontrados.
+    """
+    resultado = {'inseridos': 0, 'total_erros': 0, 'erros': []}
+
+    def registrar_erro(numero, mensagem):
+        resultado['total_erros'] += 1
+        if len(resultado['erros']) < MAX_ERROS_RELATADOS:
+            resultado['erros'].append({'registro': numero, 'mensagem': mensagem})
+
+    def descarregar(lote):
+        try:
+            inseridos, erros = inserir(lote)
+        except sqlite3.Error as e:
+            for numero, _ in lote:
+                registrar_erro(numero, f"Erro ao adicionar {descricao}: {e}")
+            return
+        resultado['inseridos'] += inseridos
+        for numero, mensagem in erros:
+            registrar_erro(numero, f"Erro ao adicionar {descricao}: {mensagem}")
+
+    lote = []
+    try:
+        for numero, dados in registros:
+            try:
+                if isinstance(dados, ValueError):
+                    raise dados
+                if not isinstance(dados, dict):
+                    raise TypeError(f"o registro deve ser um objeto, não {type(dados).__name__}.")
+                lote.append((numero, validar(dados)))
+            except (ValueError, KeyError, TypeError) as e:
+                registrar_erro(numero, f"Erro ao adicionar {descricao}: {e}")
+                continue
+            if len(lote) >= tamanho_lote:
+                descarregar(lote)
+                lote = []
+    except (ValueError, csv.Error) as e:
+        # Erro de leitura do corpo: não dá para continuar, mas o que já foi lido é gravado.
+        registrar_erro(None, f"Erro ao ler os dados: {e}")
+    if lote:
+        descarregar(lote)
+    return resultado
+
+@instrumentar
+def importar_itens(registros, tamanho_lote=TAMANHO_LOTE):
+    """
+    Valida e insere itens vindos de um iterável de (numero, dados).
+    Retorna um dicionário com o total inserido e os erros encontrados.
+    """
+    return _importar(registros, _validar_item, _inserir_lote, 'item', tamanho_lote)
+
+# --- LEITURAS DE ODÔMETRO E PREVISÃO ---
+
+JANELA_PREVISAO_DIAS = 365  # só as leituras deste período (até a última de cada veículo) entram no ajuste
+
+def _validar_leitura(data):
+    """
+    Valida uma leitura do odômetro recebida pela API. Retorna (veiculo_id, data ISO, km).
+    Lança ValueError, KeyError ou TypeError se algum campo for inválido.
+    """
+    veiculo_id = int(data.get('veiculo_id', VEICULO_PADRAO))
+    dia = _ler_data(data['data']).isoformat()
+    km = int(data['km'])
+    if km < 0:
+        raise ValueError("A km da leitura não pode ser negativa.")
+    return veiculo_id, dia, km
+
+def _inserir_leituras(lote):
+    """Insere um lote de (numero, valores) de leituras; mesmo contrato de _inserir_lote."""
+    with conexao() as conn:
+        try:
+            conn.executemany("INSERT INTO leituras_odometro (veiculo_id, data, km) VALUES (?, ?, ?)",
+                             [valores for _, valores in lote])
+            inseridos, erros = len(lote), []
+        except sqlite3.IntegrityError:
+            # Veículo inexistente em alguma linha: refaz linha a linha para separar só as ruins.
+            conn.rollback()
+            inseridos, erros = 0, []
+            for numero, valores in lote:
+                try:
+                    conn.execute("INSERT INTO leituras_odometro (veiculo_id, data, km) VALUES (?, ?, ?)", valores)
+                    inseridos += 1
+                except sqlite3.IntegrityError as e:
+                    erros.append((numero, str(e)))
+        versao = motor_alertas.versao_na_transacao(conn)
+        conn.commit()
+    # Cada leitura avança a versão dos dados uma vez (trigger), sem mexer nos itens.
+    motor_alertas.registrar(versao, passos=inseridos)
+    return inseridos, erros
+
+@instrumentar
+def importar_leituras(registros, tamanho_lote=TAMANHO_LOTE):
+    """
+    Valida e insere leituras do odômetro ({veiculo_id, data, km}) vindas de um iterável
+    de (numero, dados). Retorna um dicionário com o total inserido e os erros encontrados.
+    """
+    return _importar(registros, _validar_leitura, _inserir_leituras, 'leitura', tamanho_lote)
+
+@instrumentar
+def listar_leituras(veiculo_id, limite=LIMITE_MAXIMO):
+    """Leituras mais recentes do odômetro de um veículo, da mais nova para a mais antiga."""
+    limite = int(limite)
+    if not 1 <= limite <= LIMITE_MAXIMO:
+        raise ValueError(f"O limite deve estar entre 1 e {LIMITE_MAXIMO}.")
+    with conexao() as conn:
+        registros = conn.execute(
+            "SELECT id, data, km FROM leituras_odometro WHERE veiculo_id = ? ORDER BY data DESC, id DESC LIMIT ?",
+            (veiculo_id, limite),
+        ).fetchall()
+    return [{'id': id, 'data': data, 'km': km} for id, data, km in registros]
+
+def _ajustar_taxas(veiculos, dias, kms):
+    """
+    Ajusta por mínimos quadrados a reta km = a + taxa * dia de cada veículo, usando as
+    leituras dos últimos JANELA_PREVISAO_DIAS dias até a leitura mais recente dele.
+    As listas vêm ordenadas por veículo e data. Retorna {veiculo_id: (taxa em km/dia,
+    dia da última leitura como ordinal, km da última leitura)}; veículos com menos de
+    duas datas ou sem aumento de km ficam de fora.
+    """
+    if not veiculos:
+        return {}
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+    if np is not None:
+        # Todos os veículos de uma vez: somas por grupo com bincount, sem laço por veículo ou item.
+        veiculos = np.asarray(veiculos, dtype=np.int64)
+        x = np.asarray(dias, dtype=np.float64)
+        y = np.asarray(kms, dtype=np.float64)
+        ids, grupo = np.unique(veiculos, return_inverse=True)
+        ultimas = np.append(np.flatnonzero(np.diff(grupo)), len(grupo) - 1)
+        na_janela = x >= x[ultimas][grupo] - JANELA_PREVISAO_DIAS
+        grupo, x, y = grupo[na_janela], x[na_janela], y[na_janela]
+        quantidade = np.bincount(grupo, minlength=len(ids))
+        # Centralizar em cada grupo evita perder precisão com os ordinais (~740 mil) ao quadrado.
+        dx = x - (np.bincount(grupo, x, len(ids)) / quantidade)[grupo]
+        dy = y - (np.bincount(grupo, y, len(ids)) / quantidade)[grupo]
+        sxx = np.bincount(grupo, dx * dx, len(ids))
+        sxy = np.bincount(grupo, dx * dy, len(ids))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            taxas = np.where(sxx > 0, sxy / sxx, 0.0)
+        return {
+            veiculo: (taxa, dia, km)
+            for veiculo, taxa, dia, km in zip(ids.tolist(), taxas.tolist(), np.asarray(dias)[ultimas].tolist(),
+                                              np.asarray(kms)[ultimas].tolist())
+            if taxa > 0
+        }
+
+    # Sem NumPy: as mesmas somas, acumuladas numa passada pelas leituras.
+    ultimas = {}
+    for veiculo, dia, km in zip(veiculos, dias, kms):
+        ultimas[veiculo] = (dia, km)
+    somas = {}
+    for veiculo, dia, km in zip(veiculos, dias, kms):
+        if dia >= ultimas[veiculo][0] - JANELA_PREVISAO_DIAS:
+            soma = somas.setdefault(veiculo, [0, 0, 0, []])
+            soma[0] += 1
+            soma[1] += dia
+            soma[2] += km
+            soma[3].append((dia, km))
+    taxas = {}
+    for veiculo, (quantidade, soma_x, soma_y, pontos) in somas.items():
+        media_x, media_y = soma_x / quantidade, soma_y / quantidade
+        sxx = sum((dia - media_x) ** 2 for dia, _ in pontos)
+        sxy = sum((dia - media_x) * (km - media_y) for dia, km in pontos)
+        if sxx > 0 and sxy / sxx > 0:
+            taxas[veiculo] = (sxy / sxx, *ultimas[veiculo])
+    return taxas
+
+
+class PrevisaoKm:
+    """
+    Taxa de km por dia de cada veículo, ajustada sobre as leituras do odômetro e guardada
+    até chegarem leituras novas (versao_leituras), para estimar em que data cada item
+    atinge a sua km de troca.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chave = None
+        self._taxas = {}
+
+    def taxas(self):
+        """{veiculo_id: (km por dia, ordinal da última leitura, km da última leitura)}"""
+        pool = obter_pool()
+        with pool.conexao() as conn:
+            versao = conn.execute("SELECT versao_leituras FROM versao_dados WHERE id = 1").fetchone()[0]
+            with self._lock:
+                if self._chave == (pool, versao):
+                    return self._taxas
+                conn.execute("BEGIN")
+                try:
+                    versao = conn.execute("SELECT versao_leituras FROM versao_dados WHERE id = 1").fetchone()[0]
+                    registros = conn.execute(f'''
+                        SELECT veiculo_id, CAST(julianday(data) - {JULIANO_ORDINAL} AS INTEGER), km
+                        FROM leituras_odometro ORDER BY veiculo_id, data
+                    ''').fetchall()
+                finally:
+                    conn.rollback()
+                self._taxas = _ajustar_taxas(*zip(*registros)) if registros else {}
+                self._chave = (pool, versao)
+                return self._taxas
+
+    def anexar(self, itens):
+        """
+        Preenche em cada item 'proxima_km_data_prevista': a data (ISO) em que o veículo deve
+        chegar a proxima_troca_km_prevista no ritmo atual, ou None sem leituras suficientes.
+        """
+        if not itens:
+            return itens
+        taxas = self.taxas()
+        for item in itens:
+            item['proxima_km_data_prevista'] = None
+            ajuste = taxas.get(item['veiculo_id'])
+            if ajuste is not None:
+                taxa, dia, km = ajuste
+                try:
+                    data = datetime.date.fromordinal(dia + math.ceil((item['proxima_troca_km_prevista'] - km) / taxa))
+                except (ValueError, OverflowError):
+                    continue  # ritmo tão lento que a data sai do calendário
+                item['proxima_km_data_prevista'] = data.isoformat()
+        return itens
+
+    def limpar(self):
+        with self._lock:
+            self._chave = None
+            self._taxas = {}
+
+
+previsao_km = PrevisaoKm()
+
+# --- MUDANÇAS DOS ITENS ---
+
+INTERVALO_MUDANCAS = 0.5  # s; de quanto em quanto tempo a espera confere o banco (escritas de outros processos)
+ESPERA_MAXIMA_MUDANCAS = 30  # s; maior espera aceita no long-poll
+BATIMENTO_EVENTOS = 15  # s; sem mudanças, o stream de eventos manda um comentário para manter a conexão
+
+SELECT_MUDANCAS = (
+    f"SELECT m.seq, m.item_id, m.removido, {', '.join('i.' + coluna for coluna in COLUNAS_TABELA)} "
+    "FROM mudancas_itens m LEFT JOIN manutencao_itens i ON i.id = m.item_id "
+    "WHERE m.seq > ? ORDER BY m.seq LIMIT ?"
+)
+
+def ultima_mudanca():
+    """Sequência da escrita mais recente em manutencao_itens (0 se nunca houve escrita)."""
+    with conexao() as conn:
+        return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM mudancas_itens").fetchone()[0]
+
+@instrumentar
+def listar_mudancas(desde, limite=LIMITE_MAXIMO):
+    """
+    Itens inseridos, alterados ou removidos depois da sequência 'desde'. Um item alterado
+    várias vezes aparece uma vez só, com o estado atual. Retorna {'versao', 'itens',
+    'removidos', 'mais'}: 'versao' é o 'desde' da próxima chamada e 'mais' indica que
+    o limite cortou a resposta. Se 'desde' está à frente do banco (banco trocado ou
+    restaurado), retorna 'recarregar': True e o cliente deve refazer a carga completa.
+    """
+    desde = int(desde)
+    limite = int(limite)
+    if desde < 0:
+        raise ValueError("desde não pode ser negativo.")
+    if not 1 <= limite <= LIMITE_MAXIMO:
+        raise ValueError(f"O limite deve estar entre 1 e {LIMITE_MAXIMO}.")
+
+    with conexao() as conn:
+        registros = conn.execute(SELECT_MUDANCAS, (desde, limite + 1)).fetchall()
+        if not registros:
+            ultima = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM mudancas_itens").fetchone()[0]
+            if desde > ultima:
+                return {'versao': ultima, 'itens': [], 'removidos': [], 'mais': False, 'recarregar': True}
+            return {'versao': desde, 'itens': [], 'removidos': [], 'mais': False}
+
+    mais = len(registros) > limite
+    registros = registros[:limite]
+    itens = []
+    removidos = []
+    for seq, item_id, removido, *reg in registros:
+        if removido or reg[0] is None:
+            removidos.append(item_id)
+        else:
+            itens.append(_formatar_item(reg))
+    return {'versao': registros[-1][0], 'itens': previsao_km.anexar(itens), 'removidos': removidos, 'mais': mais}
+
+
+class AvisoMudancas:
+    """
+    Acorda quem espera por mudanças (long-poll e stream de eventos). As escritas deste
+    processo avisam na hora; as de outros processos são percebidas conferindo o banco
+    a cada INTERVALO_MUDANCAS segundos.
+    """
+
+    def __init__(self):
+        self._condicao = threading.Condition()
+        self._ouvintes = []
+
+    def avisar(self):
+        with self._condicao:
+            self._condicao.notify_all()
+            ouvintes = list(self._ouvintes)
+        for ouvinte in ouvintes:
+            ouvinte()
+
+    def ouvir(self, ouvinte):
+        """Registra uma função chamada a cada escrita deste processo (usada pelo ponto de entrada ASGI)."""
+        with self._condicao:
+            self._ouvintes.append(ouvinte)
+
+    def aguardar(self, desde, tempo):
+        """Espera até 'tempo' segundos por uma mudança depois de 'desde'. Retorna se houve mudança."""
+        limite = time.monotonic() + tempo
+        while ultima_mudanca() <= desde:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return False
+            with self._condicao:
+                self._condicao.wait(min(restante, INTERVALO_MUDANCAS))
+        return True
+
 
-# --- LÓGICA DO BANCO DE DADOS ---
+aviso_mudancas = AvisoMudancas()
 
-def conectar_bd():
-    """Conecta ao banco de dados e cria a tabela se não existir."""
-    conn = sqlite3.connect('manutencao.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS manutencao_itens (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome TEXT NOT NULL,
-            valor REAL NOT NULL,
-            data_troca TEXT NOT NULL,
-            km_troca INTEGER NOT NULL,
-            km_proxima INTEGER NOT NULL,
-            meses_proxima INTEGER NOT NULL
-        )
-    ''')
-    conn.commit()
-    return conn, cursor
+def formatar_evento_mudancas(dados):
+    """Evento Server-Sent Events com um lote de mudanças; o id permite retomar com Last-Event-ID."""
+    return f"id: {dados['versao']}\nevent: mudancas\ndata: {app.json.dumps(dados)}\n\n"
 
-def carregar_itens():
-    """Carrega todos os itens do banco de dados, sem filtro."""
-    conn = None
-    try:
-        conn = sqlite3.connect('manutencao.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM manutencao_itens")
-        registros = cursor.fetchall()
-        itens = []
-        
-        for reg in registros:
-            id, nome, valor, data_troca_str, km_troca, km_proxima, meses_proxima = reg
-            
-            data_troca = datetime.datetime.strptime(data_troca_str, '%Y-%m-%d').date()
-            proxima_troca_km_prevista = km_troca + km_proxima
-            proxima_data = data_troca + datetime.timedelta(days=meses_proxima * 30)
-            
-            itens.append({
+# --- FILA DE RELATÓRIOS ---
+
+DIRETORIO_RELATORIOS = os.environ.get('MANUTENCAO_RELATORIOS', 'relatorios')
+TRABALHADORES_RELATORIO = int(os.environ.get('MANUTENCAO_RELATORIO_WORKERS', '2'))
+MAX_RELATORIOS_PENDENTES = int(os.environ.get('MANUTENCAO_RELATORIO_FILA', '16'))
+MAX_RELATORIOS_GUARDADOS = 20
+
+
+class FilaRelatorios:
+    """
+    Gera relatórios em segundo plano num número fixo de threads.
+    Cada trabalho grava num arquivo próprio, então pedidos simultâneos não disputam o
+    mesmo destino. Pedidos feitos com a tabela na mesma versão (versao_dados) reaproveitam
+    o trabalho em andamento ou o arquivo já pronto. Os trabalhos ficam na memória do
+    processo: com vários processos, cada um mantém a sua fila.
+    """
+
+    def __init__(self, diretorio, trabalhadores=2, max_pendentes=16, max_guardados=20):
+        self.diretorio = diretorio
+        self.trabalhadores = trabalhadores
+        self.max_pendentes = max_pendentes
+        self.max_guardados = max_guardados
+        self._executor = None
+        self._lock = threading.Lock()
+        self._trabalhos = collections.OrderedDict()  # id -> estado, do mais antigo ao mais novo
+        self._por_chave = {}  # (banco, versão dos dados) -> id
+
+    def solicitar(self):
+        """
+        Retorna (trabalho, novo) para a versão atual dos dados, reaproveitando um trabalho
+        equivalente quando possível. Retorna (None, False) se a fila estiver cheia.
+        """
+        chave = (obter_pool().caminho, obter_versao_dados())
+        with self._lock:
+            existente = self._trabalhos.get(self._por_chave.get(chave))
+            if existente is not None and existente['status'] != 'erro' and (
+                    existente['status'] != 'concluido' or os.path.exists(existente['caminho'])):
+                return dict(existente), False
+
+            pendentes = sum(t['status'] in ('pendente', 'executando') for t in self._trabalhos.values())
+            if pendentes >= self.max_pendentes:
+                return None, False
+
+            os.makedirs(self.diretorio, exist_ok=True)
+            id = secrets.token_hex(8)
+            trabalho = {
                 'id': id,
-                'nome': nome,
-                'valor': valor,
-                'data_troca': data_troca.strftime('%Y-%m-%d'),
-                'km_troca': km_troca,
-                'km_proxima': km_proxima,
-                'meses_proxima': meses_proxima,
-                'proxima_data_formatada': proxima_data.strftime('%d/%m/%Y'),
-                'proxima_troca_km_prevista': proxima_troca_km_prevista,
-                'proxima_data_iso': proxima_data.isoformat()
-            })
-        return itens
-    finally:
-        if conn:
-            conn.close()
+                'status': 'pendente',
+                'processados': 0,
+                'total': None,
+                'versao_dados': chave[1],
+                'criado_em': datetime.datetime.now().isoformat(timespec='seconds'),
+                'concluido_em': None,
+                'mensagem': None,
+                'caminho': os.path.abspath(os.path.join(self.diretorio, f"relatorio-{id}.txt")),
+            }
+            self._trabalhos[id] = trabalho
+            self._por_chave[chave] = id
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.trabalhadores, thread_name_prefix='relatorio')
+            self._executor.submit(self._executar, id)
+            return dict(trabalho), True
 
-def adicionar_item(data):
-    """Adiciona um novo item ao banco de dados."""
-    conn = None
-    try:
-        conn = sqlite3.connect('manutencao.db')
-        cursor = conn.cursor()
-        nome = data['nome']
-        valor = float(data['valor'])
-        data_troca_str = data['data_troca']
-        km_troca = int(data['km_troca'])
-        km_proxima = int(data['km_proxima'])
-        meses_proxima = int(data['meses_proxima'])
-        
-        cursor.execute(
-            "INSERT INTO manutencao_itens (nome, valor, data_troca, km_troca, km_proxima, meses_proxima) VALUES (?, ?, ?, ?, ?, ?)",
-            (nome, valor, data_troca_str, km_troca, km_proxima, meses_proxima)
+    def obter(self, id):
+        with self._lock:
+            trabalho = self._trabalhos.get(id)
+            return dict(trabalho) if trabalho is not None else None
+
+    def _atualizar(self, id, **campos):
+        with self._lock:
+            self._trabalhos[id].update(campos)
+
+    def _executar(self, id):
+        try:
+            with conexao() as conn:
+                total = conn.execute("SELECT COUNT(*) FROM manutencao_itens").fetchone()[0]
+            self._atualizar(id, status='executando', total=total)
+            sucesso, mensagem = gerar_relatorio(
+                self._trabalhos[id]['caminho'], lambda n: self._atualizar(id, processados=n))
+        except Exception as e:
+            sucesso, mensagem = False, f"Erro ao gerar relatório: {e}"
+        self._atualizar(
+            id,
+            status='concluido' if sucesso else 'erro',
+            mensagem=mensagem,
+            concluido_em=datetime.datetime.now().isoformat(timespec='seconds'),
         )
-        conn.commit()
-        return True, "Item adicionado com sucesso!"
-    except (ValueError, KeyError, sqlite3.Error) as e:
-        return False, f"Erro ao adicionar item: {e}"
-    finally:
-        if conn:
-            conn.close()
+        self._descartar_antigos()
 
-def remover_item(item_id):
-    """Remove um item do banco de dados pelo seu ID."""
-    conn = None
-    try:
-        conn = sqlite3.connect('manutencao.db')
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM manutencao_itens WHERE id = ?", (item_id,))
-        conn.commit()
-        if cursor.rowcount > 0:
-            return True, "Item removido com sucesso!"
+    def _descartar_antigos(self, manter=None):
+        """Mantém só os 'manter' trabalhos terminados mais recentes (e seus arquivos)."""
+        manter = self.max_guardados if manter is None else manter
+        with self._lock:
+            terminados = [t for t in self._trabalhos.values() if t['status'] in ('concluido', 'erro')]
+            descartados = terminados[:max(len(terminados) - manter, 0)]
+            for trabalho in descartados:
+                del self._trabalhos[trabalho['id']]
+            self._por_chave = {c: i for c, i in self._por_chave.items() if i in self._trabalhos}
+        for trabalho in descartados:
+            with contextlib.suppress(OSError):
+                os.remove(trabalho['caminho'])
+
+    def limpar(self):
+        """Esquece os trabalhos terminados e apaga seus arquivos (os em andamento continuam)."""
+        self._descartar_antigos(manter=0)
+
+    def fechar(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+fila_relatorios = FilaRelatorios(
+    DIRETORIO_RELATORIOS, TRABALHADORES_RELATORIO, MAX_RELATORIOS_PENDENTES, MAX_RELATORIOS_GUARDADOS)
+
+
+def descrever_trabalho(trabalho):
+    """Representação pública de um trabalho de relatório (sem o caminho no servidor)."""
+    total = trabalho['total']
+    descricao = {
+        'id': trabalho['id'],
+        'status': trabalho['status'],
+        'progresso': {
+            'processados': trabalho['processados'],
+            'total': total,
+            'percentual': round(100 * trabalho['processados'] / total, 1) if total else
+            (100.0 if trabalho['status'] == 'concluido' else 0.0),
+        },
+        'versao_dados': trabalho['versao_dados'],
+        'criado_em': trabalho['criado_em'],
+        'concluido_em': trabalho['concluido_em'],
+        'mensagem': trabalho['mensagem'],
+        'url': f"/api/relatorio/{trabalho['id']}",
+    }
+    if trabalho['status'] == 'concluido':
+        descricao['download'] = f"/api/relatorio/{trabalho['id']}/arquivo"
+    return descricao
+
+
+def solicitar_relatorio():
+    """Enfileira (ou reaproveita) um relatório e retorna (dados, status HTTP)."""
+    trabalho, novo = fila_relatorios.solicitar()
+    if trabalho is None:
+        return {'mensagem': 'Fila de relatórios cheia. Tente novamente em instantes.'}, 503
+    status = 200 if trabalho['status'] == 'concluido' else 202
+    return descrever_trabalho(trabalho), status
+
+# --- EXPORTAÇÃO E SNAPSHOTS ---
+
+FORMATOS_EXPORTACAO = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+DIRETORIO_SNAPSHOTS = os.environ.get('MANUTENCAO_SNAPSHOTS', 'snapshots')
+PAGINAS_POR_PASSO_SNAPSHOT = int(os.environ.get('MANUTENCAO_SNAPSHOT_PAGINAS', '256'))
+PAUSA_SNAPSHOT = float(os.environ.get('MANUTENCAO_SNAPSHOT_PAUSA_MS', '1')) / 1000
+PADRAO_SNAPSHOT = re.compile(r'^manutencao-\d{8}-\d{6}-[0-9a-f]{6}\.db(\.gz)?$')
+BLOCO_COPIA = 1024 * 1024
+
+
+def gerar_exportacao(formato, tamanho_bloco=1000):
+    """
+    Gera a tabela de itens em pedaços de texto no 'formato' (csv ou ndjson), um pedaço
+    por bloco de 'tamanho_bloco' linhas. Uma única consulta lê tudo, então a exportação
+    é consistente mesmo com escritas acontecendo; a memória depende só do bloco.
+    O CSV tem as mesmas colunas aceitas por /api/itens/lote e pode ser importado de volta.
+    """
+    if formato not in FORMATOS_EXPORTACAO:
+        raise ValueError(f"Formato de exportação inválido: {formato}")
+    with conexao() as conn:
+        cursor = conn.execute(SELECT_ITENS + " ORDER BY id")
+        if formato == 'csv':
+            saida = io.StringIO()
+            escritor = csv.writer(saida, lineterminator='\n')
+            escritor.writerow(COLUNAS_TABELA)
+            while True:
+                registros = cursor.fetchmany(tamanho_bloco)
+                if not registros:
+                    break
+                escritor.writerows(registros)
+                yield saida.getvalue()
+                saida.seek(0)
+                saida.truncate()
+            if saida.tell():
+                yield saida.getvalue()  # só o cabeçalho, com a tabela vazia
         else:
-            return False, "Item não encontrado."
-    except sqlite3.Error as e:
-        return False, f"Erro ao remover item: {e}"
-    finally:
-        if conn:
-            conn.close()
+            codificar = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+            while True:
+                registros = cursor.fetchmany(tamanho_bloco)
+                if not registros:
+                    break
+                yield ''.join(codificar(dict(zip(COLUNAS_TABELA, reg))) + '\n' for reg in registros)
 
-def editar_item(item_id, data):
-    """Edita um item no banco de dados pelo seu ID."""
-    conn = None
+
+def _copiar_arquivo(origem, destino, abrir_origem=open, abrir_destino=open):
+    with abrir_origem(origem, 'rb') as entrada, abrir_destino(destino, 'wb') as saida:
+        shutil.copyfileobj(entrada, saida, BLOCO_COPIA)
+
+
+def _apagar_se_existe(*caminhos):
+    for caminho in caminhos:
+        if caminho and os.path.exists(caminho):
+            os.remove(caminho)
+
+
+@instrumentar
+def criar_snapshot(diretorio=None, comprimir=False, paginas_por_passo=None, pausa=None):
+    """
+    Copia o banco em uso para um arquivo novo em 'diretorio' com a API de backup do SQLite,
+    'paginas_por_passo' páginas por vez e 'pausa' segundos entre os passos. A cópia lê
+    dentro de uma única transação de leitura, então reflete um instante só, e no modo WAL
+    leitores e escritores seguem trabalhando durante todo o processo. Com 'comprimir', o
+    arquivo final é gzip. Retorna a descrição do snapshot.
+    """
+    diretorio = diretorio or DIRETORIO_SNAPSHOTS
+    paginas_por_passo = PAGINAS_POR_PASSO_SNAPSHOT if paginas_por_passo is None else int(paginas_por_passo)
+    pausa = PAUSA_SNAPSHOT if pausa is None else float(pausa)
+    if paginas_por_passo < 1:
+        raise ValueError("O snapshot precisa copiar pelo menos uma página por passo.")
+    os.makedirs(diretorio, exist_ok=True)
+    nome = f"manutencao-{datetime.datetime.now():%Y%m%d-%H%M%S}-{secrets.token_hex(3)}.db"
+    if comprimir:
+        nome += '.gz'
+    fd, temporario = tempfile.mkstemp(prefix='.snapshot-', suffix='.tmp', dir=diretorio)
+    os.close(fd)
+    comprimido = temporario + '.gz' if comprimir else None
+    passos = 0
+
+    def progresso(status, restantes, total):
+        nonlocal passos
+        passos += 1
+        if pausa > 0 and restantes:
+            time.sleep(pausa)
+
+    inicio = time.perf_counter()
     try:
-        conn = sqlite3.connect('manutencao.db')
-        cursor = conn.cursor()
-        nome = data['nome']
-        valor = float(data['valor'])
-        data_troca_str = data['data_troca']
-        km_troca = int(data['km_troca'])
-        km_proxima = int(data['km_proxima'])
-        meses_proxima = int(data['meses_proxima'])
-        
-        cursor.execute(
-            """
-            UPDATE manutencao_itens
-            SET nome = ?, valor = ?, data_troca = ?, km_troca = ?, km_proxima = ?, meses_proxima = ?
-            WHERE id = ?
-            """,
-            (nome, valor, data_troca_str, km_troca, km_proxima, meses_proxima, item_id)
-        )
-        conn.commit()
-        if cursor.rowcount > 0:
-            return True, "Item atualizado com sucesso!"
-        else:
-            return False, "Item não encontrado."
-    except (ValueError, KeyError, sqlite3.Error) as e:
-        return False, f"Erro ao atualizar item: {e}"
-    finally:
-        if conn:
-            conn.close()
+        destino = sqlite3.connect(temporario)
+        try:
+            with conexao() as conn:
+                conn.execute("BEGIN")
+                versao = conn.execute("SELECT versao FROM versao_dados WHERE id = 1").fetchone()[0]
+                conn.backup(destino, pages=paginas_por_passo, progress=progresso)
+                conn.rollback()
+            # O snapshot vira um arquivo só, sem -wal ao lado.
+            destino.execute("PRAGMA journal_mode=DELETE")
+            paginas = destino.execute("PRAGMA page_count").fetchone()[0]
+        finally:
+            destino.close()
+        if comprimir:
+            _copiar_arquivo(temporario, comprimido, abrir_destino=functools.partial(gzip.open, compresslevel=6))
+            os.remove(temporario)
+            temporario = comprimido
+        caminho = os.path.join(diretorio, nome)
+        os.replace(temporario, caminho)
+    except BaseException:
+        _apagar_se_existe(temporario, comprimido)
+        raise
+    return {
+        'arquivo': nome,
+        'caminho': os.path.abspath(caminho),
+        'bytes': os.path.getsize(caminho),
+        'paginas': paginas,
+        'passos': passos,
+        'comprimido': comprimir,
+        'versao_dados': versao,
+        'duracao_s': round(time.perf_counter() - inicio, 3),
+    }
 
-def gerar_relatorio():
-    """Gera um relatório detalhado em um arquivo .txt na raiz do projeto."""
-    itens = carregar_itens()
-    relatorio_texto = "Relatório de Manutenção do Veículo\n"
-    relatorio_texto += "-----------------------------------\n\n"
-    
-    total_gasto = 0
-    
-    if not itens:
-        relatorio_texto += "Nenhum item de manutenção registrado."
-    else:
-        for item in itens:
-            relatorio_texto += f"Item: {item['nome']}\n"
-            relatorio_texto += f"  - Valor: R${item['valor']:.2f}\n"
-            relatorio_texto += f"  - Data da Troca: {item['data_troca']}\n"
-            relatorio_texto += f"  - KM da Troca: {item['km_troca']}\n"
-            relatorio_texto += f"  - Próxima Troca (KM): {item['proxima_troca_km_prevista']}\n"
-            relatorio_texto += f"  - Próxima Troca (Data): {item['proxima_data_formatada']}\n\n"
-            total_gasto += item['valor']
-        
-        relatorio_texto += "-----------------------------------\n"
-        relatorio_texto += f"Resumo:\n"
-        relatorio_texto += f"  - Total de Itens: {len(itens)}\n"
-        relatorio_texto += f"  - Gasto Total Acumulado: R${total_gasto:.2f}\n"
 
+def listar_snapshots(diretorio=None):
+    """Snapshots guardados em 'diretorio', do mais novo para o mais antigo."""
+    diretorio = diretorio or DIRETORIO_SNAPSHOTS
+    if not os.path.isdir(diretorio):
+        return []
+    snapshots = []
+    for nome in sorted(os.listdir(diretorio), reverse=True):
+        if PADRAO_SNAPSHOT.match(nome):
+            caminho = os.path.join(diretorio, nome)
+            snapshots.append({
+                'arquivo': nome,
+                'bytes': os.path.getsize(caminho),
+                'criado_em': datetime.datetime.fromtimestamp(os.path.getmtime(caminho)).isoformat(timespec='seconds'),
+                'comprimido': nome.endswith('.gz'),
+            })
+    return snapshots
+
+
+@instrumentar
+def restaurar_snapshot(caminho):
+    """
+    Substitui o conteúdo do banco em uso pelo snapshot em 'caminho' (comprimido ou não).
+    O snapshot é conferido e migrado para o esquema atual numa cópia temporária antes de
+    tocar no banco, e a troca é feita pela API de backup numa única etapa, então as outras
+    conexões veem o banco antigo ou o restaurado, nunca uma mistura. Os contadores de
+    versão avançam além dos atuais, para que nenhum cache sirva dados de antes da troca,
+    e os itens que deixaram de existir aparecem como removidos em /api/itens/mudancas.
+    Escritas feitas durante a restauração se perdem. Retorna a descrição do banco restaurado.
+    """
+    if not os.path.isfile(caminho):
+        raise FileNotFoundError(f"Snapshot não encontrado: {caminho}")
+    pool = obter_pool()
+    fd, temporario = tempfile.mkstemp(prefix='.restauracao-', suffix='.db',
+                                      dir=os.path.dirname(os.path.abspath(pool.caminho)))
+    os.close(fd)
+    copia = None
     try:
-        with open("relatorio_manutencao.txt", "w") as f:
-            f.write(relatorio_texto)
-        return True, "Relatório gerado com sucesso!"
-    except Exception as e:
-        return False, f"Erro ao gerar relatório: {e}"
+        _copiar_arquivo(caminho, temporario, abrir_origem=gzip.open if caminho.endswith('.gz') else open)
+        fonte = sqlite3.connect(temporario)
+        try:
+            if fonte.execute("PRAGMA quick_check").fetchone()[0] != 'ok':
+                raise sqlite3.DatabaseError(f"O snapshot {caminho} está corrompido.")
+            if fonte.execute("PRAGMA user_version").fetchone()[0] > len(MIGRACOES):
+                raise sqlite3.DatabaseError("O snapshot é de uma versão mais nova da aplicação.")
+        finally:
+            fonte.close()
+        copia = PoolConexoes(temporario, 1, **pool.pragmas)
+        inicializar_bd(copia)
+
+        with copia.conexao() as fonte:
+            fonte.execute("ATTACH DATABASE ? AS atual", (pool.caminho,))
+            fonte.execute("BEGIN IMMEDIATE")
+            fonte.execute(
+                "UPDATE main.versao_dados SET "
+                "versao = MAX(versao, (SELECT versao FROM atual.versao_dados WHERE id = 1)) + 1, "
+                "versao_leituras = MAX(versao_leituras, (SELECT versao_leituras FROM atual.versao_dados WHERE id = 1)) + 1"
+            )
+            # Todas as mudanças do snapshot ficam depois da última sequência que os clientes já viram.
+            fonte.execute("UPDATE main.mudancas_itens SET seq = -seq")
+            fonte.execute("UPDATE main.mudancas_itens SET seq = (SELECT COALESCE(MAX(seq), 0) FROM atual.mudancas_itens) - seq")
+            fonte.execute(
+                """
+                INSERT OR IGNORE INTO main.mudancas_itens (item_id, seq, removido)
+                SELECT a.id, (SELECT MAX(seq) FROM main.mudancas_itens) + ROW_NUMBER() OVER (ORDER BY a.id), 1
+                FROM atual.manutencao_itens a
+                WHERE a.id NOT IN (SELECT id FROM main.manutencao_itens)
+                """
+            )
+            fonte.commit()
+            fonte.execute("DETACH DATABASE atual")
+            with pool.conexao() as conn:
+                fonte.backup(conn)
+    finally:
+        if copia is not None:
+            copia.fechar()
+        _apagar_se_existe(temporario, temporario + '-wal', temporario + '-shm')
+
+    motor_alertas.atualizar()
+    aviso_mudancas.avisar()
+    with conexao() as conn:
+        itens = conn.execute("SELECT COUNT(*) FROM manutencao_itens").fetchone()[0]
+    return {'arquivo': os.path.basename(caminho), 'itens': itens, 'versao_dados': obter_versao_dados()}
+
+# --- MANUTENÇÃO DO BANCO ---
+
+INTERVALO_MANUTENCAO = float(os.environ.get('MANUTENCAO_BD_MANUTENCAO_S', '60'))  # 0 desliga a tarefa
+INTERVALO_OTIMIZAR = float(os.environ.get('MANUTENCAO_BD_OTIMIZAR_S', '3600'))
+PAGINAS_VACUUM_POR_PASSO = int(os.environ.get('MANUTENCAO_BD_VACUUM_PAGINAS', '128'))
+TEMPO_MAXIMO_VACUUM = float(os.environ.get('MANUTENCAO_BD_VACUUM_MS', '50')) / 1000  # por volta
+LIMITE_ANALISE = 1000  # PRAGMA analysis_limit: linhas lidas por índice no ANALYZE
+# Varrer uma tabela menor que isto (segundo o sqlite_stat1) é a escolha certa do planejador.
+LINHAS_MINIMAS_VARREDURA = int(os.environ.get('MANUTENCAO_BD_VARREDURA_LINHAS', '1000'))
+MODOS_AUTO_VACUUM = ('none', 'full', 'incremental')
+
+# Consultas quentes da API, com parâmetros de exemplo, cujo plano entra no relatório.
+# Uma delas passar a varrer uma tabela grande inteira aparece em 'varreduras' e no log.
+CONSULTAS_MONITORADAS = (
+    ('listar_itens', SELECT_ITENS + " WHERE id > ? ORDER BY id LIMIT ?", (0, 51)),
+    ('listar_itens_por_nome', SELECT_ITENS + " WHERE nome >= ? AND nome < ? ORDER BY nome, id LIMIT ?",
+     ('Óleo', 'Óleo\U0010ffff', 51)),
+    ('listar_itens_por_data', SELECT_ITENS + " WHERE (data_troca, id) > (?, ?) ORDER BY data_troca, id LIMIT ?",
+     ('2024-01-01', 0, 51)),
+    ('listar_itens_veiculo', SELECT_ITENS + " WHERE veiculo_id = ? AND id > ? ORDER BY id LIMIT ?", (1, 0, 51)),
+    ('buscar_item', SELECT_ITENS + " WHERE id = ?", (1,)),
+    ('listar_vencimentos', _sql_vencimentos(('proxima_km', 'proxima_data'), False),
+     (10000, 500, '2024-01-01', 500, 500)),
+    ('listar_vencimentos_veiculo', _sql_vencimentos(('proxima_km', 'proxima_data'), True),
+     (1, 10000, 500, 1, '2024-01-01', 500, 500)),
+    ('buscar_itens', "SELECT n.nome FROM itens_fts JOIN nomes_itens n ON n.id = itens_fts.rowid "
+                     "WHERE itens_fts MATCH ? ORDER BY itens_fts.rank, n.quantidade DESC, n.nome", ('"oleo"*',)),
+    ('listar_mudancas', SELECT_MUDANCAS, (0, 501)),
+    ('listar_leituras', "SELECT id, data, km FROM leituras_odometro WHERE veiculo_id = ? "
+                        "ORDER BY data DESC, id DESC LIMIT ?", (1, 50)),
+)
+_VARREDURA = re.compile(r'^SCAN (\w+)$')
+
+
+def _linhas_por_tabela(conn):
+    """Número de linhas de cada tabela segundo o sqlite_stat1 (vazio antes do primeiro ANALYZE)."""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+        return {}
+    linhas = {}
+    for tabela, stat in conn.execute("SELECT tbl, stat FROM sqlite_stat1"):
+        # O primeiro número de 'stat' é o total de linhas, em qualquer índice da tabela.
+        linhas[tabela] = max(linhas.get(tabela, 0), int(stat.split(' ', 1)[0]))
+    return linhas
+
+
+def planos_consultas(conn):
+    """
+    EXPLAIN QUERY PLAN de cada consulta monitorada. Retorna (planos, varreduras): o texto
+    de cada passo do plano por consulta e os nomes das que varrem uma tabela inteira com
+    pelo menos LINHAS_MINIMAS_VARREDURA linhas. Sem estatísticas não há como saber o
+    tamanho, e nenhuma varredura é apontada.
+    """
+    linhas = _linhas_por_tabela(conn)
+    planos = {}
+    varreduras = []
+    for nome, sql, parametros in CONSULTAS_MONITORADAS:
+        passos = [linha[3] for linha in conn.execute("EXPLAIN QUERY PLAN " + sql, parametros)]
+        planos[nome] = passos
+        tabelas = [encontrada.group(1) for encontrada in map(_VARREDURA.match, passos) if encontrada]
+        if any(linhas.get(tabela, 0) >= LINHAS_MINIMAS_VARREDURA for tabela in tabelas):
+            varreduras.append(nome)
+    return planos, varreduras
+
+
+class ManutencaoBd:
+    """
+    Manutenção periódica do banco numa thread de fundo. A cada 'intervalo' segundos, se o
+    banco estiver ocioso (nenhuma conexão emprestada e nenhuma escrita desde a volta
+    anterior), devolve as páginas livres ao sistema com PRAGMA incremental_vacuum, em
+    passos de 'paginas_por_passo' e por no máximo 'tempo_maximo' segundos, parando antes
+    se aparecer trabalho. A cada 'intervalo_otimizar' segundos confere os planos das
+    consultas monitoradas e roda PRAGMA optimize (ANALYZE completo na primeira vez).
+    """
+
+    def __init__(self, intervalo=60, intervalo_otimizar=3600, paginas_por_passo=128, tempo_maximo=0.05):
+        if paginas_por_passo < 1:
+            raise ValueError("O vacuum incremental precisa liberar pelo menos uma página por passo.")
+        self.intervalo = intervalo
+        self.intervalo_otimizar = intervalo_otimizar
+        self.paginas_por_passo = paginas_por_passo
+        self.tempo_maximo = tempo_maximo
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+        self._versao_vista = None
+        self._proxima_otimizacao = 0
+        self._estatisticas = {
+            'voltas': 0,
+            'voltas_ociosas': 0,
+            'paginas_liberadas': 0,
+            'otimizacoes': 0,
+            'compactacoes': 0,
+            'ultima_volta': None,
+            'ultima_otimizacao': None,
+            'varreduras': [],
+            'erro': None,
+        }
+
+    def iniciar(self):
+        """Inicia a thread de fundo (nada acontece com intervalo 0 ou se ela já está rodando)."""
+        with self._lock:
+            if self.intervalo <= 0 or self._thread is not None:
+                return
+            self._parar.clear()
+            self._thread = threading.Thread(target=self._laco, name='manutencao-bd', daemon=True)
+            self._thread.start()
+
+    def parar(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        self._parar.set()
+        if thread is not None:
+            thread.join()
+
+    def _laco(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                self.executar()
+            except sqlite3.Error as e:
+                # Banco ocupado por outro processo, por exemplo; tenta de novo na próxima volta.
+                log_sql.warning("Falha na manutenção do banco: %s", e)
+                with self._lock:
+                    self._estatisticas['erro'] = str(e)
+
+    def executar(self, forcar=False):
+        """
+        Faz uma volta de manutenção. Com 'forcar', não espera o banco ficar ocioso, ignora
+        o limite de tempo do vacuum e otimiza mesmo fora do horário.
+        """
+        pool = obter_pool()
+        ocioso = pool.estatisticas()['em_uso'] == 0
+        versao = obter_versao_dados()
+        ocioso = ocioso and versao == self._versao_vista
+        self._versao_vista = versao
+
+        liberadas = self.recuperar_paginas(pool, forcar) if ocioso or forcar else 0
+        otimizado = False
+        if forcar or time.monotonic() >= self._proxima_otimizacao:
+            self.otimizar(pool)
+            otimizado = True
+        with self._lock:
+            self._estatisticas['voltas'] += 1
+            self._estatisticas['voltas_ociosas'] += ocioso
+            self._estatisticas['ultima_volta'] = datetime.datetime.now().isoformat(timespec='seconds')
+            self._estatisticas['erro'] = None
+        return {'ocioso': ocioso, 'paginas_liberadas': liberadas, 'otimizado': otimizado}
+
+    def recuperar_paginas(self, pool, forcar=False):
+        """Devolve páginas livres em passos curtos; cada passo é uma transação de escrita própria."""
+        liberadas = 0
+        limite = time.monotonic() + self.tempo_maximo
+        with pool.conexao() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+                return 0
+            livres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            while livres:
+                # O pragma devolve uma linha sem colunas por página, e o execute() pararia na
+                # primeira; o executescript() roda o comando até o fim.
+                conn.executescript(f"PRAGMA incremental_vacuum({self.paginas_por_passo});")
+                restantes = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                liberadas += livres - restantes
+                if restantes >= livres:
+                    break
+                livres = restantes
+                if not forcar and (time.monotonic() >= limite or pool.estatisticas()['em_uso'] > 1):
+                    break
+            if liberadas:
+                # Só o checkpoint encolhe o arquivo; PASSIVE não espera leitores nem escritores.
+                conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        with self._lock:
+            self._estatisticas['paginas_liberadas'] += liberadas
+        return liberadas
+
+    def compactar(self, pool):
+        """
+        Reescreve o arquivo com VACUUM, o que também converte para auto_vacuum=INCREMENTAL
+        um banco criado antes da migração. As escritas esperam enquanto ele roda, então só
+        é feito quando pedido (POST /api/bd/manutencao?compactar=1 ou 'snapshot.py compactar').
+        """
+        with pool.conexao() as conn:
+            antes = conn.execute("PRAGMA page_count").fetchone()[0]
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            depois = conn.execute("PRAGMA page_count").fetchone()[0]
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        with self._lock:
+            self._estatisticas['compactacoes'] += 1
+        return {'paginas_antes': antes, 'paginas_depois': depois}
+
+    def otimizar(self, pool):
+        """
+        Confere os planos das consultas monitoradas e atualiza as estatísticas do planejador.
+        Os planos são preparados na mesma conexão antes do PRAGMA optimize, que só analisa
+        as tabelas usadas por consultas daquela conexão.
+        """
+        with pool.conexao() as conn:
+            planos_consultas(conn)
+            conn.execute(f"PRAGMA analysis_limit = {LIMITE_ANALISE}")
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+                conn.execute("ANALYZE")
+            else:
+                conn.execute("PRAGMA optimize")
+            _, varreduras = planos_consultas(conn)  # já com as estatísticas novas
+        if varreduras:
+            log_sql.warning("Consultas monitoradas varrendo uma tabela grande inteira: %s", ', '.join(varreduras))
+        with self._lock:
+            self._estatisticas['otimizacoes'] += 1
+            self._estatisticas['ultima_otimizacao'] = datetime.datetime.now().isoformat(timespec='seconds')
+            self._estatisticas['varreduras'] = varreduras
+        self._proxima_otimizacao = time.monotonic() + self.intervalo_otimizar
+
+    def estatisticas(self):
+        with self._lock:
+            dados = dict(self._estatisticas)
+        dados.update({'intervalo_s': self.intervalo, 'ativa': self._thread is not None})
+        return dados
+
+
+manutencao_bd = ManutencaoBd(INTERVALO_MANUTENCAO, INTERVALO_OTIMIZAR, PAGINAS_VACUUM_POR_PASSO,
+                             TEMPO_MAXIMO_VACUUM)
+
+
+@instrumentar
+def relatorio_bd():
+    """Tamanho do arquivo, páginas livres, modo de auto_vacuum e planos das consultas monitoradas."""
+    pool = obter_pool()
+    with pool.conexao() as conn:
+        def pragma(nome):
+            return conn.execute(f"PRAGMA {nome}").fetchone()[0]
+
+        tamanho_pagina = pragma('page_size')
+        dados = {
+            'arquivo_bytes': os.path.getsize(pool.caminho),
+            'wal_bytes': os.path.getsize(pool.caminho + '-wal') if os.path.exists(pool.caminho + '-wal') else 0,
+            'tamanho_pagina': tamanho_pagina,
+            'paginas': pragma('page_count'),
+            'paginas_livres': pragma('freelist_count'),
+            'auto_vacuum': MODOS_AUTO_VACUUM[pragma('auto_vacuum')],
+            'estatisticas_planejador': conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is not None,
+        }
+        dados['bytes_livres'] = dados['paginas_livres'] * tamanho_pagina
+        dados['planos'], dados['varreduras'] = planos_consultas(conn)
+    dados['manutencao'] = manutencao_bd.estatisticas()
+    return dados
+
+# --- CACHE DE RESPOSTAS ---
+
+TAMANHO_MINIMO_COMPRESSAO = 1024  # bytes; corpos menores não compensam a compressão
+CACHE_MAX_BYTES = int(os.environ.get('MANUTENCAO_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+
+class CacheRespostas:
+    """
+    Guarda o JSON já serializado de respostas GET, indexado pela chave da requisição
+    e válido apenas para uma versão dos dados. As versões comprimidas são criadas
+    sob demanda e guardadas junto. Quando passa de 'max_bytes', descarta as entradas
+    usadas há mais tempo.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entradas = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def obter(self, chave, versao):
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None or entrada['versao'] != versao:
+                return None
+            self._entradas.move_to_end(chave)
+            return entrada
+
+    def guardar(self, chave, versao, corpo):
+        entrada = {
+            'versao': versao,
+            'etag': hashlib.sha1(corpo).hexdigest()[:20],
+            'identity': corpo,
+        }
+        with self._lock:
+            antiga = self._entradas.pop(chave, None)
+            if antiga is not None:
+                self._bytes -= self._tamanho(antiga)
+            self._entradas[chave] = entrada
+            self._bytes += self._tamanho(entrada)
+            self._podar()
+        return entrada
+
+    def comprimido(self, chave, entrada, codificacao):
+        """Retorna o corpo na codificação pedida, comprimindo só na primeira vez."""
+        corpo = entrada.get(codificacao)
+        if corpo is None:
+            if codificacao == 'br':
+                corpo = brotli.compress(entrada['identity'], quality=5)
+            else:
+                corpo = gzip.compress(entrada['identity'], compresslevel=6)
+            with self._lock:
+                if self._entradas.get(chave) is entrada and codificacao not in entrada:
+                    entrada[codificacao] = corpo
+                    self._bytes += len(corpo)
+                    self._podar()
+        return corpo
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    @staticmethod
+    def _tamanho(entrada):
+        return sum(len(entrada[c]) for c in ('identity', 'gzip', 'br') if c in entrada)
+
+    def _podar(self):
+        while self._bytes > self.max_bytes and len(self._entradas) > 1:
+            _, removida = self._entradas.popitem(last=False)
+            self._bytes -= self._tamanho(removida)
+
+
+_cache_respostas = CacheRespostas(CACHE_MAX_BYTES)
+
+
+@instrumentar
+def serializar_json(dados):
+    """Serializa 'dados' exatamente como o jsonify do Flask."""
+    return app.json.response(dados).get_data()
+
+def preparar_resposta_json(chave, produzir, if_none_match=None, accept_encoding=None):
+    """
+    Prepara a resposta de um GET usando o cache de respostas e ETags fortes,
+    sem depender do objeto request (serve tanto ao Flask quanto ao ponto de entrada ASGI).
+    'produzir' só é chamado quando não há entrada para a versão atual dos dados; deve
+    retornar (dados, status). Respostas com status diferente de 200 não são guardadas.
+    Se o If-None-Match do cliente bater com a ETag, devolve 304 sem corpo.
+    Retorna (status, cabecalhos, corpo).
+    """
+    versao = obter_versao_dados()
+    entrada = _cache_respostas.obter(chave, versao)
+    if entrada is None:
+        dados, status = produzir()
+        if status != 200:
+            return status, {'Content-Type': 'application/json'}, serializar_json(dados)
+        entrada = _cache_respostas.guardar(chave, versao, serializar_json(dados))
+
+    codificacao = 'identity'
+    if len(entrada['identity']) >= TAMANHO_MINIMO_COMPRESSAO:
+        aceitas = parse_accept_header(accept_encoding)
+        if brotli is not None and aceitas['br']:
+            codificacao = 'br'
+        elif aceitas['gzip']:
+            codificacao = 'gzip'
+
+    # Cada codificação é uma representação diferente, então recebe uma ETag forte própria.
+    etag = entrada['etag'] if codificacao == 'identity' else f"{entrada['etag']}-{codificacao}"
+    cabecalhos = {'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache', 'ETag': quote_etag(etag)}
+    if parse_etags(if_none_match).contains(etag):
+        return 304, cabecalhos, b''
+
+    cabecalhos['Content-Type'] = 'application/json'
+    if codificacao == 'identity':
+        return 200, cabecalhos, entrada['identity']
+    cabecalhos['Content-Encoding'] = codificacao
+    return 200, cabecalhos, _cache_respostas.comprimido(chave, entrada, codificacao)
+
+def resposta_json_condicional(chave, produzir):
+    """Versão de preparar_resposta_json para as rotas Flask."""
+    status, cabecalhos, corpo = preparar_resposta_json(
+        chave, produzir, request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding')
+    )
+    return Response(corpo, status=status, headers=cabecalhos)
 
 # --- APLICAÇÃO WEB COM FLASK ---
 
 app = Flask(__name__)
 
+if METRICAS_ATIVAS:
+    @app.before_request
+    def _iniciar_medicao():
+        request.environ['manutencao.inicio'] = time.perf_counter()
+
+    @app.after_request
+    def _registrar_medicao(resposta):
+        # O rótulo é o padrão da rota ('/api/itens/<int:item_id>'), não a URL, para não explodir a cardinalidade.
+        rota = request.url_rule.rule if request.url_rule is not None else '<sem rota>'
+        inicio = request.environ.get('manutencao.inicio')
+        if inicio is not None:
+            metricas.registrar_requisicao(rota, request.method, resposta.status_code, time.perf_counter() - inicio)
+        return resposta
+
 @app.route('/')
 def index():
     """Rota principal que serve o HTML da aplicação."""
     return render_template('index.html')
 
+def _responder_listagem(veiculo_id):
+    """Monta a resposta de uma listagem paginada a partir dos parâmetros da URL."""
+    args = request.args
+    return resposta_json_condicional(('itens', veiculo_id, request.query_string),
+                                     lambda: consultar_itens(args, veiculo_id))
+
+def _responder_vencimentos(veiculo_id):
+    """Monta a resposta da consulta de vencimentos a partir dos parâmetros da URL."""
+    try:
+        itens = listar_vencimentos(
+            km_atual=request.args.get('km_atual'),
+            ate=request.args.get('ate'),
+            limite=request.args.get('limit', LIMITE_MAXIMO),
+            veiculo_id=veiculo_id,
+        )
+    except ValueError as e:
+        return jsonify({'mensagem': f"Parâmetros inválidos: {e}"}), 400
+    return jsonify({'itens': itens})
+
+def _responder_alertas(veiculo_id):
+    """Monta a resposta da consulta de alertas a partir dos parâmetros da URL."""
+    args = request.args
+    try:
+        itens = listar_alertas(
+            km_atual=args.get('km_atual'),
+            data=args.get('data'),
+            antecedencia_km=args.get('antecedencia_km', ANTECEDENCIA_KM_PADRAO),
+            antecedencia_dias=args.get('antecedencia_dias', ANTECEDENCIA_DIAS_PADRAO),
+            limite=args.get('limit', LIMITE_MAXIMO),
+            veiculo_id=veiculo_id,
+        )
+    except ValueError as e:
+        return jsonify({'mensagem': f"Parâmetros inválidos: {e}"}), 400
+    return jsonify({'itens': itens})
+
 @app.route('/api/itens', methods=['GET', 'POST'])
 def handle_itens():
     """
     Endpoint da API para manipular os itens de manutenção.
-    - GET: Retorna todos os itens do banco de dados.
+    - GET: Retorna uma página de itens. Parâmetros opcionais: limit, after_id, cursor,
+      nome (prefixo), data_de, data_ate, km_min, km_max, ordenar e ordem.
+      Com q, faz a busca textual por nome (só aceita limit e cursor junto).
     - POST: Adiciona um novo item ao banco de dados.
     """
     if request.method == 'GET':
-        itens = carregar_itens()
-        return jsonify(itens)
+        return _responder_listagem(None)
 
     elif request.method == 'POST':
         data = request.json
@@ -191,6 +3177,89 @@ def handle_itens():
         else:
             return jsonify({'mensagem': mensagem}), 400
 
+def _registros_do_corpo():
+    """
+    Lê o corpo de uma importação em lote no formato de ?formato=json|ndjson|csv ou do
+    Content-Type. Retorna (iterável de (numero, dados), formato); None no lugar do
+    iterável se o formato for inválido.
+    """
+    formato = request.args.get('formato')
+    if formato is None:
+        formato = {
+            'application/x-ndjson': 'ndjson',
+            'application/ndjson': 'ndjson',
+            'application/jsonl': 'ndjson',
+            'text/csv': 'csv',
+        }.get(request.mimetype, 'json')
+    leitor = LEITORES_LOTE.get(formato)
+    if leitor is None:
+        return None, formato
+    texto = io.TextIOWrapper(io.BufferedReader(request.stream), encoding='utf-8-sig', newline='')
+    return leitor(texto), formato
+
+@app.route('/api/itens/lote', methods=['POST'])
+def handle_lote():
+    """
+    Endpoint da API para importar muitos itens de uma vez.
+    Aceita uma lista JSON, NDJSON (um item por linha) ou CSV com cabeçalho.
+    O formato vem de ?formato=json|ndjson|csv ou do Content-Type.
+    """
+    registros, formato = _registros_do_corpo()
+    if registros is None:
+        return jsonify({'mensagem': f"Formato inválido: {formato}"}), 400
+    resultado = importar_itens(registros)
+    if resultado['inseridos'] == 0 and resultado['total_erros'] == 0:
+        resultado['mensagem'] = "Nenhum item recebido."
+        return jsonify(resultado), 400
+    resultado['mensagem'] = f"{resultado['inseridos']} itens adicionados, {resultado['total_erros']} com erro."
+    return jsonify(resultado), 201 if resultado['inseridos'] else 400
+
+@app.route('/api/itens/mudancas', methods=['GET'])
+def handle_mudancas():
+    """
+    Endpoint da API com as mudanças nos itens desde a sequência 'desde'.
+    Sem 'desde', só informa a versão atual (ponto de partida depois de uma carga completa).
+    - espera=N (até 30 s): long-poll; se não houver mudanças, segura a resposta até surgir uma.
+    - Accept: text/event-stream: Server-Sent Events, um evento 'mudancas' por lote,
+      retomando de Last-Event-ID na reconexão.
+    """
+    args = request.args
+    desde = request.headers.get('Last-Event-ID') or args.get('desde')
+    try:
+        if desde is None:
+            return jsonify({'versao': ultima_mudanca(), 'itens': [], 'removidos': [], 'mais': False})
+        desde = int(desde)
+        limite = int(args.get('limit', LIMITE_MAXIMO))
+        espera = min(float(args.get('espera', 0)), ESPERA_MAXIMA_MUDANCAS)
+        dados = listar_mudancas(desde, limite)
+    except ValueError as e:
+        return jsonify({'mensagem': f"Parâmetros inválidos: {e}"}), 400
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        def eventos(dados):
+            while True:
+                if dados['itens'] or dados['removidos'] or dados.get('recarregar'):
+                    yield formatar_evento_mudancas(dados)
+                elif not aviso_mudancas.aguardar(dados['versao'], BATIMENTO_EVENTOS):
+                    yield ": batimento\n\n"
+                dados = listar_mudancas(dados['versao'], limite)
+
+        return Response(stream_with_context(eventos(dados)), content_type='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    if espera > 0 and not (dados['itens'] or dados['removidos'] or dados.get('recarregar')):
+        if aviso_mudancas.aguardar(desde, espera):
+            dados = listar_mudancas(desde, limite)
+    return jsonify(dados)
+
+@app.route('/api/itens/vencendo', methods=['GET'])
+def handle_vencendo():
+    """
+    Endpoint da API com os itens que já devem ser trocados.
+    Parâmetros: km_atual (KM atual da moto) e/ou ate (data AAAA-MM-DD), e limit opcional.
+    """
+    return _responder_vencimentos(None)
+
 @app.route('/api/itens/<int:item_id>', methods=['GET', 'DELETE', 'PUT'])
 def handle_item(item_id):
     """
@@ -200,29 +3269,14 @@ def handle_item(item_id):
     - DELETE: Remove um item existente.
     """
     if request.method == 'GET':
-        conn = None
-        try:
-            conn = sqlite3.connect('manutencao.db')
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM manutencao_itens WHERE id = ?", (item_id,))
-            reg = cursor.fetchone()
-            if reg:
-                id, nome, valor, data_troca, km_troca, km_proxima, meses_proxima = reg
-                item = {
-                    'id': id,
-                    'nome': nome,
-                    'valor': valor,
-                    'data_troca': data_troca,
-                    'km_troca': km_troca,
-                    'km_proxima': km_proxima,
-                    'meses_proxima': meses_proxima
-                }
-                return jsonify(item)
+        def produzir():
+            item = buscar_item(item_id)
+            if item:
+                return item, 200
             else:
-                return jsonify({'mensagem': 'Item não encontrado.'}), 404
-        finally:
-            if conn:
-                conn.close()
+                return {'mensagem': 'Item não encontrado.'}, 404
+
+        return resposta_json_condicional(('item', item_id), produzir)
 
     elif request.method == 'PUT':
         data = request.json
@@ -239,16 +3293,294 @@ def handle_item(item_id):
         else:
             return jsonify({'mensagem': mensagem}), 404
 
-@app.route('/api/relatorio', methods=['POST'])
-def handle_relatorio():
-    """Endpoint da API para gerar o relatório."""
-    sucesso, mensagem = gerar_relatorio()
+@app.route('/api/veiculos', methods=['GET', 'POST'])
+def handle_veiculos():
+    """
+    Endpoint da API para a frota.
+    - GET: Retorna uma página de veículos (parâmetros limit e after_id).
+    - POST: Adiciona um novo veículo.
+    """
+    if request.method == 'GET':
+        try:
+            veiculos, proximo_after_id = listar_veiculos(
+                limite=request.args.get('limit', LIMITE_PADRAO),
+                after_id=request.args.get('after_id'),
+            )
+        except ValueError as e:
+            return jsonify({'mensagem': f"Parâmetros inválidos: {e}"}), 400
+        return jsonify({'veiculos': veiculos, 'proximo_after_id': proximo_after_id})
+
+    elif request.method == 'POST':
+        sucesso, mensagem, veiculo_id = adicionar_veiculo(request.json)
+        if sucesso:
+            return jsonify({'mensagem': mensagem, 'id': veiculo_id}), 201
+        else:
+            return jsonify({'mensagem': mensagem}), 400
+
+@app.route('/api/veiculos/<int:veiculo_id>', methods=['GET', 'PUT', 'DELETE'])
+def handle_veiculo(veiculo_id):
+    """
+    Endpoint da API para um veículo específico.
+    - GET: Retorna o veículo.
+    - PUT: Edita nome e placa.
+    - DELETE: Remove o veículo, se ele não tiver itens.
+    """
+    if request.method == 'GET':
+        veiculo = buscar_veiculo(veiculo_id)
+        if veiculo:
+            return jsonify(veiculo)
+        else:
+            return jsonify({'mensagem': 'Veículo não encontrado.'}), 404
+
+    elif request.method == 'PUT':
+        sucesso, mensagem = editar_veiculo(veiculo_id, request.json)
+        if sucesso:
+            return jsonify({'mensagem': mensagem}), 200
+        else:
+            return jsonify({'mensagem': mensagem}), 404
+
+    elif request.method == 'DELETE':
+        if buscar_veiculo(veiculo_id) is None:
+            return jsonify({'mensagem': 'Veículo não encontrado.'}), 404
+        sucesso, mensagem = remover_veiculo(veiculo_id)
+        if sucesso:
+            return jsonify({'mensagem': mensagem}), 200
+        else:
+            return jsonify({'mensagem': mensagem}), 409
+
+@app.route('/api/veiculos/<int:veiculo_id>/itens', methods=['GET'])
+def handle_itens_veiculo(veiculo_id):
+    """Endpoint da API com os itens de um veículo; aceita os mesmos parâmetros de GET /api/itens."""
+    if buscar_veiculo(veiculo_id) is None:
+        return jsonify({'mensagem': 'Veículo não encontrado.'}), 404
+    return _responder_listagem(veiculo_id)
+
+@app.route('/api/veiculos/<int:veiculo_id>/itens/vencendo', methods=['GET'])
+def handle_vencendo_veiculo(veiculo_id):
+    """Endpoint da API com os itens vencidos de um veículo; mesmos parâmetros de /api/itens/vencendo."""
+    if buscar_veiculo(veiculo_id) is None:
+        return jsonify({'mensagem': 'Veículo não encontrado.'}), 404
+    return _responder_vencimentos(veiculo_id)
+
+@app.route('/api/leituras', methods=['POST'])
+def handle_leituras():
+    """
+    Endpoint da API para registrar leituras do odômetro em lote: {veiculo_id, data, km}
+    por registro, nos mesmos formatos de /api/itens/lote (JSON, NDJSON ou CSV).
+    """
+    registros, formato = _registros_do_corpo()
+    if registros is None:
+        return jsonify({'mensagem': f"Formato inválido: {formato}"}), 400
+    resultado = importar_leituras(registros)
+    if resultado['inseridos'] == 0 and resultado['total_erros'] == 0:
+        resultado['mensagem'] = "Nenhuma leitura recebida."
+        return jsonify(resultado), 400
+    resultado['mensagem'] = f"{resultado['inseridos']} leituras adicionadas, {resultado['total_erros']} com erro."
+    return jsonify(resultado), 201 if resultado['inseridos'] else 400
+
+@app.route('/api/veiculos/<int:veiculo_id>/leituras', methods=['GET'])
+def handle_leituras_veiculo(veiculo_id):
+    """
+    Endpoint da API com as leituras mais recentes de um veículo (parâmetro limit) e o
+    ritmo em km por dia usado nas previsões (null sem leituras suficientes).
+    """
+    if buscar_veiculo(veiculo_id) is None:
+        return jsonify({'mensagem': 'Veículo não encontrado.'}), 404
+    try:
+        leituras = listar_leituras(veiculo_id, request.args.get('limit', LIMITE_MAXIMO))
+    except ValueError as e:
+        return jsonify({'mensagem': f"Parâmetros inválidos: {e}"}), 400
+    ajuste = previsao_km.taxas().get(veiculo_id)
+    return jsonify({'leituras': leituras, 'km_por_dia': round(ajuste[0], 2) if ajuste else None})
+
+@app.route('/api/alertas', methods=['GET'])
+def handle_alertas():
+    """
+    Endpoint da API com os itens vencidos e os que vencem em breve, do índice em memória.
+    Parâmetros opcionais: km_atual, data (AAAA-MM-DD, padrão hoje), antecedencia_km,
+    antecedencia_dias e limit.
+    """
+    return _responder_alertas(None)
+
+@app.route('/api/veiculos/<int:veiculo_id>/alertas', methods=['GET'])
+def handle_alertas_veiculo(veiculo_id):
+    """Endpoint da API com os alertas de um veículo; mesmos parâmetros de /api/alertas."""
+    if buscar_veiculo(veiculo_id) is None:
+        return jsonify({'mensagem': 'Veículo não encontrado.'}), 404
+    return _responder_alertas(veiculo_id)
+
+@app.route('/api/estatisticas', methods=['GET'])
+def handle_estatisticas():
+    """
+    Endpoint da API com gastos por item, por mês e por ano e o intervalo médio entre trocas.
+    Parâmetros opcionais: veiculo_id, de e ate (AAAA-MM-DD) e modo (resumo, pandas ou sql).
+    Sem recorte de datas a resposta vem das tabelas de resumo; com recorte, do cálculo vetorizado.
+    """
+    args = request.args
+    de, ate = args.get('de'), args.get('ate')
+    modo = args.get('modo', 'pandas' if de or ate else 'resumo')
+    if modo not in ('resumo', 'pandas', 'sql'):
+        return jsonify({'mensagem': f"Modo inválido: {modo}"}), 400
+    if modo == 'resumo' and (de or ate):
+        return jsonify({'mensagem': "O modo resumo não aceita recorte de datas."}), 400
+
+    def produzir():
+        try:
+            if modo == 'resumo':
+                return estatisticas_resumo(args.get('veiculo_id')), 200
+            elif modo == 'pandas':
+                return estatisticas_pandas(args.get('veiculo_id'), de, ate), 200
+            else:
+                return estatisticas_sql(args.get('veiculo_id'), de, ate), 200
+        except ValueError as e:
+            return {'mensagem': f"Parâmetros inválidos: {e}"}, 400
+
+    return resposta_json_condicional(('estatisticas', request.query_string), produzir)
+
+@app.route('/api/estatisticas/recalcular', methods=['POST'])
+def handle_recalcular_estatisticas():
+    """Endpoint da API que reconstrói as tabelas de resumo do zero."""
+    sucesso, mensagem = recalcular_resumos()
     if sucesso:
         return jsonify({'mensagem': mensagem}), 200
     else:
         return jsonify({'mensagem': mensagem}), 500
 
+@app.route('/api/relatorio', methods=['GET', 'POST'])
+def handle_relatorio():
+    """
+    Endpoint da API para o relatório.
+    - GET: Envia o relatório como download, gerado e transmitido aos poucos.
+    - POST: Enfileira a geração do relatório em segundo plano e retorna o id do trabalho
+      (202); se a tabela não mudou desde um relatório já pronto, ele é reaproveitado (200).
+    """
+    if request.method == 'GET':
+        resposta = Response(
+            stream_with_context(gerar_linhas_relatorio()),
+            mimetype='text/plain',
+        )
+        resposta.headers['Content-Disposition'] = 'attachment; filename="relatorio_manutencao.txt"'
+        return resposta
+
+    dados, status = solicitar_relatorio()
+    resposta = jsonify(dados)
+    if 'url' in dados:
+        resposta.headers['Location'] = dados['url']
+    return resposta, status
+
+@app.route('/api/relatorio/<trabalho_id>', methods=['GET'])
+def handle_trabalho_relatorio(trabalho_id):
+    """Endpoint da API com o status e o progresso de um relatório em segundo plano."""
+    trabalho = fila_relatorios.obter(trabalho_id)
+    if trabalho is None:
+        return jsonify({'mensagem': 'Relatório não encontrado.'}), 404
+    return jsonify(descrever_trabalho(trabalho))
+
+@app.route('/api/relatorio/<trabalho_id>/arquivo', methods=['GET'])
+def handle_arquivo_relatorio(trabalho_id):
+    """Endpoint da API para baixar um relatório gerado em segundo plano."""
+    trabalho = fila_relatorios.obter(trabalho_id)
+    if trabalho is None:
+        return jsonify({'mensagem': 'Relatório não encontrado.'}), 404
+    if trabalho['status'] != 'concluido':
+        return jsonify({'mensagem': 'O relatório ainda não está pronto.', 'status': trabalho['status']}), 409
+    if not os.path.exists(trabalho['caminho']):
+        return jsonify({'mensagem': 'O arquivo do relatório não existe mais.'}), 410
+    return send_file(trabalho['caminho'], mimetype='text/plain', as_attachment=True,
+                     download_name='relatorio_manutencao.txt')
+
+@app.route('/api/export', methods=['GET'])
+def handle_exportacao():
+    """
+    Endpoint da API que exporta todos os itens em ?formato=csv|ndjson (padrão csv),
+    transmitidos em blocos sem carregar a tabela na memória.
+    """
+    formato = request.args.get('formato', 'csv')
+    if formato not in FORMATOS_EXPORTACAO:
+        return jsonify({'mensagem': f"Formato inválido: use {' ou '.join(FORMATOS_EXPORTACAO)}."}), 400
+    resposta = Response(stream_with_context(gerar_exportacao(formato)), content_type=FORMATOS_EXPORTACAO[formato])
+    resposta.headers['Content-Disposition'] = f'attachment; filename="manutencao_itens.{formato}"'
+    return resposta
+
+@app.route('/api/bd/snapshots', methods=['GET', 'POST'])
+def handle_snapshots():
+    """
+    Endpoint da API para snapshots do banco.
+    - GET: Lista os snapshots guardados.
+    - POST: Cria um snapshot consistente sem parar a aplicação (?comprimir=1 para gzip).
+    A restauração fica só na linha de comando (snapshot.py), pois substitui todos os dados.
+    """
+    if request.method == 'GET':
+        return jsonify({'snapshots': listar_snapshots()})
+    comprimir = request.args.get('comprimir', '0').lower() in ('1', 'true', 'sim')
+    try:
+        return jsonify(criar_snapshot(comprimir=comprimir)), 201
+    except (sqlite3.Error, OSError) as e:
+        return jsonify({'mensagem': f"Erro ao criar snapshot: {e}"}), 500
+
+@app.route('/api/bd/manutencao', methods=['GET', 'POST'])
+def handle_manutencao_bd():
+    """
+    Endpoint da API com o estado do arquivo do banco e os planos das consultas monitoradas.
+    - GET: Só o relatório.
+    - POST: Faz uma volta de manutenção agora (vacuum incremental e optimize) e devolve o relatório.
+      Com compactar=1, antes reescreve o arquivo com VACUUM (veja ManutencaoBd.compactar).
+    """
+    volta = None
+    if request.method == 'POST':
+        try:
+            compactacao = None
+            if request.args.get('compactar') == '1':
+                compactacao = manutencao_bd.compactar(obter_pool())
+            volta = manutencao_bd.executar(forcar=True)
+            if compactacao is not None:
+                volta['compactacao'] = compactacao
+        except sqlite3.Error as e:
+            return jsonify({'mensagem': f"Erro na manutenção do banco: {e}"}), 500
+    dados = relatorio_bd()
+    if volta is not None:
+        dados['volta'] = volta
+    return jsonify(dados)
+
+@app.route('/api/bd/pool', methods=['GET'])
+def handle_pool():
+    """Endpoint da API com as estatísticas do pool de conexões (e do escritor agrupado, se ligado)."""
+    dados = obter_pool().estatisticas()
+    escritor = _escritor
+    if escritor is not None:
+        dados['escrita_agrupada'] = escritor.estatisticas()
+    return jsonify(dados)
+
+@app.route('/metrics', methods=['GET'])
+def handle_metricas():
+    """Métricas da aplicação no formato de texto do Prometheus."""
+    if not METRICAS_ATIVAS:
+        return jsonify({'mensagem': 'Métricas desativadas (MANUTENCAO_METRICAS=0).'}), 404
+    pool = obter_pool().estatisticas()
+    extras = [
+        ('manutencao_pool_conexoes_em_uso', 'gauge', "Conexões emprestadas no momento.", pool['em_uso']),
+        ('manutencao_pool_conexoes_ociosas', 'gauge', "Conexões abertas aguardando uso.", pool['ociosas']),
+        ('manutencao_pool_esperas_total', 'counter', "Vezes que uma requisição esperou por conexão.", pool['esperas']),
+        ('manutencao_cache_respostas_bytes', 'gauge', "Bytes ocupados pelo cache de respostas.",
+         _cache_respostas._bytes),
+    ]
+    manutencao = manutencao_bd.estatisticas()
+    extras.append(('manutencao_bd_paginas_liberadas_total', 'counter',
+                   "Páginas devolvidas pelo vacuum incremental.", manutencao['paginas_liberadas']))
+    extras.append(('manutencao_bd_consultas_com_varredura', 'gauge',
+                   "Consultas monitoradas que varrem uma tabela inteira.", len(manutencao['varreduras'])))
+    escritor = _escritor
+    if escritor is not None:
+        grupos = escritor.estatisticas()
+        extras += [
+            ('manutencao_escrita_grupos_total', 'counter', "Commits feitos pelo escritor agrupado.", grupos['grupos']),
+            ('manutencao_escrita_agrupada_total', 'counter', "Escritas confirmadas em grupo.", grupos['escritas']),
+            ('manutencao_escrita_pendentes', 'gauge', "Escritas aguardando o próximo grupo.", grupos['pendentes']),
+        ]
+    return Response(metricas.exportar(extras), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 if __name__ == '__main__':
-    conn, _ = conectar_bd()
-    conn.close()
+    obter_pool()
+    motor_alertas.atualizar()
+    manutencao_bd.iniciar()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,547 @@
+"""
+Ponto de entrada ASGI da aplicação de manutenção.
+
+As rotas de itens, de relatório e de exportação têm versões assíncronas: o laço de
+eventos cuida das conexões HTTP e só o acesso ao banco vai para um executor de threads
+de tamanho fixo (igual ao pool de conexões). Assim milhares de clientes podem ficar conectados sem que
+o número de threads cresça. As demais rotas continuam no Flask, que roda num executor
+próprio (uma thread por requisição encaminhada, do início ao fim da resposta) para que
+uploads e downloads lentos não tomem as threads do banco. O corpo da requisição chega ao
+Flask aos poucos, à medida que ele o lê, sem ser juntado na memória antes.
+
+Para executar (com um servidor ASGI, por exemplo o uvicorn):
+
+    $ pip install uvicorn
+    $ uvicorn asgi:aplicacao
+"""
+import asyncio
+import concurrent.futures
+import io
+import os
+import re
+import sys
+import threading
+import time
+from urllib.parse import parse_qsl
+
+from asgiref.sync import sync_to_async
+
+import app as nucleo
+
+executor_bd = concurrent.futures.ThreadPoolExecutor(max_workers=nucleo.TAMANHO_POOL, thread_name_prefix='bd')
+THREADS_FLASK = int(os.environ.get('MANUTENCAO_ASGI_THREADS_FLASK', '32'))
+executor_flask = concurrent.futures.ThreadPoolExecutor(max_workers=THREADS_FLASK, thread_name_prefix='flask')
+PEDACOS_EM_ESPERA = 8  # pedaços da resposta do Flask aguardando envio antes de a thread esperar
+TAMANHO_BUFFER_ENTRADA = 64 * 1024
+
+
+def em_thread(funcao):
+    """Transforma uma função bloqueante em corrotina que roda no executor do banco."""
+    return sync_to_async(funcao, thread_sensitive=False, executor=executor_bd)
+
+
+# --- LEITURA DA REQUISIÇÃO E ENVIO DA RESPOSTA ---
+
+class CorpoRequisicao:
+    """
+    Corpo da requisição lido só quando pedido. As rotas assíncronas que precisam dele
+    (JSONs pequenos de um item) o leem inteiro; nas encaminhadas ao Flask ele é lido aos
+    poucos pelo wsgi.input.
+    """
+
+    def __init__(self, receive):
+        self.receive = receive
+        self.lido = None
+        self.desconectado = False
+
+    async def ler(self):
+        if self.lido is None:
+            partes = []
+            while True:
+                mensagem = await self.receive()
+                if mensagem['type'] == 'http.disconnect':
+                    self.desconectado = True
+                    break
+                partes.append(mensagem.get('body', b''))
+                if not mensagem.get('more_body', False):
+                    break
+            self.lido = b''.join(partes)
+        return self.lido
+
+    async def aguardar_desconexao(self):
+        """
+        Termina quando o cliente fecha a conexão. Respostas longas precisam disso: o
+        uvicorn não faz o send falhar depois da desconexão, só passa a ignorá-lo.
+        """
+        await self.ler()
+        while not self.desconectado:
+            if (await self.receive())['type'] == 'http.disconnect':
+                self.desconectado = True
+
+
+class EntradaWsgi(io.RawIOBase):
+    """
+    wsgi.input bloqueante para a thread do Flask: quando os bytes recebidos acabam, pede a
+    próxima mensagem ao laço de eventos. Só uma mensagem fica na memória por vez, e o
+    cliente só envia mais quando o Flask consome o que chegou.
+    """
+
+    def __init__(self, receive, laco, inicial=None):
+        self._receive = receive
+        self._laco = laco
+        self._pendente = memoryview(inicial or b'')
+        self._fim = inicial is not None  # o corpo já foi lido inteiro por uma rota assíncrona
+
+    def readable(self):
+        return True
+
+    def readinto(self, destino):
+        while not self._pendente and not self._fim:
+            mensagem = asyncio.run_coroutine_threadsafe(self._receive(), self._laco).result()
+            if mensagem['type'] != 'http.request':
+                self._fim = True  # cliente desconectou: o Flask vê o corpo terminar aqui
+                break
+            self._pendente = memoryview(mensagem.get('body', b''))
+            self._fim = not mensagem.get('more_body', False)
+        tamanho = min(len(destino), len(self._pendente))
+        destino[:tamanho] = self._pendente[:tamanho]
+        self._pendente = self._pendente[tamanho:]
+        return tamanho
+
+
+def _cabecalhos(scope):
+    """Cabeçalhos da requisição como dicionário com nomes em minúsculas."""
+    cabecalhos = {}
+    for nome, valor in scope['headers']:
+        nome = nome.decode('latin-1')
+        valor = valor.decode('latin-1')
+        cabecalhos[nome] = f"{cabecalhos[nome]},{valor}" if nome in cabecalhos else valor
+    return cabecalhos
+
+
+def _parametros(scope):
+    """Parâmetros da URL; como no request.args do Flask, vale o primeiro valor de cada nome."""
+    parametros = {}
+    for nome, valor in parse_qsl(scope['query_string'].decode('utf-8', 'replace'), keep_blank_values=True):
+        parametros.setdefault(nome, valor)
+    return parametros
+
+
+async def _responder(send, status, cabecalhos, corpo):
+    lista = [(nome.lower().encode('latin-1'), str(valor).encode('latin-1')) for nome, valor in cabecalhos.items()]
+    lista.append((b'content-length', str(len(corpo)).encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': lista})
+    await send({'type': 'http.response.body', 'body': corpo})
+
+
+async def _responder_json(send, dados, status=200):
+    await _responder(send, status, {'Content-Type': 'application/json'}, nucleo.serializar_json(dados))
+
+
+def _ler_json(cabecalhos, corpo):
+    """
+    Decodifica o corpo JSON. Retorna None quando o Flask responderia com erro
+    (Content-Type errado ou JSON malformado); nesses casos a requisição é repassada a ele.
+    """
+    tipo = cabecalhos.get('content-type', '').split(';', 1)[0].strip().lower()
+    if tipo != 'application/json' and not (tipo.startswith('application/') and tipo.endswith('+json')):
+        return None
+    try:
+        return nucleo.app.json.loads(corpo)
+    except ValueError:
+        return None
+
+
+# --- PONTE PARA O FLASK ---
+
+def _montar_environ(scope, entrada):
+    servidor = scope.get('server') or ('localhost', 80)
+    cliente = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': servidor[0],
+        'SERVER_PORT': str(servidor[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': cliente[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': entrada,
+        'wsgi.input_terminated': True,  # a leitura termina no fim do corpo, com ou sem Content-Length
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for nome, valor in _cabecalhos(scope).items():
+        if nome == 'content-type':
+            environ['CONTENT_TYPE'] = valor
+        elif nome == 'content-length':
+            environ['CONTENT_LENGTH'] = valor
+        else:
+            environ['HTTP_' + nome.upper().replace('-', '_')] = valor
+    return environ
+
+
+class ConexaoEncerrada(Exception):
+    """O envio da resposta foi interrompido (o cliente desconectou)."""
+
+
+def _executar_wsgi(environ, entregar):
+    """
+    Chama o app Flask e percorre a resposta inteira nesta thread, entregando ao laço de
+    eventos as mensagens ASGI prontas e None no fim. Tudo roda no mesmo contexto, então
+    o stream_with_context do Flask funciona como num servidor WSGI.
+    """
+    inicio = {}
+
+    def start_response(status, cabecalhos, exc_info=None):
+        inicio['status'] = int(status.split(' ', 1)[0])
+        inicio['cabecalhos'] = [(n.lower().encode('latin-1'), v.encode('latin-1')) for n, v in cabecalhos]
+
+    def comecar():
+        if inicio:
+            entregar({'type': 'http.response.start', 'status': inicio.pop('status'),
+                      'headers': inicio.pop('cabecalhos')})
+
+    try:
+        resultado = nucleo.app(environ, start_response)
+        try:
+            # O start_response pode ser chamado só ao produzir o primeiro pedaço do corpo.
+            for pedaco in resultado:
+                comecar()
+                if pedaco:
+                    entregar({'type': 'http.response.body', 'body': pedaco, 'more_body': True})
+            comecar()
+            entregar({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Fechar a resposta devolve a conexão ao pool mesmo se o cliente desistir no meio.
+            if hasattr(resultado, 'close'):
+                resultado.close()
+    except ConexaoEncerrada:
+        return
+    entregar(None)
+
+
+async def encaminhar_para_flask(scope, receive, corpo, send):
+    """
+    Atende a requisição com o app Flask numa thread do executor_flask, enviando o corpo
+    da resposta pedaço por pedaço. A fila limitada faz a thread esperar quando o cliente
+    lê mais devagar do que o Flask produz.
+    """
+    laco = asyncio.get_running_loop()
+    fila = asyncio.Queue(maxsize=PEDACOS_EM_ESPERA)
+    encerrada = threading.Event()
+
+    def entregar(mensagem):
+        if encerrada.is_set():
+            raise ConexaoEncerrada()
+        asyncio.run_coroutine_threadsafe(fila.put(mensagem), laco).result()
+
+    entrada = io.BufferedReader(EntradaWsgi(receive, laco, corpo.lido), TAMANHO_BUFFER_ENTRADA)
+    tarefa = laco.run_in_executor(executor_flask, _executar_wsgi, _montar_environ(scope, entrada), entregar)
+    try:
+        while True:
+            mensagem = await fila.get()
+            if mensagem is None:
+                break
+            await send(mensagem)
+    finally:
+        if not tarefa.done():
+            # O envio falhou: avisa a thread e esvazia a fila até ela fechar a resposta.
+            encerrada.set()
+            while not tarefa.done():
+                try:
+                    fila.get_nowait()
+                except asyncio.QueueEmpty:
+                    await asyncio.sleep(0.01)
+    await tarefa
+
+
+# --- ROTAS ASSÍNCRONAS ---
+
+async def _transmitir(send, gerador, cabecalhos):
+    """Envia os pedaços de texto de um gerador bloqueante, cada um pedido ao executor do banco."""
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': cabecalhos})
+        while True:
+            pedaco = await em_thread(next)(gerador, None)
+            if pedaco is None:
+                break
+            await send({'type': 'http.response.body', 'body': pedaco.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        # Fechar o gerador devolve a conexão ao pool mesmo se o cliente desistir no meio.
+        await em_thread(gerador.close)()
+
+
+async def itens(scope, cabecalhos, corpo, send):
+    """GET e POST em /api/itens (mesmo contrato da rota Flask)."""
+    if scope['method'] == 'GET':
+        args = _parametros(scope)
+
+        status, cabecalhos_resposta, corpo_resposta = await em_thread(nucleo.preparar_resposta_json)(
+            ('itens', None, scope['query_string']), lambda: nucleo.consultar_itens(args),
+            cabecalhos.get('if-none-match'), cabecalhos.get('accept-encoding'),
+        )
+        await _responder(send, status, cabecalhos_resposta, corpo_resposta)
+        return True
+
+    if scope['method'] == 'POST':
+        data = _ler_json(cabecalhos, await corpo.ler())
+        if data is None:
+            return False
+        sucesso, mensagem = await em_thread(nucleo.adicionar_item)(data)
+        await _responder_json(send, {'mensagem': mensagem}, 201 if sucesso else 400)
+        return True
+
+    return False
+
+
+async def item(scope, cabecalhos, corpo, send, item_id):
+    """GET, PUT e DELETE em /api/itens/<id> (mesmo contrato da rota Flask)."""
+    if scope['method'] == 'GET':
+        def produzir():
+            encontrado = nucleo.buscar_item(item_id)
+            if encontrado:
+                return encontrado, 200
+            else:
+                return {'mensagem': 'Item não encontrado.'}, 404
+
+        status, cabecalhos_resposta, corpo_resposta = await em_thread(nucleo.preparar_resposta_json)(
+            ('item', item_id), produzir, cabecalhos.get('if-none-match'), cabecalhos.get('accept-encoding'),
+        )
+        await _responder(send, status, cabecalhos_resposta, corpo_resposta)
+        return True
+
+    if scope['method'] == 'PUT':
+        data = _ler_json(cabecalhos, await corpo.ler())
+        if data is None:
+            return False
+        sucesso, mensagem = await em_thread(nucleo.editar_item)(item_id, data)
+        await _responder_json(send, {'mensagem': mensagem}, 200 if sucesso else 404)
+        return True
+
+    if scope['method'] == 'DELETE':
+        sucesso, mensagem = await em_thread(nucleo.remover_item)(item_id)
+        await _responder_json(send, {'mensagem': mensagem}, 200 if sucesso else 404)
+        return True
+
+    return False
+
+
+async def relatorio(scope, cabecalhos, corpo, send):
+    """GET (download transmitido aos poucos) e POST (relatório em segundo plano) em /api/relatorio."""
+    if scope['method'] == 'POST':
+        dados, status = await em_thread(nucleo.solicitar_relatorio)()
+        cabecalhos_resposta = {'Content-Type': 'application/json'}
+        if 'url' in dados:
+            cabecalhos_resposta['Location'] = dados['url']
+        await _responder(send, status, cabecalhos_resposta, nucleo.serializar_json(dados))
+        return True
+
+    if scope['method'] == 'GET':
+        await _transmitir(send, nucleo.gerar_linhas_relatorio(), [
+            (b'content-type', b'text/plain; charset=utf-8'),
+            (b'content-disposition', b'attachment; filename="relatorio_manutencao.txt"'),
+        ])
+        return True
+
+    return False
+
+
+async def exportar(scope, cabecalhos, corpo, send):
+    """GET em /api/export (mesmo contrato da rota Flask), transmitido bloco a bloco."""
+    if scope['method'] != 'GET':
+        return False
+    formato = _parametros(scope).get('formato', 'csv')
+    if formato not in nucleo.FORMATOS_EXPORTACAO:
+        return False  # o Flask monta a mesma resposta de erro
+    await _transmitir(send, nucleo.gerar_exportacao(formato), [
+        (b'content-type', nucleo.FORMATOS_EXPORTACAO[formato].encode('latin-1')),
+        (b'content-disposition', f'attachment; filename="manutencao_itens.{formato}"'.encode('latin-1')),
+    ])
+    return True
+
+
+class VigiaMudancas:
+    """
+    Acompanha a última sequência de mudanças dos itens para todos os clientes em long-poll
+    ou Server-Sent Events: uma única tarefa confere o banco a cada INTERVALO_MUDANCAS
+    segundos (ou na hora, quando a escrita é deste processo) e acorda quem espera,
+    em vez de cada conexão consultar o banco por conta própria.
+    """
+
+    def __init__(self):
+        self.versao = None
+        self._condicao = None
+        self._acordar = None
+        self._tarefa = None
+
+    def _iniciar(self):
+        if self._tarefa is not None:
+            return
+        laco = asyncio.get_running_loop()
+        self._condicao = asyncio.Condition()
+        self._acordar = asyncio.Event()
+        nucleo.aviso_mudancas.ouvir(lambda: laco.call_soon_threadsafe(self._acordar.set))
+        self._tarefa = asyncio.create_task(self._vigiar())
+
+    async def _vigiar(self):
+        while True:
+            try:
+                versao = await em_thread(nucleo.ultima_mudanca)()
+            except nucleo.sqlite3.Error:
+                versao = self.versao
+            if versao != self.versao:
+                self.versao = versao
+                async with self._condicao:
+                    self._condicao.notify_all()
+            try:
+                await asyncio.wait_for(self._acordar.wait(), nucleo.INTERVALO_MUDANCAS)
+            except asyncio.TimeoutError:
+                pass
+            self._acordar.clear()
+
+    async def aguardar(self, desde, tempo):
+        """Espera até 'tempo' segundos por uma mudança depois de 'desde'. Retorna se houve mudança."""
+        self._iniciar()
+        try:
+            async with self._condicao:
+                await asyncio.wait_for(
+                    self._condicao.wait_for(lambda: self.versao is not None and self.versao > desde), tempo)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def parar(self):
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            self._tarefa = None
+
+
+vigia_mudancas = VigiaMudancas()
+
+
+async def mudancas(scope, cabecalhos, corpo, send):
+    """
+    GET em /api/itens/mudancas (mesmo contrato da rota Flask). O long-poll e o stream de
+    eventos esperam no laço de eventos, sem ocupar uma thread do executor por cliente.
+    """
+    if scope['method'] != 'GET':
+        return False
+    args = _parametros(scope)
+    desde = cabecalhos.get('last-event-id') or args.get('desde')
+    eventos = 'text/event-stream' in cabecalhos.get('accept', '')
+    if desde is None:
+        return False  # só a versão atual: responde o Flask
+    try:
+        desde = int(desde)
+        limite = int(args.get('limit', nucleo.LIMITE_MAXIMO))
+        espera = min(float(args.get('espera', 0)), nucleo.ESPERA_MAXIMA_MUDANCAS)
+        dados = await em_thread(nucleo.listar_mudancas)(desde, limite)
+    except ValueError:
+        return False  # o Flask monta a mesma resposta de erro
+
+    def tem_mudancas(dados):
+        return dados['itens'] or dados['removidos'] or dados.get('recarregar')
+
+    if not eventos:
+        if espera > 0 and not tem_mudancas(dados) and await vigia_mudancas.aguardar(desde, espera):
+            dados = await em_thread(nucleo.listar_mudancas)(desde, limite)
+        await _responder_json(send, dados)
+        return True
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no')],
+    })
+    desconexao = asyncio.ensure_future(corpo.aguardar_desconexao())
+    try:
+        while not desconexao.done():
+            if tem_mudancas(dados):
+                evento = nucleo.formatar_evento_mudancas(dados)
+                await send({'type': 'http.response.body', 'body': evento.encode('utf-8'), 'more_body': True})
+            else:
+                espera = asyncio.ensure_future(vigia_mudancas.aguardar(dados['versao'], nucleo.BATIMENTO_EVENTOS))
+                await asyncio.wait((espera, desconexao), return_when=asyncio.FIRST_COMPLETED)
+                if desconexao.done():
+                    espera.cancel()
+                    break
+                if not espera.result():
+                    await send({'type': 'http.response.body', 'body': b": batimento\n\n", 'more_body': True})
+                    continue
+            dados = await em_thread(nucleo.listar_mudancas)(dados['versao'], limite)
+    finally:
+        desconexao.cancel()
+    return True
+
+
+# O terceiro elemento é o padrão da rota no Flask, usado como rótulo nas métricas.
+ROTAS = [
+    (re.compile(r'^/api/itens$'), itens, '/api/itens'),
+    (re.compile(r'^/api/itens/mudancas$'), mudancas, '/api/itens/mudancas'),
+    (re.compile(r'^/api/itens/(?P<item_id>\d+)$'), item, '/api/itens/<int:item_id>'),
+    (re.compile(r'^/api/relatorio$'), relatorio, '/api/relatorio'),
+    (re.compile(r'^/api/export$'), exportar, '/api/export'),
+]
+
+
+# --- APLICAÇÃO ASGI ---
+
+async def _lifespan(receive, send):
+    while True:
+        mensagem = await receive()
+        if mensagem['type'] == 'lifespan.startup':
+            await em_thread(nucleo.obter_pool)()
+            await em_thread(nucleo.motor_alertas.atualizar)()
+            nucleo.manutencao_bd.iniciar()
+            await send({'type': 'lifespan.startup.complete'})
+        elif mensagem['type'] == 'lifespan.shutdown':
+            vigia_mudancas.parar()
+            await em_thread(nucleo.manutencao_bd.parar)()
+            await em_thread(nucleo.configurar_escrita)(False)  # grava o que ainda está no grupo aberto
+            await em_thread(nucleo.fila_relatorios.fechar)()
+            await em_thread(nucleo.obter_pool().fechar)()
+            executor_bd.shutdown(wait=False)
+            executor_flask.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def aplicacao(scope, receive, send):
+    """Aplicação ASGI: rotas assíncronas primeiro, o resto vai para o Flask."""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    corpo = CorpoRequisicao(receive)
+    for padrao, rota, nome_rota in ROTAS:
+        encontrado = padrao.match(scope['path'])
+        if encontrado:
+            argumentos = {nome: int(valor) for nome, valor in encontrado.groupdict().items()}
+            if not nucleo.METRICAS_ATIVAS:
+                if await rota(scope, _cabecalhos(scope), corpo, send, **argumentos):
+                    return
+                break
+            # Nas rotas assíncronas a medição vai até o último pedaço do corpo ser enviado.
+            inicio = time.perf_counter()
+            status = {}
+
+            async def enviar(mensagem):
+                if mensagem['type'] == 'http.response.start':
+                    status['codigo'] = mensagem['status']
+                await send(mensagem)
+
+            if await rota(scope, _cabecalhos(scope), corpo, enviar, **argumentos):
+                nucleo.metricas.registrar_requisicao(
+                    nome_rota, scope['method'], status.get('codigo', 0), time.perf_counter() - inicio)
+                return
+            break
+    await encaminhar_para_flask(scope, receive, corpo, send)
@@ -0,0 +1,267 @@
+"""
+Benchmarks reproduzíveis da camada de dados e das rotas da API.
+
+Cada execução cria um manutencao.db temporário com a quantidade de linhas pedida,
+mede as funções de dados diretamente e as rotas pelo cliente de testes do Flask,
+e imprime (ou grava) um JSON com p50/p95/p99 e linhas por segundo de cada caso.
+
+Exemplos:
+
+    $ python benchmark.py --linhas 1000 100000
+    $ python benchmark.py --linhas 100000 --saida atual.json
+    $ python benchmark.py --linhas 100000 --baseline atual.json --tolerancia 0.25
+
+Com --baseline, o processo termina com código 1 se algum caso ficou mais lento que
+o permitido pela tolerância.
+"""
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import app as nucleo
+
+NOMES = ['Óleo', 'Filtro de óleo', 'Filtro de ar', 'Corrente', 'Relação', 'Pneu dianteiro',
+         'Pneu traseiro', 'Pastilha de freio', 'Vela', 'Fluido de freio']
+TAMANHO_LOTE_BENCHMARK = 1000
+TAMANHO_PAGINA = 50
+ESCRITAS_CONCORRENTES = 64
+THREADS_ESCRITA = 16
+
+
+def gerar_item(aleatorio):
+    """Gera um item de manutenção plausível no formato aceito pela API."""
+    data_troca = datetime.date(2020, 1, 1) + datetime.timedelta(days=aleatorio.randint(0, 2000))
+    return {
+        'nome': aleatorio.choice(NOMES),
+        'valor': round(aleatorio.uniform(10, 800), 2),
+        'data_troca': data_troca.isoformat(),
+        'km_troca': aleatorio.randint(0, 80000),
+        'km_proxima': aleatorio.choice([1000, 3000, 5000, 10000]),
+        'meses_proxima': aleatorio.choice([3, 6, 12, 24]),
+    }
+
+
+def popular_bd(linhas, aleatorio):
+    """Insere 'linhas' itens pelo caminho de importação em lote."""
+    resultado = nucleo.importar_itens((i, gerar_item(aleatorio)) for i in range(1, linhas + 1))
+    if resultado['total_erros']:
+        raise RuntimeError(f"Falha ao popular o banco: {resultado['erros'][:3]}")
+
+
+def percentil(valores, p):
+    """Percentil com interpolação linear entre as posições vizinhas."""
+    ordenados = sorted(valores)
+    if len(ordenados) == 1:
+        return ordenados[0]
+    posicao = (len(ordenados) - 1) * p / 100
+    inferior = int(posicao)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (posicao - inferior)
+
+
+def medir(operacao, repeticoes, linhas_por_execucao, preparar=None):
+    """
+    Executa 'operacao' 'repeticoes' vezes e resume as durações.
+    'preparar' roda antes de cada repetição e fica fora da medição.
+    """
+    duracoes = []
+    for _ in range(repeticoes):
+        if preparar:
+            preparar()
+        inicio = time.perf_counter()
+        operacao()
+        duracoes.append(time.perf_counter() - inicio)
+    p50 = percentil(duracoes, 50)
+    return {
+        'repeticoes': repeticoes,
+        'p50_ms': round(p50 * 1000, 3),
+        'p95_ms': round(percentil(duracoes, 95) * 1000, 3),
+        'p99_ms': round(percentil(duracoes, 99) * 1000, 3),
+        'linhas_por_s': round(linhas_por_execucao / p50, 1) if p50 > 0 else None,
+    }
+
+
+def _verificar(resposta, status=200):
+    if resposta.status_code != status:
+        raise RuntimeError(f"{resposta.request.path} respondeu {resposta.status_code}: {resposta.get_data(as_text=True)[:200]}")
+    return resposta
+
+
+def executar_cenario(linhas, repeticoes, semente):
+    """Cria um banco temporário com 'linhas' itens e mede todos os casos nele."""
+    aleatorio = random.Random(semente)
+    diretorio_original = os.getcwd()
+    caminho_original = nucleo.CAMINHO_BD
+    with tempfile.TemporaryDirectory(prefix='bench-manutencao-') as diretorio:
+        # O relatório de GET /api/relatorio vai para o diretório atual; assim nada escapa da pasta temporária.
+        os.chdir(diretorio)
+        diretorio_relatorios = nucleo.fila_relatorios.diretorio
+        nucleo.fila_relatorios.diretorio = os.path.join(diretorio, 'relatorios')
+        try:
+            nucleo.configurar_bd(os.path.join(diretorio, 'manutencao.db'))
+            popular_bd(linhas, aleatorio)
+            cliente = nucleo.app.test_client()
+            pesadas = max(3, repeticoes // 10)  # casos que percorrem a tabela inteira
+
+            def proximo_id():
+                return aleatorio.randint(1, linhas)
+
+            casos = {}
+            casos['dados_adicionar_item'] = medir(
+                lambda: nucleo.adicionar_item(gerar_item(aleatorio)), repeticoes, 1)
+
+            def adicionar_concorrente():
+                itens = [gerar_item(aleatorio) for _ in range(ESCRITAS_CONCORRENTES)]
+                with concurrent.futures.ThreadPoolExecutor(THREADS_ESCRITA) as executor:
+                    for sucesso, mensagem in executor.map(nucleo.adicionar_item, itens):
+                        if not sucesso:
+                            raise RuntimeError(mensagem)
+
+            casos['dados_adicionar_concorrente'] = medir(
+                adicionar_concorrente, max(3, repeticoes // 10), ESCRITAS_CONCORRENTES)
+            casos['dados_importar_lote'] = medir(
+                lambda: nucleo.importar_itens(
+                    (i, gerar_item(aleatorio)) for i in range(TAMANHO_LOTE_BENCHMARK)),
+                max(3, repeticoes // 10), TAMANHO_LOTE_BENCHMARK)
+            casos['dados_buscar_item'] = medir(lambda: nucleo.buscar_item(proximo_id()), repeticoes, 1)
+            casos['dados_listar_pagina'] = medir(
+                lambda: nucleo.listar_itens(limite=TAMANHO_PAGINA), repeticoes, TAMANHO_PAGINA)
+            casos['dados_carregar_itens'] = medir(nucleo.carregar_itens, pesadas, linhas)
+            casos['dados_gerar_relatorio'] = medir(
+                lambda: nucleo.gerar_relatorio(os.path.join(diretorio, 'relatorio.txt')), pesadas, linhas)
+
+            item_json = gerar_item(aleatorio)
+            casos['http_post_item'] = medir(
+                lambda: _verificar(cliente.post('/api/itens', json=item_json), 201), repeticoes, 1)
+            lote_json = [gerar_item(aleatorio) for _ in range(TAMANHO_LOTE_BENCHMARK)]
+            casos['http_post_lote'] = medir(
+                lambda: _verificar(cliente.post('/api/itens/lote', json=lote_json), 201),
+                max(3, repeticoes // 10), TAMANHO_LOTE_BENCHMARK)
+            casos['http_get_item'] = medir(
+                lambda: _verificar(cliente.get(f'/api/itens/{proximo_id()}')), repeticoes, 1,
+                preparar=nucleo._cache_respostas.limpar)
+            casos['http_listar_pagina'] = medir(
+                lambda: _verificar(cliente.get(f'/api/itens?limit={TAMANHO_PAGINA}')), repeticoes, TAMANHO_PAGINA,
+                preparar=nucleo._cache_respostas.limpar)
+            casos['http_alertas'] = medir(
+                lambda: _verificar(cliente.get('/api/alertas?km_atual=40000&data=2022-01-01&limit=50')),
+                repeticoes, TAMANHO_PAGINA)
+            casos['http_listar_pagina_cache'] = medir(
+                lambda: _verificar(cliente.get(f'/api/itens?limit={TAMANHO_PAGINA}')), repeticoes, TAMANHO_PAGINA)
+
+            def listar_tudo():
+                cursor = None
+                while True:
+                    url = '/api/itens?limit=500' + (f'&cursor={cursor}' if cursor else '')
+                    cursor = _verificar(cliente.get(url)).get_json()['proximo_cursor']
+                    if not cursor:
+                        break
+
+            casos['http_listar_tudo'] = medir(listar_tudo, pesadas, linhas, preparar=nucleo._cache_respostas.limpar)
+            casos['http_baixar_relatorio'] = medir(
+                lambda: _verificar(cliente.get('/api/relatorio')).get_data(), pesadas, linhas)
+
+            def gerar_e_aguardar():
+                trabalho = _verificar(cliente.post('/api/relatorio'), 202).get_json()
+                while trabalho['status'] in ('pendente', 'executando'):
+                    time.sleep(0.005)
+                    trabalho = _verificar(cliente.get(trabalho['url'])).get_json()
+                if trabalho['status'] != 'concluido':
+                    raise RuntimeError(f"Relatório falhou: {trabalho['mensagem']}")
+
+            # Sem limpar a fila o segundo pedido reaproveitaria o relatório pronto.
+            casos['http_gerar_relatorio'] = medir(
+                gerar_e_aguardar, pesadas, linhas, preparar=nucleo.fila_relatorios.limpar)
+            casos['http_gerar_relatorio_cache'] = medir(
+                lambda: _verificar(cliente.post('/api/relatorio')), repeticoes, linhas)
+            return casos
+        finally:
+            nucleo.fila_relatorios.limpar()
+            nucleo.fila_relatorios.diretorio = diretorio_relatorios
+            nucleo.configurar_bd(caminho_original)
+            os.chdir(diretorio_original)
+
+
+def comparar(resultados, baseline, tolerancia, metrica):
+    """Lista os casos em que 'metrica' piorou mais que 'tolerancia' (fração) em relação à baseline."""
+    regressoes = []
+    for linhas, casos in resultados.items():
+        for caso, atual in casos.items():
+            anterior = baseline.get(linhas, {}).get(caso)
+            if not anterior:
+                continue
+            if atual[metrica] > anterior[metrica] * (1 + tolerancia):
+                regressoes.append({
+                    'linhas': linhas,
+                    'caso': caso,
+                    'metrica': metrica,
+                    'baseline': anterior[metrica],
+                    'atual': atual[metrica],
+                })
+    return regressoes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks da camada de dados e da API de manutenção.")
+    parser.add_argument('--linhas', type=int, nargs='+', default=[1000],
+                        help="quantidades de linhas a testar (ex.: 1000 100000 1000000)")
+    parser.add_argument('--repeticoes', type=int, default=50, help="repetições de cada caso leve")
+    parser.add_argument('--semente', type=int, default=42, help="semente dos dados gerados")
+    parser.add_argument('--saida', help="grava o JSON de resultados neste arquivo")
+    parser.add_argument('--baseline', help="JSON de uma execução anterior para detectar regressões")
+    parser.add_argument('--tolerancia', type=float, default=0.2,
+                        help="piora relativa aceita antes de acusar regressão (padrão 0.2 = 20%%)")
+    parser.add_argument('--grupo-commit', action='store_true',
+                        help="mede com o commit em grupo ligado (MANUTENCAO_GRUPO_COMMIT=1)")
+    parser.add_argument('--metrica', choices=('p50_ms', 'p95_ms', 'p99_ms'), default='p50_ms',
+                        help="métrica comparada com a baseline")
+    args = parser.parse_args(argv)
+    if args.grupo_commit:
+        nucleo.configurar_escrita(True)
+
+    resultados = {}
+    for linhas in args.linhas:
+        print(f"Medindo com {linhas} linhas...", file=sys.stderr)
+        resultados[str(linhas)] = executar_cenario(linhas, args.repeticoes, args.semente)
+
+    relatorio = {
+        'ambiente': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'plataforma': platform.platform(),
+        },
+        'parametros': {'repeticoes': args.repeticoes, 'semente': args.semente,
+                       'grupo_commit': nucleo._escritor is not None},
+        'resultados': resultados,
+    }
+
+    codigo = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['resultados']
+        regressoes = comparar(resultados, baseline, args.tolerancia, args.metrica)
+        relatorio['regressoes'] = regressoes
+        if regressoes:
+            codigo = 1
+            for r in regressoes:
+                print(f"REGRESSÃO [{r['linhas']} linhas] {r['caso']}: {r['metrica']} "
+                      f"{r['baseline']} -> {r['atual']}", file=sys.stderr)
+
+    texto = json.dumps(relatorio, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            f.write(texto + '\n')
+    print(texto)
+    return codigo
+
+
+if __name__ == '__main__':
+    sys.exit(main())
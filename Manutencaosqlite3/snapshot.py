@@ -0,0 +1,75 @@
+"""
+Snapshots e exportação do banco pela linha de comando, com a aplicação rodando ou não.
+
+Os snapshots usam a API de backup do SQLite em passos pequenos, então podem ser feitos
+com o servidor atendendo requisições normalmente. O banco usado é o de MANUTENCAO_BD
+(ou --bd). O comando 'compactar' reescreve o arquivo com VACUUM, o que converte um banco
+antigo para auto_vacuum=INCREMENTAL; as escritas esperam enquanto ele roda.
+
+Exemplos:
+
+    $ python snapshot.py criar --comprimir
+    $ python snapshot.py listar
+    $ python snapshot.py restaurar snapshots/manutencao-20250301-120000-a1b2c3.db.gz
+    $ python snapshot.py exportar --formato ndjson --saida itens.ndjson
+    $ python snapshot.py compactar
+"""
+import argparse
+import json
+import sys
+
+import app as nucleo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Snapshots e exportação do banco de manutenção.")
+    parser.add_argument('--bd', help="caminho do banco (padrão: MANUTENCAO_BD ou manutencao.db)")
+    comandos = parser.add_subparsers(dest='comando', required=True)
+
+    criar = comandos.add_parser('criar', help="cria um snapshot consistente do banco")
+    criar.add_argument('--diretorio', help="onde guardar o snapshot (padrão: MANUTENCAO_SNAPSHOTS ou snapshots)")
+    criar.add_argument('--comprimir', action='store_true', help="grava o snapshot com gzip")
+    criar.add_argument('--paginas', type=int, help="páginas copiadas por passo")
+    criar.add_argument('--pausa-ms', type=float, help="pausa entre os passos, em ms")
+
+    listar = comandos.add_parser('listar', help="lista os snapshots guardados")
+    listar.add_argument('--diretorio', help="diretório dos snapshots")
+
+    restaurar = comandos.add_parser('restaurar', help="substitui os dados do banco pelos de um snapshot")
+    restaurar.add_argument('arquivo', help="arquivo .db ou .db.gz criado por 'criar'")
+
+    exportar = comandos.add_parser('exportar', help="exporta os itens em CSV ou NDJSON")
+    exportar.add_argument('--formato', choices=sorted(nucleo.FORMATOS_EXPORTACAO), default='csv')
+    exportar.add_argument('--saida', help="arquivo de destino (padrão: saída padrão)")
+
+    comandos.add_parser('compactar', help="reescreve o arquivo do banco com VACUUM")
+
+    args = parser.parse_args(argv)
+    if args.bd:
+        nucleo.configurar_bd(args.bd)
+
+    if args.comando == 'exportar':
+        saida = open(args.saida, 'w', encoding='utf-8', newline='') if args.saida else sys.stdout
+        try:
+            for pedaco in nucleo.gerar_exportacao(args.formato):
+                saida.write(pedaco)
+        finally:
+            if args.saida:
+                saida.close()
+        return 0
+
+    if args.comando == 'criar':
+        pausa = args.pausa_ms / 1000 if args.pausa_ms is not None else None
+        resultado = nucleo.criar_snapshot(args.diretorio, args.comprimir, args.paginas, pausa)
+    elif args.comando == 'listar':
+        resultado = nucleo.listar_snapshots(args.diretorio)
+    elif args.comando == 'compactar':
+        resultado = nucleo.manutencao_bd.compactar(nucleo.obter_pool())
+    else:
+        resultado = nucleo.restaurar_snapshot(args.arquivo)
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
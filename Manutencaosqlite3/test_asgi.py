@@ -0,0 +1,146 @@
+"""
+Testes do ponto de entrada ASGI, chamando asgi.aplicacao diretamente com mensagens
+ASGI montadas à mão (sem servidor). Rode com: python -m pytest test_asgi.py
+"""
+import asyncio
+import csv
+import io
+import json
+import threading
+
+import pytest
+
+import app as nucleo
+import asgi
+
+ITEM = {'nome': 'Óleo', 'valor': 35.5, 'data_troca': '2024-01-10', 'km_troca': 12000,
+        'km_proxima': 1000, 'meses_proxima': 6}
+
+
+@pytest.fixture(autouse=True)
+def banco(tmp_path, monkeypatch):
+    """Cada teste usa um banco novo num diretório temporário."""
+    monkeypatch.chdir(tmp_path)
+    caminho_original = nucleo.CAMINHO_BD
+    nucleo.configurar_bd(str(tmp_path / 'manutencao.db'))
+    yield
+    nucleo.configurar_bd(caminho_original)
+
+
+def chamar(metodo, caminho, consulta='', corpo=b'', cabecalhos=(), pedacos=None):
+    """
+    Executa uma requisição HTTP na aplicação ASGI e devolve (status, cabeçalhos, corpo).
+    Com 'pedacos', o corpo é enviado em várias mensagens http.request, como num upload.
+    """
+    scope = {
+        'type': 'http', 'method': metodo, 'path': caminho, 'query_string': consulta.encode(),
+        'headers': [(n.encode('latin-1'), v.encode('latin-1')) for n, v in cabecalhos],
+        'http_version': '1.1', 'scheme': 'http', 'server': ('teste', 80), 'client': ('127.0.0.1', 5000),
+    }
+    pedacos = pedacos if pedacos is not None else [corpo]
+    entrada = [{'type': 'http.request', 'body': pedaco, 'more_body': i < len(pedacos) - 1}
+               for i, pedaco in enumerate(pedacos)]
+    enviadas = []
+
+    async def receive():
+        if entrada:
+            return entrada.pop(0)
+        await asyncio.Event().wait()  # o cliente continua conectado
+
+    async def send(mensagem):
+        enviadas.append(mensagem)
+
+    asyncio.run(asgi.aplicacao(scope, receive, send))
+    inicio = enviadas[0]
+    cabecalhos_resposta = {n.decode('latin-1'): v.decode('latin-1') for n, v in inicio['headers']}
+    corpo_resposta = b''.join(m.get('body', b'') for m in enviadas[1:])
+    return inicio['status'], cabecalhos_resposta, corpo_resposta
+
+
+def test_exportacao_csv():
+    for km in (1000, 2000, 3000):
+        assert nucleo.adicionar_item(dict(ITEM, km_troca=km))[0]
+    status, cabecalhos, corpo = chamar('GET', '/api/export', 'formato=csv')
+    assert status == 200
+    assert cabecalhos['content-type'].startswith('text/csv')
+    linhas = list(csv.DictReader(io.StringIO(corpo.decode('utf-8'))))
+    assert [int(linha['km_troca']) for linha in linhas] == [1000, 2000, 3000]
+    assert linhas[0]['nome'] == 'Óleo'
+
+
+def test_exportacao_ndjson():
+    assert nucleo.adicionar_item(ITEM)[0]
+    status, cabecalhos, corpo = chamar('GET', '/api/export', 'formato=ndjson')
+    assert status == 200
+    assert cabecalhos['content-type'].startswith('application/x-ndjson')
+    registros = [json.loads(linha) for linha in corpo.decode('utf-8').splitlines()]
+    assert len(registros) == 1 and registros[0]['valor'] == 35.5
+
+
+def test_exportacao_formato_invalido():
+    status, _, corpo = chamar('GET', '/api/export', 'formato=xml')
+    assert status == 400
+    assert 'Formato inválido' in json.loads(corpo)['mensagem']
+
+
+def test_importacao_em_pedacos_pelo_flask():
+    linhas = [json.dumps(dict(ITEM, km_troca=1000 + i)) + '\n' for i in range(300)]
+    pedacos = [''.join(linhas[i:i + 7]).encode('utf-8') for i in range(0, len(linhas), 7)]
+    status, _, corpo = chamar('POST', '/api/itens/lote', 'formato=ndjson', pedacos=pedacos,
+                              cabecalhos=[('content-type', 'application/x-ndjson')])
+    assert status == 201
+    assert json.loads(corpo)['inseridos'] == 300
+    assert len(nucleo.listar_itens(limite=500)[0]) == 300
+
+
+def test_flask_roda_fora_do_executor_do_banco():
+    threads = []
+    original = nucleo.app.wsgi_app
+
+    def registrar(environ, start_response):
+        threads.append(threading.current_thread().name)
+        return original(environ, start_response)
+
+    nucleo.app.wsgi_app = registrar
+    try:
+        status, _, _ = chamar('GET', '/api/itens/mudancas')
+    finally:
+        nucleo.app.wsgi_app = original
+    assert status == 200
+    assert threads and threads[0].startswith('flask')
+
+
+def test_eventos_terminam_quando_o_cliente_desconecta():
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': '/api/itens/mudancas', 'query_string': b'desde=0',
+        'headers': [(b'accept', b'text/event-stream')],
+        'http_version': '1.1', 'scheme': 'http', 'server': ('teste', 80), 'client': ('127.0.0.1', 5000),
+    }
+    enviadas = []
+
+    async def cenario():
+        desconectar = asyncio.Event()
+        entrada = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+        async def receive():
+            if entrada:
+                return entrada.pop(0)
+            await desconectar.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(mensagem):
+            # Como o uvicorn: depois da desconexão o send não falha, só é ignorado.
+            if not desconectar.is_set():
+                enviadas.append(mensagem)
+
+        tarefa = asyncio.ensure_future(asgi.aplicacao(scope, receive, send))
+        while not enviadas:
+            await asyncio.sleep(0.01)
+        desconectar.set()
+        try:
+            await asyncio.wait_for(tarefa, 2)
+        finally:
+            asgi.vigia_mudancas.parar()
+
+    asyncio.run(cenario())
+    assert enviadas[0]['status'] == 200
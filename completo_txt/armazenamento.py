@@ -0,0 +1,356 @@
+"""
+Persistência dos itens do GerenciadorManutencao.
+
+O ArmazenamentoDiario grava cada adição/remoção num diário (append-only) e, de tempos
+em tempos, compacta tudo num snapshot binário com as mesmas colunas da ColecaoItens.
+Ao iniciar, o snapshot é aberto com mmap e cada coluna é copiada em bloco para a
+coleção, sem criar um objeto por item: 1 milhão de itens carregam em poucos décimos de segundo.
+
+Garantias contra queda no meio de uma escrita:
+- cada registro do diário tem CRC32 e é gravado com fsync; um registro incompleto no
+  final do arquivo é descartado na próxima abertura;
+- cada snapshot tem nome próprio (itens-<seq>.snap), é gravado num arquivo temporário e só
+  então renomeado; na abertura vale o de maior seq, e os antigos são apagados depois;
+- os registros do diário têm número de sequência e o snapshot guarda o último que
+  contém, então uma queda entre a troca do snapshot e a limpeza do diário não duplica nada.
+
+Só um processo por vez usa o diretório: carregar() trava o arquivo itens.lock e fechar()
+o libera. Um segundo processo (ex.: o modo em lote com o menu aberto) recebe DadosEmUso
+em vez de distribuir os mesmos ids e apagar o snapshot do outro.
+"""
+import array
+import contextlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from colecao import COLUNAS, ColecaoItens
+
+ARQUIVO_SNAPSHOT = 'itens-{:016d}.snap'
+PADRAO_SNAPSHOT = re.compile(r'^itens-(\d{16})\.snap$')
+ARQUIVO_DIARIO = 'diario.log'
+ARQUIVO_TRAVA = 'itens.lock'
+COMPACTAR_A_CADA = 1000  # operações no diário antes de compactar
+
+# Cabeçalho: assinatura, versão, quantidade de itens, último seq incluído, próximo id, quantidade de nomes.
+CABECALHO = struct.Struct('<4sIQQQI4x')
+ASSINATURA = b'MNTS'
+VERSAO_SNAPSHOT = 1
+
+
+class SnapshotItens:
+    """Visão somente leitura, em colunas, de um arquivo de snapshot mapeado em memória."""
+
+    def __init__(self, caminho):
+        if sys.byteorder != 'little':
+            raise OSError("O formato de snapshot só é suportado em máquinas little-endian.")
+        self.caminho = caminho
+        with open(caminho, 'rb') as f:
+            self._mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._visao = memoryview(self._mapa)
+        assinatura, versao, self.quantidade, self.ultimo_seq, self.proximo_id, qtd_nomes = \
+            CABECALHO.unpack_from(self._mapa)
+        if assinatura != ASSINATURA or versao != VERSAO_SNAPSHOT:
+            self.fechar()
+            raise OSError(f"Arquivo de snapshot inválido: {caminho}")
+
+        self.colunas = {}
+        posicao = CABECALHO.size
+        for nome, tipo in COLUNAS:
+            tamanho = self.quantidade * struct.calcsize(tipo)
+            self.colunas[nome] = self._visao[posicao:posicao + tamanho].cast(tipo)
+            posicao += tamanho
+        tamanhos = self._visao[posicao:posicao + 4 * qtd_nomes].cast('I')
+        posicao += 4 * qtd_nomes
+        self.nomes = []
+        for tamanho in tamanhos:
+            self.nomes.append(bytes(self._visao[posicao:posicao + tamanho]).decode('utf-8'))
+            posicao += tamanho
+        tamanhos.release()
+        if posicao != len(self._mapa):
+            self.fechar()
+            raise OSError(f"Arquivo de snapshot truncado: {caminho}")
+
+    def __len__(self):
+        return self.quantidade
+
+    def fechar(self):
+        for coluna in getattr(self, 'colunas', {}).values():
+            coluna.release()
+        self._visao.release()
+        self._mapa.close()
+
+
+def gravar_snapshot(caminho, colunas, nomes, ultimo_seq, proximo_id):
+    """
+    Grava as colunas (arrays no formato de COLUNAS) e a tabela de nomes num arquivo
+    temporário no mesmo diretório e o renomeia para 'caminho' de forma atômica.
+    """
+    nomes_codificados = [nome.encode('utf-8') for nome in nomes]
+    diretorio = os.path.dirname(os.path.abspath(caminho))
+    descritor, temporario = tempfile.mkstemp(prefix='.itens-', suffix='.snap', dir=diretorio)
+    try:
+        if hasattr(os, 'fchmod'):  # não existe no Windows
+            # O mkstemp cria o arquivo só para o dono (0600); o snapshot fica com as
+            # permissões de um arquivo criado normalmente, como o diário.
+            os.fchmod(descritor, _modo_arquivo_novo())
+        with os.fdopen(descritor, 'wb') as f:
+            f.write(CABECALHO.pack(ASSINATURA, VERSAO_SNAPSHOT, len(colunas['id']),
+                                   ultimo_seq, proximo_id, len(nomes_codificados)))
+            for nome, _ in COLUNAS:
+                colunas[nome].tofile(f)
+            array.array('I', map(len, nomes_codificados)).tofile(f)
+            f.write(b''.join(nomes_codificados))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, caminho)
+    except BaseException:
+        os.unlink(temporario)
+        raise
+    _sincronizar_diretorio(diretorio)
+
+
+def _modo_arquivo_novo():
+    # O umask só pode ser lido trocando-o; ele é restaurado logo em seguida.
+    mascara = os.umask(0)
+    os.umask(mascara)
+    return 0o666 & ~mascara
+
+
+def _sincronizar_diretorio(diretorio):
+    # Garante que a troca de nome sobreviva a uma queda de energia (não existe no Windows).
+    try:
+        descritor = os.open(diretorio, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descritor)
+    except OSError:
+        pass
+    finally:
+        os.close(descritor)
+
+
+class DadosEmUso(OSError):
+    """O diretório de dados já está aberto por outro processo."""
+
+
+def _travar(caminho):
+    """Abre 'caminho' e o trava sem esperar; lança DadosEmUso se outro processo tiver a trava."""
+    arquivo = open(caminho, 'a+b')
+    try:
+        if fcntl is not None:
+            fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            arquivo.seek(0)
+            msvcrt.locking(arquivo.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        arquivo.close()
+        raise DadosEmUso(f"dados em uso por outro processo: {os.path.dirname(caminho) or '.'}")
+    return arquivo  # a trava some quando o arquivo é fechado, inclusive se o processo morrer
+
+
+class ArmazenamentoMemoria:
+    """Armazenamento que não grava nada: os itens somem quando o programa termina."""
+
+    def __init__(self):
+        self._proximo_id = 1
+
+    def carregar(self, fabrica):
+        return ColecaoItens(fabrica)
+
+    def novo_id(self):
+        id, self._proximo_id = self._proximo_id, self._proximo_id + 1
+        return id
+
+    def lote(self):
+        return contextlib.nullcontext()
+
+    def registrar_adicao(self, item):
+        pass
+
+    def registrar_remocao(self, item):
+        pass
+
+    def compactar_se_preciso(self, itens):
+        pass
+
+    def fechar(self, itens):
+        pass
+
+
+class ArmazenamentoDiario:
+    """Diário de operações + snapshot binário em 'diretorio' (veja a documentação do módulo)."""
+
+    def __init__(self, diretorio, compactar_a_cada=COMPACTAR_A_CADA):
+        self.diretorio = diretorio
+        self.compactar_a_cada = compactar_a_cada
+        self.caminho_diario = os.path.join(diretorio, ARQUIVO_DIARIO)
+        os.makedirs(diretorio, exist_ok=True)
+        self._caminho_snapshot = None
+        self._diario = None
+        self._trava = None
+        self._seq = 0
+        self._proximo_id = 1
+        self._operacoes = 0
+        self._em_lote = False
+
+    def _snapshots(self):
+        """Caminhos dos snapshots do diretório, do mais novo para o mais antigo."""
+        nomes = [nome for nome in os.listdir(self.diretorio) if PADRAO_SNAPSHOT.match(nome)]
+        return [os.path.join(self.diretorio, nome) for nome in sorted(nomes, reverse=True)]
+
+    def _apagar_snapshots_antigos(self):
+        atual = self._caminho_snapshot
+        # Inclui temporários de uma compactação interrompida por queda.
+        sobras = [os.path.join(self.diretorio, nome) for nome in os.listdir(self.diretorio)
+                  if nome.startswith('.itens-') and nome.endswith('.snap')]
+        for caminho in self._snapshots() + sobras:
+            if caminho != atual:
+                try:
+                    os.remove(caminho)
+                except OSError:
+                    pass  # ainda mapeado por outro processo (Windows); fica para a próxima vez
+
+    def carregar(self, fabrica):
+        self._trava = _travar(os.path.join(self.diretorio, ARQUIVO_TRAVA))
+        try:
+            return self._carregar(fabrica)
+        except BaseException:
+            self._liberar()
+            raise
+
+    def _liberar(self):
+        if self._trava is not None:
+            self._trava.close()
+            self._trava = None
+
+    def _carregar(self, fabrica):
+        itens = ColecaoItens(fabrica)
+        snapshots = self._snapshots()
+        if snapshots:
+            snapshot = SnapshotItens(snapshots[0])
+            try:
+                itens.carregar_colunas(snapshot.colunas, snapshot.nomes)
+                self._seq = snapshot.ultimo_seq
+                self._proximo_id = snapshot.proximo_id
+            finally:
+                snapshot.fechar()
+            self._caminho_snapshot = snapshots[0]
+            self._apagar_snapshots_antigos()
+
+        for registro in self._ler_diario():
+            if registro['seq'] <= self._seq:
+                continue  # já está no snapshot (queda entre a compactação e a limpeza do diário)
+            self._seq = registro['seq']
+            self._operacoes += 1
+            if registro['op'] == 'A':
+                itens.acrescentar(registro['id'], registro['nome'], registro['valor'], registro['data'],
+                                  registro['km_troca'], registro['km_proxima'], registro['meses'])
+                self._proximo_id = max(self._proximo_id, registro['id'] + 1)
+            elif registro['id'] in itens:
+                itens.remover(registro['id'])
+
+        self._diario = open(self.caminho_diario, 'ab')
+        return itens
+
+    def _ler_diario(self):
+        """Lê os registros válidos e corta o arquivo no primeiro registro incompleto ou corrompido."""
+        if not os.path.exists(self.caminho_diario):
+            return
+        valido = 0
+        with open(self.caminho_diario, 'rb+') as f:
+            for linha in f:
+                crc, _, conteudo = linha.rstrip(b'\n').partition(b' ')
+                try:
+                    if not linha.endswith(b'\n') or int(crc, 16) != zlib.crc32(conteudo):
+                        break
+                    registro = json.loads(conteudo)
+                except ValueError:
+                    break
+                valido += len(linha)
+                yield registro
+            if valido != f.seek(0, os.SEEK_END):
+                f.truncate(valido)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _gravar(self, registro):
+        self._seq += 1
+        registro['seq'] = self._seq
+        conteudo = json.dumps(registro, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self._diario.write(b'%08x %s\n' % (zlib.crc32(conteudo), conteudo))
+        if not self._em_lote:
+            self._diario.flush()
+            os.fsync(self._diario.fileno())
+        self._operacoes += 1
+
+    @contextlib.contextmanager
+    def lote(self):
+        """
+        Agrupa muitas operações com um único fsync no final. Se cair no meio, os registros
+        completos até ali valem e o resto do lote se perde.
+        """
+        self._em_lote = True
+        try:
+            yield
+        finally:
+            self._em_lote = False
+            self._diario.flush()
+            os.fsync(self._diario.fileno())
+
+    def novo_id(self):
+        id, self._proximo_id = self._proximo_id, self._proximo_id + 1
+        return id
+
+    def registrar_adicao(self, item):
+        self._gravar({
+            'op': 'A', 'id': item.id, 'nome': item.nome, 'valor': item.valor,
+            'data': item.data_troca.toordinal(), 'km_troca': item.km_troca,
+            'km_proxima': item.km_proxima, 'meses': item.meses_proxima,
+        })
+
+    def registrar_remocao(self, item):
+        self._gravar({'op': 'R', 'id': item.id})
+
+    def compactar_se_preciso(self, itens):
+        if self._operacoes >= self.compactar_a_cada:
+            self.compactar(itens)
+
+    def compactar(self, itens):
+        """Grava o estado atual num snapshot novo e esvazia o diário."""
+        caminho = os.path.join(self.diretorio, ARQUIVO_SNAPSHOT.format(self._seq))
+        if caminho == self._caminho_snapshot:
+            return
+        colunas, nomes = itens.exportar()
+        gravar_snapshot(caminho, colunas, nomes, self._seq, self._proximo_id)
+        self._caminho_snapshot = caminho
+        self._apagar_snapshots_antigos()
+
+        # Se cair antes daqui, os registros do diário têm seq <= ultimo_seq e são ignorados.
+        self._diario.close()
+        self._diario = open(self.caminho_diario, 'wb')
+        os.fsync(self._diario.fileno())
+        self._operacoes = 0
+
+    def fechar(self, itens):
+        if self._diario is None:
+            return
+        try:
+            if self._operacoes:
+                self.compactar(itens)
+            self._diario.close()
+            self._diario = None
+        finally:
+            self._liberar()
@@ -0,0 +1,268 @@
+"""
+Coleção de itens de manutenção guardada em colunas.
+
+Em vez de um objeto por item, cada campo fica num array compacto: nomes viram índices
+numa tabela de nomes únicos, datas viram o número do dia (date.toordinal) e os km
+ficam em arrays de inteiros. Um item custa ~50 bytes em vez de ~400 de um objeto com
+__dict__, a remoção por id é O(1) (a posição é marcada como livre e as lacunas são
+recolhidas quando passam da metade) e o cálculo das próximas trocas é feito de uma
+vez para todos os itens, com NumPy quando ele está instalado.
+"""
+import array
+import datetime
+import itertools
+import operator
+
+try:
+    import numpy as np
+except ImportError:  # NumPy é opcional; sem ele os cálculos em lote usam o módulo array
+    np = None
+
+DIAS_POR_MES = 30  # mesma aproximação usada em ManutencaoItem.__str__
+# Colunas na ordem em que aparecem no snapshot; as de 8 bytes vêm primeiro para manter o alinhamento.
+COLUNAS = (('id', 'q'), ('valor', 'd'), ('km_troca', 'q'), ('km_proxima', 'q'),
+           ('data', 'i'), ('meses', 'i'), ('nome', 'I'))
+
+
+class ColecaoItens:
+    """Itens de manutenção em colunas, na ordem em que foram adicionados."""
+
+    def __init__(self, fabrica):
+        self._fabrica = fabrica
+        self.colunas = {nome: array.array(tipo) for nome, tipo in COLUNAS}
+        self.nomes = []  # índice -> nome
+        self._indice_nome = {}  # nome -> índice
+        self._vivos = bytearray()  # 1 na posição ocupada, 0 na removida
+        self._posicoes = array.array('q')  # id - 1 -> posição, -1 se o id não está na coleção
+        self._quantidade = 0
+        self._por_nome = None  # índice do nome -> posições (montado na primeira consulta)
+        self._vencimentos = None
+        self._datas = {}
+        self._textos_data = {}
+
+    def __len__(self):
+        return self._quantidade
+
+    def __iter__(self):
+        for posicao in itertools.compress(range(len(self._vivos)), self._vivos):
+            yield self._item(posicao)
+
+    def __contains__(self, item_id):
+        return 0 < item_id <= len(self._posicoes) and self._posicoes[item_id - 1] >= 0
+
+    # --- INSERÇÃO E REMOÇÃO ---
+
+    def _indice_do_nome(self, nome):
+        indice = self._indice_nome.get(nome)
+        if indice is None:
+            indice = self._indice_nome[nome] = len(self.nomes)
+            self.nomes.append(nome)
+        return indice
+
+    def acrescentar(self, id, nome, valor, ordinal, km_troca, km_proxima, meses):
+        if id in self:
+            raise KeyError(f"Já existe um item com id {id}.")
+        c = self.colunas
+        posicao = len(self._vivos)
+        indice = self._indice_do_nome(nome)
+        c['id'].append(id)
+        c['nome'].append(indice)
+        c['valor'].append(valor)
+        c['data'].append(ordinal)
+        c['km_troca'].append(km_troca)
+        c['km_proxima'].append(km_proxima)
+        c['meses'].append(meses)
+        self._vivos.append(1)
+        if id > len(self._posicoes):
+            self._posicoes.extend(itertools.repeat(-1, id - len(self._posicoes)))
+        self._posicoes[id - 1] = posicao
+        self._quantidade += 1
+        if self._por_nome is not None:
+            self._por_nome.setdefault(indice, array.array('q')).append(posicao)
+        self._vencimentos = None
+
+    def append(self, item):
+        self.acrescentar(item.id, item.nome, item.valor, item.data_troca.toordinal(),
+                         item.km_troca, item.km_proxima, item.meses_proxima)
+
+    def carregar_colunas(self, colunas, nomes):
+        """Acrescenta de uma vez colunas no formato do snapshot (memoryviews ou arrays)."""
+        if self._vivos:
+            raise ValueError("carregar_colunas só pode ser usado numa coleção vazia.")
+        self.nomes = list(nomes)
+        self._indice_nome = {nome: i for i, nome in enumerate(self.nomes)}
+        for nome, _ in COLUNAS:
+            self.colunas[nome].frombytes(memoryview(colunas[nome]).cast('B'))
+        quantidade = len(self.colunas['id'])
+        self._vivos = bytearray(b'\x01') * quantidade
+        self._quantidade = quantidade
+        self._reindexar()
+
+    def remover(self, item_id):
+        """Remove o item pelo id em O(1) e o devolve. KeyError se o id não existir."""
+        if item_id not in self:
+            raise KeyError(item_id)
+        posicao = self._posicoes[item_id - 1]
+        item = self._item(posicao)
+        self._vivos[posicao] = 0
+        self._posicoes[item_id - 1] = -1
+        self._quantidade -= 1
+        # Recolher as lacunas só quando passam da metade mantém a remoção O(1) amortizada.
+        if len(self._vivos) > 64 and self._quantidade < len(self._vivos) // 2:
+            self._recolher_lacunas()
+        return item
+
+    def _sem_lacunas(self):
+        """Cópia das colunas só com as posições ocupadas."""
+        if np is not None:
+            vivos = np.frombuffer(self._vivos, dtype=np.bool_)
+            return {nome: array.array(tipo, np.frombuffer(self.colunas[nome], dtype=tipo)[vivos].tobytes())
+                    for nome, tipo in COLUNAS}
+        return {nome: array.array(tipo, itertools.compress(self.colunas[nome], self._vivos))
+                for nome, tipo in COLUNAS}
+
+    def _recolher_lacunas(self):
+        self.colunas = self._sem_lacunas()
+        self._vivos = bytearray(b'\x01') * self._quantidade
+        self._reindexar()
+
+    def _reindexar(self):
+        ids = self.colunas['id']
+        maior = max(ids, default=0)
+        if np is not None and ids:
+            posicoes = np.full(maior, -1, dtype=np.int64)
+            posicoes[np.frombuffer(ids, dtype=np.int64) - 1] = np.arange(len(ids), dtype=np.int64)
+            self._posicoes = array.array('q', posicoes.tobytes())
+        else:
+            self._posicoes = array.array('q', itertools.repeat(-1, maior))
+            for posicao, id in enumerate(ids):
+                self._posicoes[id - 1] = posicao
+        self._por_nome = None
+        self._vencimentos = None
+
+    # --- CONSULTAS ---
+
+    def _data(self, ordinal):
+        data = self._datas.get(ordinal)
+        if data is None:
+            data = self._datas[ordinal] = datetime.date.fromordinal(ordinal)
+        return data
+
+    def _item(self, posicao):
+        c = self.colunas
+        return self._fabrica(self.nomes[c['nome'][posicao]], c['valor'][posicao], self._data(c['data'][posicao]),
+                             c['km_troca'][posicao], c['km_proxima'][posicao], c['meses'][posicao],
+                             id=c['id'][posicao])
+
+    def item(self, item_id):
+        if item_id not in self:
+            raise KeyError(item_id)
+        return self._item(self._posicoes[item_id - 1])
+
+    def ids(self):
+        return list(itertools.compress(self.colunas['id'], self._vivos))
+
+    def ids_e_nomes(self):
+        """Pares (id, índice em self.nomes) dos itens, sem criar os objetos."""
+        return itertools.compress(zip(self.colunas['id'], self.colunas['nome']), self._vivos)
+
+    def por_nome(self, nome):
+        """Itens com exatamente este nome, pelo índice de nomes."""
+        indice = self._indice_nome.get(nome)
+        if indice is None:
+            return []
+        if self._por_nome is None:
+            self._por_nome = {}
+            for posicao, i in enumerate(self.colunas['nome']):
+                self._por_nome.setdefault(i, array.array('q')).append(posicao)
+        return [self._item(p) for p in self._por_nome.get(indice, ()) if self._vivos[p]]
+
+    def vencimentos(self):
+        """
+        (próximo km, próxima data como ordinal) de todas as posições, calculados de uma vez
+        e guardados até a próxima inserção.
+        """
+        if self._vencimentos is None:
+            c = self.colunas
+            if np is not None:
+                km = np.frombuffer(c['km_troca'], dtype=np.int64) + np.frombuffer(c['km_proxima'], dtype=np.int64)
+                datas = np.frombuffer(c['data'], dtype=np.int32) + np.frombuffer(c['meses'], dtype=np.int32) * DIAS_POR_MES
+            else:
+                km = array.array('q', map(operator.add, c['km_troca'], c['km_proxima']))
+                datas = array.array('i', (d + m * DIAS_POR_MES for d, m in zip(c['data'], c['meses'])))
+            self._vencimentos = (km, datas)
+        return self._vencimentos
+
+    def vencendo(self, km_atual=None, ate=None):
+        """Ids dos itens cuja próxima troca já chegou pelo km atual ou até a data 'ate'."""
+        km, datas = self.vencimentos()
+        if np is not None:
+            vence = np.zeros(len(self._vivos), dtype=bool)
+            if km_atual is not None:
+                vence |= km <= km_atual
+            if ate is not None:
+                vence |= datas <= ate.toordinal()
+            vence &= np.frombuffer(self._vivos, dtype=np.bool_)
+            return np.frombuffer(self.colunas['id'], dtype=np.int64)[vence].tolist()
+        limite_data = ate.toordinal() if ate is not None else None
+        return [
+            id for id, vivo, proximo_km, proxima_data in zip(self.colunas['id'], self._vivos, km, datas)
+            if vivo and ((km_atual is not None and proximo_km <= km_atual)
+                         or (limite_data is not None and proxima_data <= limite_data))
+        ]
+
+    def filtrar(self, nome=None, antes=None, km_ate=None):
+        """
+        Ids dos itens que atendem a todos os filtros informados: nome exato,
+        troca antes da data 'antes' e km da troca até 'km_ate'.
+        """
+        c = self.colunas
+        indice = None
+        if nome is not None:
+            indice = self._indice_nome.get(nome)
+            if indice is None:
+                return []
+        if np is not None:
+            mascara = np.frombuffer(self._vivos, dtype=np.bool_).copy()
+            if indice is not None:
+                mascara &= np.frombuffer(c['nome'], dtype=np.uint32) == indice
+            if antes is not None:
+                mascara &= np.frombuffer(c['data'], dtype=np.int32) < antes.toordinal()
+            if km_ate is not None:
+                mascara &= np.frombuffer(c['km_troca'], dtype=np.int64) <= km_ate
+            return np.frombuffer(c['id'], dtype=np.int64)[mascara].tolist()
+        limite_data = antes.toordinal() if antes is not None else None
+        return [
+            id for id, vivo, i, data, km in zip(c['id'], self._vivos, c['nome'], c['data'], c['km_troca'])
+            if vivo and (indice is None or i == indice) and (limite_data is None or data < limite_data)
+            and (km_ate is None or km <= km_ate)
+        ]
+
+    def _texto_data(self, ordinal):
+        texto = self._textos_data.get(ordinal)
+        if texto is None:
+            texto = self._textos_data[ordinal] = self._data(ordinal).strftime('%d/%m/%Y')
+        return texto
+
+    def linhas_relatorio(self):
+        """O mesmo texto de str(item) para cada item, sem criar os objetos."""
+        c = self.colunas
+        km, datas = self.vencimentos()
+        if np is not None:
+            km, datas = km.tolist(), datas.tolist()
+        colunas = zip(self._vivos, c['nome'], c['valor'], c['data'], c['km_troca'], km, datas)
+        for vivo, nome, valor, data, km_troca, proximo_km, proxima_data in colunas:
+            if vivo:
+                yield (
+                    f"--- {self.nomes[nome]} ---\n"
+                    f"Valor: R$ {valor:.2f}\n"
+                    f"Data da troca: {self._texto_data(data)}\n"
+                    f"KM da troca: {km_troca} km\n"
+                    f"Próxima troca recomendada: {proximo_km} km ou {self._texto_data(proxima_data)}\n"
+                )
+
+    def exportar(self):
+        """Colunas sem as posições removidas e a tabela de nomes, prontas para o snapshot."""
+        if self._quantidade == len(self._vivos):
+            return self.colunas, self.nomes
+        return self._sem_lacunas(), self.nomes
@@ -9,6 +9,11 @@ import os
 # Começamos a criar um "molde" ou "receita de bolo" para um item de manutenção.
 # Cada vez que você adiciona uma peça, o programa usa este molde para criar um objeto.
 class ManutencaoItem:
+    # '__slots__' lista os únicos atributos que um item pode ter. Assim o Python não cria
+    # um dicionário ('__dict__') para cada objeto, e cada item ocupa bem menos memória.
+    # Isso faz diferença quando o histórico tem milhares de peças.
+    __slots__ = ('nome', 'valor', 'data_troca', 'km_troca', 'km_proxima', 'meses_proxima')
+
     # Este método, chamado '__init__', é o "construtor". Ele é a primeira coisa que roda
     # quando criamos um novo item. Ele pega as informações que você digitou (nome, valor, etc.)
     # e as armazena dentro do objeto que acabou de ser criado.
@@ -1,8 +1,66 @@
+import argparse
+import csv
 import datetime
+import io
+import json
 import os
+import sys
+
+from armazenamento import ArmazenamentoDiario, ArmazenamentoMemoria, DadosEmUso
+
+DIRETORIO_DADOS = "dados_manutencao"
+FORMATO_DATA = '%d/%m/%Y'
+CAMPOS = ('nome', 'valor', 'data_troca', 'km_troca', 'km_proxima', 'meses_proxima')
+
+def ler_data(texto):
+    # Atalho para o caso comum 'DD/MM/AAAA'; o resto (ex.: '1/2/2024') segue pelo strptime.
+    if len(texto) == 10 and texto[2] == texto[5] == '/' and texto.isascii() \
+            and texto[:2].isdigit() and texto[3:5].isdigit() and texto[6:].isdigit():
+        return datetime.date(int(texto[6:]), int(texto[3:5]), int(texto[:2]))
+    return datetime.datetime.strptime(texto, FORMATO_DATA).date()
+
+def converter_item(registro):
+    # Mesmas conversões do adicionar_item interativo; os valores chegam como texto (CSV) ou JSON.
+    if not isinstance(registro, dict):
+        raise ValueError("registro não é um objeto com os campos do item")
+    textos = []
+    for campo in CAMPOS:
+        valor = registro.get(campo)
+        if valor is None:
+            raise ValueError(f"campo ausente: {campo}")
+        textos.append(valor if isinstance(valor, str) else str(valor))
+    nome, valor, data_troca, km_troca, km_proxima, meses_proxima = textos
+    return nome, float(valor), ler_data(data_troca), int(km_troca), int(km_proxima), int(meses_proxima)
+
+def ler_csv(arquivo):
+    leitor = csv.DictReader(arquivo)
+    for registro in leitor:
+        yield leitor.line_num, registro
+
+def ler_ndjson(arquivo):
+    for numero, linha in enumerate(arquivo, 1):
+        if not linha.strip():
+            continue
+        try:
+            yield numero, json.loads(linha)
+        except ValueError:
+            yield numero, None
+
+LEITORES = {'csv': ler_csv, 'ndjson': ler_ndjson}
+
+def escrever_relatorio(arquivo, textos):
+    arquivo.write("RELATÓRIO DE MANUTENÇÃO\n")
+    arquivo.write("=" * 25 + "\n\n")
+    for texto in textos:
+        arquivo.write(texto + "\n")
+        arquivo.write("-" * 25 + "\n")
 
 class ManutencaoItem:
-    def __init__(self, nome, valor, data_troca, km_troca, km_proxima, meses_proxima):
+    # Sem __dict__ por instância; as coleções grandes ficam em colunas (ColecaoItens).
+    __slots__ = ('id', 'nome', 'valor', 'data_troca', 'km_troca', 'km_proxima', 'meses_proxima')
+
+    def __init__(self, nome, valor, data_troca, km_troca, km_proxima, meses_proxima, id=None):
+        self.id = id
         self.nome = nome
         self.valor = valor
         self.data_troca = data_troca
@@ -22,8 +80,10 @@ class ManutencaoItem:
         )
 
 class GerenciadorManutencao:
-    def __init__(self):
-        self.itens = []
+    def __init__(self, armazenamento=None):
+        # Sem armazenamento os itens ficam só em memória, como antes.
+        self.armazenamento = armazenamento if armazenamento is not None else ArmazenamentoMemoria()
+        self.itens = self.armazenamento.carregar(ManutencaoItem)
         self.diretorio_relatorios = "relatorios_manutencao"
         if not os.path.exists(self.diretorio_relatorios):
             os.makedirs(self.diretorio_relatorios)
@@ -33,16 +93,51 @@ class GerenciadorManutencao:
             nome = input("Digite o nome da peça/item: ")
             valor = float(input("Digite o valor da peça/item (Ex: 50.00): "))
             data_troca_str = input("Digite a data da troca (DD/MM/AAAA): ")
-            data_troca = datetime.datetime.strptime(data_troca_str, '%d/%m/%Y').date()
+            data_troca = ler_data(data_troca_str)
             km_troca = int(input("Digite a KM atual da moto na troca: "))
             km_proxima = int(input("Com quantos KM a peça deve ser trocada novamente? (Ex: 2000): "))
             meses_proxima = int(input("Em quantos meses a peça deve ser trocada novamente? (Ex: 12): "))
 
-            item = ManutencaoItem(nome, valor, data_troca, km_troca, km_proxima, meses_proxima)
+            item = ManutencaoItem(nome, valor, data_troca, km_troca, km_proxima, meses_proxima,
+                                  id=self.armazenamento.novo_id())
+            self.armazenamento.registrar_adicao(item)
             self.itens.append(item)
+            self.armazenamento.compactar_se_preciso(self.itens)
             print("\nItem adicionado com sucesso!\n")
         except ValueError:
             print("\nErro: Formato de entrada inválido. Tente novamente.\n")
+        except OSError as e:
+            print(f"\nErro ao gravar o item: {e}\n")
+
+    def adicionar_em_lote(self, registros, ao_errar=None):
+        # 'registros' é um iterável de (número da linha, registro); nada é lido antes da hora.
+        adicionados = erros = 0
+        with self.armazenamento.lote():
+            for numero, registro in registros:
+                try:
+                    campos = converter_item(registro)
+                except ValueError as e:
+                    erros += 1
+                    if ao_errar:
+                        ao_errar(numero, e)
+                    continue
+                item = ManutencaoItem(*campos, id=self.armazenamento.novo_id())
+                self.armazenamento.registrar_adicao(item)
+                self.itens.append(item)
+                adicionados += 1
+        self.armazenamento.compactar_se_preciso(self.itens)
+        return adicionados, erros
+
+    def remover_em_lote(self, ids):
+        removidos = 0
+        with self.armazenamento.lote():
+            for item_id in ids:
+                if item_id in self.itens:
+                    self.armazenamento.registrar_remocao(self.itens.item(item_id))
+                    self.itens.remover(item_id)
+                    removidos += 1
+        self.armazenamento.compactar_se_preciso(self.itens)
+        return removidos
 
     def remover_item(self):
         if not self.itens:
@@ -50,18 +145,24 @@ class GerenciadorManutencao:
             return
 
         print("\n--- Itens para Remoção ---")
-        for i, item in enumerate(self.itens):
-            print(f"[{i}] {item.nome}")
+        nomes = self.itens.nomes
+        for item_id, indice_nome in self.itens.ids_e_nomes():
+            print(f"ID {item_id}: {nomes[indice_nome]}")
 
         try:
-            indice = int(input("\nDigite o número do item que deseja remover: "))
-            if 0 <= indice < len(self.itens):
-                item_removido = self.itens.pop(indice)
+            item_id = int(input("\nDigite o ID do item que deseja remover: "))
+            if item_id in self.itens:
+                item_removido = self.itens.item(item_id)
+                self.armazenamento.registrar_remocao(item_removido)
+                self.itens.remover(item_id)
+                self.armazenamento.compactar_se_preciso(self.itens)
                 print(f"\nItem '{item_removido.nome}' removido com sucesso!\n")
             else:
-                print("\nÍndice inválido.\n")
+                print(f"\nNenhum item com o ID {item_id}.\n")
         except ValueError:
-            print("\nErro: Digite um número válido.\n")
+            print("\nErro: Digite um ID válido (número inteiro).\n")
+        except OSError as e:
+            print(f"\nErro ao gravar a remoção: {e}\n")
 
     def gerar_relatorio_tela(self):
         if not self.itens:
@@ -69,25 +170,23 @@ class GerenciadorManutencao:
             return
 
         print("\n--- Relatório de Manutenção ---\n")
-        for item in self.itens:
-            print(item)
+        for texto in self.itens.linhas_relatorio():
+            print(texto)
             print("-" * 25)
 
+    def caminho_relatorio(self):
+        data_hoje = datetime.date.today().strftime("%Y-%m-%d")
+        return os.path.join(self.diretorio_relatorios, f"relatorio_{data_hoje}.txt")
+
     def gerar_relatorio_txt(self):
         if not self.itens:
             print("\nNenhum item para gerar relatório.\n")
             return
 
-        data_hoje = datetime.date.today().strftime("%Y-%m-%d")
-        nome_arquivo = os.path.join(self.diretorio_relatorios, f"relatorio_{data_hoje}.txt")
-        
+        nome_arquivo = self.caminho_relatorio()
         with open(nome_arquivo, 'w', encoding='utf-8') as f:
-            f.write("RELATÓRIO DE MANUTENÇÃO\n")
-            f.write("=" * 25 + "\n\n")
-            for item in self.itens:
-                f.write(str(item) + "\n")
-                f.write("-" * 25 + "\n")
-        
+            escrever_relatorio(f, self.itens.linhas_relatorio())
+
         print(f"\nRelatório salvo com sucesso em: {nome_arquivo}\n")
 
     def exibir_menu(self):
@@ -110,11 +209,113 @@ class GerenciadorManutencao:
             elif escolha == '4':
                 self.gerar_relatorio_txt()
             elif escolha == '5':
+                self.armazenamento.fechar(self.itens)
                 print("Saindo do programa. Até a próxima!")
                 break
             else:
                 print("\nOpção inválida. Por favor, tente novamente.\n")
 
+def _abrir_entrada(caminho):
+    if caminho == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+    return open(caminho, encoding='utf-8-sig', newline='')
+
+def _formato(args):
+    if args.formato:
+        return args.formato
+    extensao = os.path.splitext(args.arquivo)[1].lower()
+    return 'ndjson' if extensao in ('.ndjson', '.jsonl') else 'csv'
+
+def _avisar_erro(numero, erro):
+    print(f"linha {numero}: {erro}", file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Controle de manutenção veicular. Sem comando, abre o menu interativo.")
+    parser.add_argument('--dados', default=DIRETORIO_DADOS, help=f"diretório dos dados (padrão: {DIRETORIO_DADOS})")
+    comandos = parser.add_subparsers(dest='comando')
+
+    adicionar = comandos.add_parser('adicionar', help="adiciona itens de um arquivo CSV/NDJSON ou da entrada padrão")
+    adicionar.add_argument('arquivo', nargs='?', default='-', help="arquivo de entrada ('-' = entrada padrão)")
+    adicionar.add_argument('--formato', choices=sorted(LEITORES), help="padrão: pela extensão, ou csv")
+
+    remover = comandos.add_parser('remover', help="remove os itens que atendem a todos os filtros")
+    remover.add_argument('--id', type=int, nargs='+', help="ids dos itens")
+    remover.add_argument('--nome', help="nome exato da peça/item")
+    remover.add_argument('--antes', type=ler_data, help="troca antes de DD/MM/AAAA")
+    remover.add_argument('--km-ate', type=int, help="km da troca menor ou igual a este")
+
+    relatorio = comandos.add_parser('relatorio', help="grava o relatório de texto")
+    relatorio.add_argument('--saida', help="arquivo de saída ('-' = saída padrão); padrão: relatorios_manutencao/")
+    relatorio.add_argument('--entrada', dest='arquivo',
+                           help="monta o relatório direto de um CSV/NDJSON ('-' = entrada padrão), sem gravar os itens")
+    relatorio.add_argument('--formato', choices=sorted(LEITORES), help="formato de --entrada")
+    args = parser.parse_args(argv)
+
+    if args.comando is None:
+        try:
+            gerenciador = GerenciadorManutencao(ArmazenamentoDiario(args.dados))
+        except DadosEmUso as e:
+            print(f"Erro: {e}.", file=sys.stderr)
+            return 1
+        gerenciador.exibir_menu()
+        return 0
+
+    if args.comando == 'relatorio' and args.arquivo:
+        # Cada item é lido, formatado e escrito em seguida: a memória não cresce com a entrada.
+        erros = []
+
+        def textos():
+            with _abrir_entrada(args.arquivo) as entrada:
+                for numero, registro in LEITORES[_formato(args)](entrada):
+                    try:
+                        yield str(ManutencaoItem(*converter_item(registro)))
+                    except ValueError as e:
+                        erros.append(numero)
+                        _avisar_erro(numero, e)
+
+        if args.saida == '-':
+            escrever_relatorio(sys.stdout, textos())
+        else:
+            saida = args.saida or GerenciadorManutencao().caminho_relatorio()
+            with open(saida, 'w', encoding='utf-8') as f:
+                escrever_relatorio(f, textos())
+        return 1 if erros else 0
+
+    armazenamento = ArmazenamentoDiario(args.dados)
+    try:
+        gerenciador = GerenciadorManutencao(armazenamento)
+    except DadosEmUso as e:
+        # Outra sessão (o menu, por exemplo) está com os dados abertos; seguir em frente
+        # faria as duas sobrescreverem o estado uma da outra.
+        print(f"Erro: {e}. Nada foi alterado.", file=sys.stderr)
+        return 1
+    codigo = 0
+    try:
+        if args.comando == 'adicionar':
+            with _abrir_entrada(args.arquivo) as entrada:
+                adicionados, erros = gerenciador.adicionar_em_lote(
+                    LEITORES[_formato(args)](entrada), _avisar_erro)
+            print(f"{adicionados} itens adicionados, {erros} linhas com erro.", file=sys.stderr)
+            codigo = 1 if erros else 0
+        elif args.comando == 'remover':
+            if args.id is None and args.nome is None and args.antes is None and args.km_ate is None:
+                parser.error("informe ao menos um filtro (--id, --nome, --antes ou --km-ate)")
+            ids = gerenciador.itens.filtrar(args.nome, args.antes, args.km_ate)
+            if args.id is not None:
+                ids = sorted(set(ids) & set(args.id))
+            print(f"{gerenciador.remover_em_lote(ids)} itens removidos.", file=sys.stderr)
+        elif args.comando == 'relatorio':
+            if args.saida == '-':
+                escrever_relatorio(sys.stdout, gerenciador.itens.linhas_relatorio())
+            else:
+                saida = args.saida or gerenciador.caminho_relatorio()
+                with open(saida, 'w', encoding='utf-8') as f:
+                    escrever_relatorio(f, gerenciador.itens.linhas_relatorio())
+                print(f"Relatório salvo em: {saida}", file=sys.stderr)
+    finally:
+        armazenamento.fechar(gerenciador.itens)
+    return codigo
+
 if __name__ == "__main__":
-    gerenciador = GerenciadorManutencao()
-    gerenciador.exibir_menu()
\ No newline at end of file
+    sys.exit(main())